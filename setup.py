@@ -24,6 +24,11 @@ with (ts_client_dir / "__init__.py").open() as f:
 
 def find_bundled_files() -> Iterable[str]:
     yield str(ts_client_dir / "py.typed")
+    # generated by update_bundled.py
+    for name in ("typeshed.zip", "typeshed.symbols"):
+        path = ts_client_dir / name
+        if path.exists():
+            yield str(path)
     for root, _, files in os.walk(typeshed_dir):
         root_path = Path(root)
         for file in files:
@@ -1,19 +1,31 @@
 import ast
+import asyncio
+import errno
+import json
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, ClassVar, Optional
 from unittest import mock
 
 import typeshed_client
+from typeshed_client import aio, availability, finder, scanner, symbol_index, watcher
 from typeshed_client.finder import (
     ModulePath,
     PythonVersion,
     SearchContext,
+    build_module_index,
+    get_module_index,
     get_search_context,
     get_stub_file,
 )
-from typeshed_client.parser import get_stub_names
+from typeshed_client.parser import get_stub_names, get_stub_names_from_file
 
 TEST_TYPESHED = Path(__file__).parent / "typeshed"
 PACKAGES = Path(__file__).parent / "site-packages"
@@ -32,6 +44,21 @@ def get_context(
     )
 
 
+def resolved_targets(
+    module_name: ModulePath, resolved: typeshed_client.resolver.ResolvedName
+) -> list[typeshed_client.ImportedName]:
+    """Describe a resolved name like NameAvailability.resolved does."""
+    if isinstance(resolved, typeshed_client.ImportedInfo):
+        return [
+            typeshed_client.ImportedName(resolved.source_module, resolved.info.name)
+        ]
+    if isinstance(resolved, typeshed_client.NameInfo):
+        return [typeshed_client.ImportedName(module_name, resolved.name)]
+    if isinstance(resolved, tuple) and all(isinstance(part, str) for part in resolved):
+        return [typeshed_client.ImportedName(ModulePath(resolved))]
+    return []
+
+
 @unittest.skipUnless(HAS_TEST_FIXTURES, "test fixtures are not shipped in the sdist")
 class TestFinder(unittest.TestCase):
     def check(
@@ -67,6 +94,190 @@ class TestFinder(unittest.TestCase):
         self.check("usedotpy", (3, 6), PACKAGES / "usedotpy/__init__.py")
         self.check("usedotpy", (3, 6), None, allow_py_files=False)
 
+    def test_module_index(self) -> None:
+        modules = [
+            "lib",
+            "py2only",
+            "new37",
+            "subdir",
+            "subdir.overloads",
+            "subdir.subsubdir",
+            "subdir.subsubdir.sibling",
+            "thirdparty",
+            "nostubs",
+            "usedotpy",
+            "usedotpy.stub",
+            "nosuchmodule",
+            "lib.nosuchmodule",
+        ]
+        for version in [(2, 7), (3, 5), (3, 6), (3, 7)]:
+            for allow_py_files in (True, False):
+                ctx = get_context(version, allow_py_files=allow_py_files)
+                indexed_ctx = ctx._replace(module_index=build_module_index(ctx))
+                for module in modules:
+                    with self.subTest(module, version=version, py=allow_py_files):
+                        self.assertEqual(
+                            get_stub_file(module, search_context=indexed_ctx),
+                            get_stub_file(module, search_context=ctx),
+                        )
+
+    def test_finder(self) -> None:
+        for version in [(2, 7), (3, 5), (3, 7)]:
+            ctx = get_context(version)
+            stub_finder = finder.Finder(ctx)
+            self.assertIn("lib", stub_finder.typeshed_modules)
+            self.assertEqual(
+                "simple" in stub_finder.typeshed_modules, version >= (3, 5)
+            )
+            self.assertEqual("new37" in stub_finder.typeshed_modules, version >= (3, 7))
+            for module in ["lib", "new37", "subdir.overloads", "thirdparty", "nope"]:
+                with self.subTest(module, version=version):
+                    module_path = ModulePath(tuple(module.split(".")))
+                    self.assertEqual(
+                        stub_finder.find(module_path),
+                        get_stub_file(module, search_context=ctx),
+                    )
+
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            ctx = get_search_context(typeshed=TEST_TYPESHED, search_path=[temp_dir])
+            stub_finder = finder.Finder(ctx)
+            module_path = ModulePath(("newpkg",))
+            self.assertIsNone(stub_finder.find(module_path))
+            self.assertFalse(finder.may_have_submodules(module_path, ctx))
+            (temp_dir / "newpkg").mkdir()
+            (temp_dir / "newpkg" / "__init__.pyi").touch()
+            # results are memoized until the finder is invalidated, but the free
+            # functions always search the file system
+            self.assertIsNone(stub_finder.find(module_path))
+            self.assertEqual(
+                finder.get_stub_file_name(module_path, ctx),
+                temp_dir / "newpkg" / "__init__.pyi",
+            )
+            self.assertTrue(finder.may_have_submodules(module_path, ctx))
+            stub_finder.invalidate()
+            self.assertEqual(
+                stub_finder.find(module_path), temp_dir / "newpkg" / "__init__.pyi"
+            )
+
+    def test_listing_cache(self) -> None:
+        listing_cache = finder.DirectoryListingCache(maxsize=3)
+        for version in [(2, 7), (3, 6), (3, 7)]:
+            ctx = get_context(version)
+            cached_ctx = ctx._replace(listing_cache=listing_cache)
+            for module in ["lib", "new37", "subdir.overloads", "thirdparty", "nope"]:
+                with self.subTest(module, version=version):
+                    self.assertEqual(
+                        get_stub_file(module, search_context=cached_ctx),
+                        get_stub_file(module, search_context=ctx),
+                    )
+        self.assertLessEqual(len(listing_cache._listings), 3)
+
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            ctx = get_search_context(
+                typeshed=TEST_TYPESHED,
+                search_path=[temp_dir],
+                listing_cache=finder.DirectoryListingCache(),
+            )
+            self.assertIsNone(get_stub_file("newpkg", search_context=ctx))
+            (temp_dir / "newpkg").mkdir()
+            (temp_dir / "newpkg" / "__init__.pyi").touch()
+            self.assertIsNone(get_stub_file("newpkg", search_context=ctx))
+            assert ctx.listing_cache is not None
+            ctx.listing_cache.invalidate(temp_dir)
+            self.assertEqual(
+                get_stub_file("newpkg", search_context=ctx),
+                temp_dir / "newpkg" / "__init__.pyi",
+            )
+
+    def test_persistent_module_index(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            site_packages = temp_dir / "site-packages"
+            shutil.copytree(PACKAGES, site_packages)
+            cache_dir = temp_dir / "cache"
+            ctx = get_search_context(
+                version=(3, 6),
+                typeshed=TEST_TYPESHED,
+                search_path=[site_packages],
+                cache_dir=cache_dir,
+            )
+            assert ctx.module_index is not None
+            self.assertEqual(len(list(cache_dir.iterdir())), 1)
+            self.assertEqual(
+                get_stub_file("nostubs", search_context=ctx),
+                site_packages / "nostubs/__init__.pyi",
+            )
+            self.assertIsNone(get_stub_file("newpkg", search_context=ctx))
+
+            index = get_module_index(ctx, cache_dir)
+            self.assertIsNot(index, ctx.module_index)
+            self.assertEqual(index.modules, ctx.module_index.modules)
+            self.assertFalse(index.is_stale())
+
+            (site_packages / "newpkg").mkdir()
+            (site_packages / "newpkg" / "__init__.pyi").touch()
+            # Make sure the change is visible on file systems with coarse timestamps
+            os.utime(site_packages, ns=(0, 0))
+            self.assertTrue(index.is_stale())
+            index = get_module_index(ctx, cache_dir)
+            self.assertEqual(
+                index.find(ModulePath(("newpkg",))),
+                site_packages / "newpkg/__init__.pyi",
+            )
+
+    def test_sys_path_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            site_packages = temp_dir / "site-packages"
+            site_packages.mkdir()
+            cache_dir = temp_dir / "cache"
+            raw_path = json.dumps(["", str(site_packages)]).encode()
+
+            with (
+                mock.patch.dict(finder._sys_path_cache, clear=True),
+                mock.patch(
+                    "subprocess.check_output", return_value=raw_path
+                ) as check_output,
+            ):
+                for _ in range(2):
+                    ctx = get_search_context(
+                        python_executable=sys.executable, cache_dir=cache_dir
+                    )
+                    self.assertEqual(ctx.search_path, [site_packages])
+                self.assertEqual(check_output.call_count, 1)
+
+                # Use the on-disk cache in a fresh process
+                finder._sys_path_cache.clear()
+                get_search_context(
+                    python_executable=sys.executable, cache_dir=cache_dir
+                )
+                self.assertEqual(check_output.call_count, 1)
+
+                # Installing a .pth file invalidates the cache
+                (site_packages / "extra.pth").write_text("/somewhere\n")
+                os.utime(site_packages, ns=(0, 0))
+                get_search_context(
+                    python_executable=sys.executable, cache_dir=cache_dir
+                )
+                self.assertEqual(check_output.call_count, 2)
+
+                # Bare names are looked up on PATH, so different interpreters with
+                # the same name are cached separately
+                for index in range(2):
+                    bin_dir = temp_dir / f"bin{index}"
+                    bin_dir.mkdir()
+                    (bin_dir / "python-for-test").symlink_to(sys.executable)
+                    with mock.patch.dict(os.environ, {"PATH": str(bin_dir)}):
+                        for _ in range(2):
+                            get_search_context(python_executable="python-for-test")
+                    self.assertEqual(check_output.call_count, 3 + index)
+                    self.assertEqual(
+                        check_output.call_args.args[0][0],
+                        str(bin_dir / "python-for-test"),
+                    )
+
     def test_get_all_stub_files(self) -> None:
         all_stubs = typeshed_client.get_all_stub_files(get_context((2, 7)))
         self.assertEqual(
@@ -83,6 +294,124 @@ class TestFinder(unittest.TestCase):
             },
         )
 
+    def test_packed_typeshed(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            archive = Path(temp_dir_str) / "typeshed.zip"
+            finder.pack_typeshed(TEST_TYPESHED, archive)
+            for version in [(2, 7), (3, 6), (3, 7)]:
+                ctx = get_context(version)
+                packed_ctx = ctx._replace(typeshed=archive)
+                for module in ["lib", "py2only", "new37", "subdir.overloads", "nope"]:
+                    with self.subTest(module, version=version):
+                        path = get_stub_file(module, search_context=ctx)
+                        packed_path = get_stub_file(module, search_context=packed_ctx)
+                        if path is None:
+                            self.assertIsNone(packed_path)
+                        else:
+                            self.assertEqual(
+                                packed_path, archive / path.relative_to(TEST_TYPESHED)
+                            )
+                self.assertEqual(
+                    {
+                        (name, path.relative_to(archive))
+                        for name, path in typeshed_client.get_all_stub_files(packed_ctx)
+                        if archive in path.parents
+                    },
+                    {
+                        (name, path.relative_to(TEST_TYPESHED))
+                        for name, path in typeshed_client.get_all_stub_files(ctx)
+                        if TEST_TYPESHED in path.parents
+                    },
+                )
+
+            packed_ctx = get_context((3, 10))._replace(typeshed=archive)
+            names = get_stub_names("starimportall", search_context=packed_ctx)
+            assert names is not None
+            self.assertEqual(set(names), {"a", "b", "c", "f", "h", "n"})
+
+    def test_archive_routing(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            typeshed = temp_dir / "typeshed"
+            typeshed.mkdir()
+            (typeshed / "VERSIONS").write_text("first: 3.0-\nsecond: 3.0-\n")
+            (typeshed / "first.pyi").write_text("x: int\n")
+            archive = temp_dir / "typeshed.zip"
+            finder.pack_typeshed(typeshed, archive)
+            ctx = get_context((3, 10))._replace(typeshed=archive)
+            self.assertEqual(
+                get_stub_file("first", search_context=ctx), archive / "first.pyi"
+            )
+            self.assertIsNone(get_stub_file("second", search_context=ctx))
+
+            # repacking replaces the open archive
+            (typeshed / "second.pyi").write_text("y: int\n")
+            finder.pack_typeshed(typeshed, archive)
+            self.assertEqual(
+                get_stub_file("second", search_context=ctx), archive / "second.pyi"
+            )
+
+            # other zip files are not looked into
+            other_archive = temp_dir / "stubs.zip"
+            finder.pack_typeshed(typeshed, other_archive)
+            ctx = get_context((3, 10))._replace(search_path=[other_archive])
+            self.assertFalse(finder.safe_is_dir(other_archive))
+            self.assertIsNone(get_stub_file("first", search_context=ctx))
+
+    def test_ast_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            first = temp_dir / "first.pyi"
+            second = temp_dir / "second.pyi"
+            first.write_text("x: int\n")
+            second.write_text("y: int\n")
+            cache = finder.ASTCache(maxsize=1)
+            tree = cache.parse(first)
+            self.assertIs(cache.parse(first), tree)
+            self.assertEqual(cache.stats(), finder.ASTCacheStats(1, 1, 0, 1, 7))
+
+            # edited files are parsed again
+            first.write_text("x: str\n")
+            os.utime(first, ns=(0, 0))
+            self.assertEqual(
+                ast.dump(cache.parse(first)), ast.dump(ast.parse("x: str"))
+            )
+            self.assertEqual(cache.stats(), finder.ASTCacheStats(1, 2, 0, 1, 7))
+
+            # the least recently used tree is evicted
+            cache.parse(second)
+            self.assertEqual(cache.stats(), finder.ASTCacheStats(1, 3, 1, 1, 7))
+            cache.max_bytes = 3
+            cache.parse(first)
+            self.assertEqual(cache.stats(), finder.ASTCacheStats(1, 4, 3, 0, 0))
+
+        self.assertEqual(finder.ASTCache().max_bytes, 1 << 20)
+        ctx = get_context((3, 5))
+        path = get_stub_file("simple", search_context=ctx)
+        assert path is not None
+        self.assertIs(finder._parse_stub_file(path), finder._parse_stub_file(path))
+
+        # the public functions return trees the caller may modify
+        self.assertIsNot(finder.parse_stub_file(path), finder.parse_stub_file(path))
+        tree = typeshed_client.get_stub_ast("simple", search_context=ctx)
+        assert tree is not None
+        tree.body.clear()
+        again = typeshed_client.get_stub_ast("simple", search_context=ctx)
+        assert again is not None
+        self.assertNotEqual(again.body, [])
+        names = get_stub_names("simple", search_context=ctx)
+        assert names is not None
+        self.assertIsInstance(names["func"].ast, ast.FunctionDef)
+
+    def test_get_all_stub_files_parallel(self) -> None:
+        for version in [(2, 7), (3, 6), (3, 12)]:
+            ctx = get_context(version)
+            with self.subTest(version=version):
+                self.assertEqual(
+                    list(typeshed_client.get_all_stub_files(ctx, max_workers=4)),
+                    list(typeshed_client.get_all_stub_files(ctx)),
+                )
+
 
 @unittest.skipUnless(HAS_TEST_FIXTURES, "test fixtures are not shipped in the sdist")
 class TestParser(unittest.TestCase):
@@ -188,6 +517,51 @@ class TestParser(unittest.TestCase):
         path = typeshed_client.ModulePath(("about",))
         self.assertEqual(names["x"].ast, typeshed_client.ImportedName(path, "x"))
 
+    def test_starimport_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            for module, source in [
+                ("first", "from second import *\n"),
+                ("second", "from third import *\n"),
+                ("third", "x: int\n"),
+            ]:
+                (temp_dir / module).mkdir()
+                (temp_dir / module / "__init__.pyi").write_text(source)
+            ctx = get_search_context(typeshed=TEST_TYPESHED, search_path=[temp_dir])
+            with mock.patch(
+                "typeshed_client.parser.get_stub_names_from_file",
+                wraps=get_stub_names_from_file,
+            ) as mock_get_stub_names:
+                for _ in range(3):
+                    names = get_stub_names("first", search_context=ctx)
+                    assert names is not None
+                    self.assertEqual(set(names), {"x"})
+            # the star-imported modules are only parsed the first time
+            self.assertEqual(
+                [call.args[0] for call in mock_get_stub_names.call_args_list],
+                ["first", "second", "third", "first", "first"],
+            )
+
+            # changes to stubs that are star-imported indirectly are seen
+            (temp_dir / "third" / "__init__.pyi").write_text("x: int\ny: int\n")
+            names = get_stub_names("first", search_context=ctx)
+            assert names is not None
+            self.assertEqual(set(names), {"x", "y"})
+
+            # cycles are reported instead of recursing forever
+            (temp_dir / "third" / "__init__.pyi").write_text(
+                "from first import *\nz: int\n"
+            )
+            with self.assertLogs("typeshed_client.parser", "WARNING") as logs:
+                names = get_stub_names("first", search_context=ctx)
+            assert names is not None
+            self.assertEqual(set(names), {"z"})
+            self.assertIn("cyclic import * of second", logs.output[0])
+            with self.assertRaises(typeshed_client.InvalidStub):
+                get_stub_names(
+                    "first", search_context=ctx._replace(raise_on_warnings=True)
+                )
+
     def test_dot_import(self) -> None:
         ctx = get_context((3, 5))
         for mod in (
@@ -227,6 +601,423 @@ class TestParser(unittest.TestCase):
         self.check_nameinfo(names, "Generic", ast.TypeAlias)
         self.check_nameinfo(names, "_Private", ast.TypeAlias, is_exported=False)
 
+    def test_symbol_tables(self) -> None:
+        def dump(node: object) -> object:
+            if isinstance(node, typeshed_client.OverloadedName):
+                return [dump(defn) for defn in node.definitions]
+            return ast.dump(node) if isinstance(node, ast.AST) else node
+
+        def normalize(names: typeshed_client.NameDict) -> dict[str, Any]:
+            return {
+                name: (
+                    info.is_exported,
+                    dump(info.ast),
+                    None if info.child_nodes is None else normalize(info.child_nodes),
+                )
+                for name, info in names.items()
+            }
+
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            typeshed = Path(temp_dir_str) / "typeshed"
+            shutil.copytree(TEST_TYPESHED, typeshed)
+            self.assertEqual(
+                typeshed_client.parser.write_symbol_tables(typeshed),
+                Path(temp_dir_str) / "typeshed.symbols",
+            )
+            for version, platform in [
+                ((2, 7), "linux"),
+                ((3, 6), "linux"),
+                ((3, 6), "flat"),
+                ((3, 11), "win32"),
+            ]:
+                ctx = get_context(version, platform)
+                precompiled_ctx = ctx._replace(typeshed=typeshed)
+                for module, _ in typeshed_client.get_all_stub_files(ctx):
+                    with self.subTest(module, version=version, platform=platform):
+                        names = get_stub_names(module, search_context=ctx)
+                        precompiled = get_stub_names(
+                            module, search_context=precompiled_ctx
+                        )
+                        assert names is not None
+                        assert precompiled is not None
+                        self.assertEqual(normalize(precompiled), normalize(names))
+
+            # AST nodes are only looked up when needed
+            ctx = get_context((3, 6))._replace(typeshed=typeshed)
+            with mock.patch(
+                "typeshed_client.parser._parse_stub_file"
+            ) as mock_parse_stub_file:
+                names = get_stub_names("simple", search_context=ctx)
+                assert names is not None
+                self.assertEqual(
+                    names["other"].ast,
+                    typeshed_client.ImportedName(ModulePath(("other",))),
+                )
+                # neither does hashing or comparing infos from the same stub
+                again = get_stub_names("simple", search_context=ctx)
+                assert again is not None
+                self.assertEqual(hash(names["func"]), hash(again["func"]))
+                self.assertEqual(names["func"], names["func"])
+                mock_parse_stub_file.assert_not_called()
+            self.check_nameinfo(names, "func", ast.FunctionDef)
+            self.assertEqual(names["func"], typeshed_client.NameInfo(*names["func"]))
+            replaced = names["func"]._replace(is_exported=False)
+            self.assertEqual(
+                replaced,
+                typeshed_client.NameInfo("func", False, names["func"].ast, None),
+            )
+            self.assertEqual(type(replaced), typeshed_client.NameInfo)
+            self.assertEqual(
+                type(type(names["func"])._make(replaced)), typeshed_client.NameInfo
+            )
+
+            # Changed stubs are parsed again
+            with (typeshed / "simple.pyi").open("a") as f:
+                f.write("added: int\n")
+            names = get_stub_names("simple", search_context=ctx)
+            assert names is not None
+            self.assertIn("added", names)
+            # even if their size is the same
+            (typeshed / "lib.pyi").write_text("x: int\n")
+            typeshed_client.parser.write_symbol_tables(typeshed)
+            typeshed_client.parser._load_symbol_tables.cache_clear()
+            self.assertIn("x", get_stub_names("lib", search_context=ctx) or {})
+            (typeshed / "lib.pyi").write_text("y: int\n")
+            os.utime(typeshed / "lib.pyi", ns=(0, 0))
+            self.assertIn("y", get_stub_names("lib", search_context=ctx) or {})
+
+            # symbol tables are stored directly, one line for each stub
+            lines = (Path(temp_dir_str) / "typeshed.symbols").read_text().splitlines()
+            self.assertEqual(json.loads(lines[0]), {"format": 2})
+            entries = {line.split("\t")[0]: line.split("\t") for line in lines[1:]}
+            self.assertEqual(
+                json.loads(entries["lib.pyi"][3]),
+                [["name", "x", True, ["node", [["body", 0]], False], None]],
+            )
+
+    def test_name_records(self) -> None:
+        def dump(node: object) -> object:
+            if isinstance(node, typeshed_client.OverloadedName):
+                return [dump(defn) for defn in node.definitions]
+            return ast.dump(node) if isinstance(node, ast.AST) else node
+
+        def normalize(names: typeshed_client.NameDict) -> dict[str, Any]:
+            return {
+                name: (
+                    info.is_exported,
+                    dump(info.ast),
+                    None if info.child_nodes is None else normalize(info.child_nodes),
+                )
+                for name, info in names.items()
+            }
+
+        ctx = get_context((3, 11))
+        for module in ["simple", "overloads", "dunder_all", "conditions"]:
+            with self.subTest(module):
+                names = get_stub_names(module, search_context=ctx)
+                records = typeshed_client.parser.get_stub_records(
+                    module, search_context=ctx
+                )
+                assert names is not None
+                assert records is not None
+                self.assertEqual(
+                    normalize(
+                        {
+                            name: record.to_name_info()
+                            for name, record in records.items()
+                        }
+                    ),
+                    normalize(names),
+                )
+
+        records = typeshed_client.parser.get_stub_records("simple", search_context=ctx)
+        assert records is not None
+        self.assertEqual(records["func"].kind, "FunctionDef")
+        self.assertEqual(records["func"].module_name, ModulePath(("simple",)))
+        self.assertEqual(records["other"].kind, "import")
+        self.assertEqual(
+            records["other"].imported,
+            typeshed_client.ImportedName(ModulePath(("other",))),
+        )
+        records = typeshed_client.parser.get_stub_records(
+            "overloads", search_context=ctx
+        )
+        assert records is not None
+        overloaded = records["overloaded"]
+        self.assertEqual(overloaded.kind, "overload")
+        assert overloaded.definitions is not None
+        self.assertEqual(
+            [(defn.kind, defn.lineno) for defn in overloaded.definitions],
+            [("FunctionDef", 4), ("FunctionDef", 6)],
+        )
+
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            stub = Path(temp_dir_str) / "stub.pyi"
+            stub.write_text("x: int\ndef f() -> None: ...\n")
+            names = typeshed_client.parse_ast(
+                ast.parse(stub.read_text()), ctx, ModulePath(("stub",)), file_path=stub
+            )
+            records = typeshed_client.parser.compact_names(
+                names, ModulePath(("stub",)), stub
+            )
+            self.assertEqual(dump(records["f"].get_ast()), dump(names["f"].ast))
+            # the stub changed under the record
+            stub.write_text("def f() -> None: ...\n")
+            with self.assertRaises(typeshed_client.InvalidStub):
+                records["f"].get_ast()
+
+    def test_get_stub_names_many(self) -> None:
+        def summarize(records: typeshed_client.parser.RecordDict) -> dict[str, Any]:
+            return {
+                name: (
+                    record.is_exported,
+                    record.kind,
+                    record.lineno,
+                    record.end_col_offset,
+                    record.imported,
+                    record.module_name,
+                    record.file_path,
+                    (
+                        None
+                        if record.definitions is None
+                        else [defn.lineno for defn in record.definitions]
+                    ),
+                    None if record.children is None else summarize(record.children),
+                )
+                for name, record in records.items()
+            }
+
+        modules = [
+            "simple",
+            "nosuchmodule",
+            "overloads",
+            "broken",
+            "dunder_all",
+            "subdir.overloads",
+            "conditions",
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            (temp_dir / "broken").mkdir()
+            (temp_dir / "broken" / "__init__.pyi").write_text("def f(:\n")
+            ctx = get_search_context(
+                version=(3, 11), typeshed=TEST_TYPESHED, search_path=[temp_dir]
+            )
+            results = list(
+                typeshed_client.parser.get_stub_names_many(
+                    modules, search_context=ctx, max_workers=2, chunksize=2
+                )
+            )
+            self.assertEqual([result.module_name for result in results], modules)
+            for module, result in zip(modules, results):
+                with self.subTest(module):
+                    if module == "broken":
+                        self.assertIsNone(result.names)
+                        self.assertIsInstance(result.error, SyntaxError)
+                        continue
+                    self.assertIsNone(result.error)
+                    records = typeshed_client.parser.get_stub_records(
+                        module, search_context=ctx
+                    )
+                    if records is None:
+                        self.assertIsNone(result.names)
+                    else:
+                        assert result.names is not None
+                        self.assertEqual(summarize(result.names), summarize(records))
+        self.assertEqual(
+            list(typeshed_client.parser.get_stub_names_many([], search_context=ctx)), []
+        )
+
+    def test_iter_all_stub_names(self) -> None:
+        def normalize(names: typeshed_client.NameDict) -> dict[str, Any]:
+            return {
+                name: (
+                    info.is_exported,
+                    ast.dump(info.ast) if isinstance(info.ast, ast.AST) else info.ast,
+                )
+                for name, info in names.items()
+                if not isinstance(info.ast, typeshed_client.OverloadedName)
+            }
+
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            (temp_dir / "broken").mkdir()
+            (temp_dir / "broken" / "__init__.pyi").write_text("def f(:\n")
+            ctx = get_search_context(
+                version=(3, 6), typeshed=TEST_TYPESHED, search_path=[temp_dir]
+            )
+            expected = [
+                (module, path)
+                for module, path in typeshed_client.get_all_stub_files(ctx)
+                if module != "broken"
+            ]
+            for prefetch in (0, 2):
+                with self.subTest(prefetch=prefetch):
+                    with self.assertLogs("typeshed_client.parser", "WARNING") as logs:
+                        results = list(
+                            typeshed_client.parser.iter_all_stub_names(
+                                ctx, prefetch=prefetch
+                            )
+                        )
+                    self.assertIn("broken", "\n".join(logs.output))
+                    self.assertEqual(
+                        [(module, path) for module, path, _ in results], expected
+                    )
+                    for module, path, names in results:
+                        self.assertEqual(
+                            normalize(names),
+                            normalize(
+                                get_stub_names_from_file(
+                                    module, path, search_context=ctx
+                                )
+                            ),
+                        )
+
+            # stopping early shuts down the background thread
+            iterator = typeshed_client.parser.iter_all_stub_names(ctx, prefetch=2)
+            next(iterator)
+            iterator.close()
+
+    def test_scanner(self) -> None:
+        def summarize(records: typeshed_client.parser.RecordDict) -> dict[str, Any]:
+            return {name: describe(record) for name, record in records.items()}
+
+        def describe(record: typeshed_client.parser.NameRecord) -> object:
+            return (
+                record.is_exported,
+                record.kind,
+                (
+                    record.lineno,
+                    record.col_offset,
+                    record.end_lineno,
+                    record.end_col_offset,
+                ),
+                record.imported,
+                record.wrap_in_list,
+                (
+                    None
+                    if record.definitions is None
+                    else [describe(defn) for defn in record.definitions]
+                ),
+            )
+
+        def check(module: str, ctx: SearchContext) -> None:
+            expected = typeshed_client.parser.get_stub_records(
+                module, search_context=ctx
+            )
+            scanned = scanner.scan_stub_names(module, search_context=ctx)
+            assert expected is not None
+            assert scanned is not None
+            self.assertEqual(summarize(scanned), summarize(expected))
+            for record in scanned.values():
+                self.assertIsNone(record.children)
+
+        for version in [(3, 6), (3, 11)]:
+            for platform in ["linux", "win32"]:
+                ctx = get_context(version, platform)
+                for module in ["simple", "overloads", "dunder_all", "conditions"]:
+                    with self.subTest(module, version=version, platform=platform):
+                        check(module, ctx)
+
+        ctx = get_search_context(search_path=[])
+        for module in ["builtins", "typing", "os", "collections"]:
+            with self.subTest(module):
+                check(module, ctx)
+
+        stub = """\
+'''Docstring with (unbalanced brackets and # no comment.'''
+from . import sibling as sibling
+from .sibling import (  # comment (
+    a,
+    b as b,
+)
+import os.path, sys as sys
+
+x: int = 1  # comment ]
+y = z = "a # b"
+ünïcode: str = "ä"
+s = '''
+class NotAClass: ...
+'''
+l = [
+    1,  # ( comment
+    [2, {3: (4,)}],
+]
+long = 1 + \\
+    2
+__all__ = ["x"]
+__all__ += ["y"]
+__all__.append("z")
+__all__.extend(["long"])
+
+
+@decorator
+class C(Base, metaclass=Meta):
+    '''Docstring.'''
+
+    def method(self) -> None:
+        '''
+def not_a_function(): ...
+'''
+
+class D: ...
+class E:
+    ...
+
+async def f(
+    x: Callable[[int], str] = ...,
+) -> None: ...
+def g(): pass
+
+if sys.version_info >= (3, 10):
+    if sys.platform == "win32":
+        def h() -> int: ...
+    elif sys.platform == "linux":
+        def h() -> str: ...
+    else:
+        def h() -> bytes: ...
+else:
+    h2: int
+try:
+    from os import sep
+except ImportError:
+    sep2: str
+finally:
+    t: int
+"""
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            package = Path(temp_dir_str) / "scanned"
+            package.mkdir()
+            (package / "__init__.pyi").write_text(stub, encoding="utf-8")
+            (package / "sibling.pyi").write_text("a: int\nb: int\n")
+            (package / "tabs.pyi").write_text(
+                "if sys.version_info >= (3,):\n\tx: int\n"
+            )
+            (package / "semicolons.pyi").write_text("x: int; y: str\n")
+            ctx = get_search_context(search_path=[Path(temp_dir_str)])
+            for module in ["scanned", "scanned.tabs", "scanned.semicolons"]:
+                for version in [(3, 9), (3, 12)]:
+                    with self.subTest(module, version=version):
+                        check(module, ctx._replace(version=version))
+
+            records = scanner.scan_stub_names("scanned", search_context=ctx)
+            assert records is not None
+            self.assertNotIn("NotAClass", records)
+            self.assertNotIn("not_a_function", records)
+            self.assertEqual(
+                records["sibling"].imported,
+                typeshed_client.ImportedName(ModulePath(("scanned",)), "sibling"),
+            )
+            self.assertEqual(records["C"].lineno, 28)
+            self.assertEqual(records["ünïcode"].end_col_offset, 21)
+            self.assertEqual(records["h"].kind, "FunctionDef")
+            self.assertEqual(records["__all__"].kind, "overload")
+
+            (package / "invalid.pyi").write_text("x = (1,\n")
+            with self.assertRaises(SyntaxError):
+                scanner.scan_stub_names("scanned.invalid", search_context=ctx)
+        self.assertIsNone(scanner.scan_stub_names("nonexistent", search_context=ctx))
+
     def check_nameinfo(
         self,
         names: typeshed_client.NameDict,
@@ -281,6 +1072,52 @@ class TestParser(unittest.TestCase):
         assert info is not None
         self.assertEqual(set(info), names | {"sys"})
 
+    def test_condition_cache(self) -> None:
+        ctx = get_context((3, 6), "linux")
+        shared = typeshed_client.parser.get_condition_cache(ctx)
+        self.assertIs(
+            typeshed_client.parser.get_condition_cache(
+                get_search_context(version=(3, 6), platform="linux", search_path=[])
+            ),
+            shared,
+        )
+        self.assertIsNot(
+            typeshed_client.parser.get_condition_cache(ctx._replace(platform="win32")),
+            shared,
+        )
+
+        cache = typeshed_client.parser.ConditionCache((3, 6), "linux")
+        stub = Path("stub.pyi")
+        self.assertTrue(
+            cache.evaluate_source("sys.version_info >= (3, 5)", file_path=stub)
+        )
+        # the same condition, spelled differently
+        self.assertTrue(
+            cache.evaluate_source("sys.version_info>=(3,5)", file_path=stub)
+        )
+        expr = ast.parse("sys.version_info >= (3, 5)", mode="eval").body
+        self.assertTrue(cache.evaluate(expr, file_path=stub))
+        self.assertFalse(
+            cache.evaluate_source('sys.platform == "win32"', file_path=stub)
+        )
+        # 1 and True are different keys
+        self.assertFalse(
+            cache.evaluate_source("sys.version_info[0] == 1", file_path=stub)
+        )
+        self.assertTrue(
+            cache.evaluate_source("sys.version_info[0] != True", file_path=stub)
+        )
+        self.assertEqual(cache.stats(), (2, 4, 4))
+
+        with self.assertRaises(typeshed_client.InvalidStub):
+            cache.evaluate_source("os.name == 'nt'", file_path=stub)
+        self.assertIsNone(
+            cache.evaluate_source("os.name == 'nt'", file_path=Path("a.py"))
+        )
+        self.assertEqual(cache.stats().entries, 4)
+        cache.clear()
+        self.assertEqual(cache.stats().entries, 0)
+
     def test_top_level_assert(self) -> None:
         ctx = get_context((3, 6), "flat")
         info = get_stub_names("top_level_assert", search_context=ctx)
@@ -291,6 +1128,144 @@ class TestParser(unittest.TestCase):
         assert info is not None
         self.assertEqual(set(info), {"x", "sys"})
 
+    def test_availability(self) -> None:
+        versions = [(2, 7), (3, 5), (3, 6), (3, 7)]
+        platforms = ["linux", "darwin", "win32"]
+        ctx = get_context((3, 6))
+        for module in ["conditions", "top_level_assert", "lib", "starimport", "new37"]:
+            result = availability.get_availability(
+                module, versions=versions, platforms=platforms, search_context=ctx
+            )
+            assert result is not None
+            for version in versions:
+                for platform in platforms:
+                    with self.subTest(module, version=version, platform=platform):
+                        combination = (version, platform)
+                        names = get_stub_names(
+                            module, search_context=get_context(version, platform)
+                        )
+                        self.assertEqual(
+                            combination in result.combinations, names is not None
+                        )
+                        expected = {
+                            name: (
+                                info.is_exported,
+                                (
+                                    info.ast
+                                    if isinstance(
+                                        info.ast, typeshed_client.ImportedName
+                                    )
+                                    else None
+                                ),
+                            )
+                            for name, info in (names or {}).items()
+                        }
+                        actual = {
+                            name: (
+                                combination in entry.exported,
+                                next(
+                                    (
+                                        target
+                                        for target, combinations in (
+                                            entry.imports.items()
+                                        )
+                                        if combination in combinations
+                                    ),
+                                    None,
+                                ),
+                            )
+                            for name, entry in result.names.items()
+                            if combination in entry.combinations
+                        }
+                        self.assertEqual(actual, expected)
+                        res = typeshed_client.Resolver(get_context(version, platform))
+                        module_path = ModulePath(tuple(module.split(".")))
+                        for name, entry in result.names.items():
+                            if combination not in entry.combinations:
+                                continue
+                            resolved = [
+                                target
+                                for target, combinations in entry.resolved.items()
+                                if combination in combinations
+                            ]
+                            self.assertEqual(
+                                resolved,
+                                resolved_targets(
+                                    module_path, res.get_name(module_path, name)
+                                ),
+                                name,
+                            )
+
+        result = availability.get_availability(
+            "conditions", versions=versions, platforms=platforms, search_context=ctx
+        )
+        assert result is not None
+        self.assertEqual(
+            result.names["windows"].combinations,
+            {(version, "win32") for version in versions},
+        )
+        self.assertEqual(
+            result.names["typing"].combinations,
+            {((3, 5), platform) for platform in platforms},
+        )
+        self.assertEqual(
+            result.names["sys"].imports,
+            {typeshed_client.ImportedName(ModulePath(("sys",))): result.combinations},
+        )
+        result = availability.get_availability(
+            "new37", versions=versions, platforms=platforms, search_context=ctx
+        )
+        assert result is not None
+        self.assertEqual(
+            result.combinations, {((3, 7), platform) for platform in platforms}
+        )
+        self.assertIsNone(
+            availability.get_availability(
+                "py2only", versions=[(3, 6)], platforms=platforms, search_context=ctx
+            )
+        )
+
+        # imports are followed into the versions in which their targets exist
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            for package, source in [
+                ("reexport", "from defs import Gated, Cycle\nfrom defs import sub\n"),
+                (
+                    "defs",
+                    "import sys\nfrom reexport import Cycle\n"
+                    "if sys.version_info >= (3, 7):\n    Gated: int\n",
+                ),
+            ]:
+                (temp_dir / package).mkdir()
+                (temp_dir / package / "__init__.pyi").write_text(source)
+            (temp_dir / "defs" / "sub.pyi").touch()
+            result = availability.get_availability(
+                "reexport",
+                versions=[(3, 6), (3, 7)],
+                platforms=["linux"],
+                search_context=get_search_context(
+                    typeshed=TEST_TYPESHED, search_path=[temp_dir]
+                ),
+            )
+            assert result is not None
+            self.assertEqual(
+                result.names["Gated"].resolved,
+                {
+                    typeshed_client.ImportedName(
+                        ModulePath(("defs",)), "Gated"
+                    ): frozenset({((3, 7), "linux")})
+                },
+            )
+            self.assertEqual(result.names["Cycle"].resolved, {})
+            self.assertEqual(
+                result.names["sub"].resolved,
+                {
+                    typeshed_client.ImportedName(
+                        ModulePath(("defs", "sub"))
+                    ): result.combinations
+                },
+            )
+
     def test_ifmypy(self) -> None:
         names = get_stub_names("ifmypy", search_context=get_context((3, 11)))
         assert names is not None
@@ -317,6 +1292,31 @@ class TestParser(unittest.TestCase):
         for defn in definitions:
             self.assertIsInstance(defn, ast.FunctionDef)
 
+    def test_lazy_classes(self) -> None:
+        ctx = get_context((3, 5))
+        eager = get_stub_names("overloads", search_context=ctx)
+        with mock.patch.object(
+            typeshed_client.parser._NameExtractor,
+            "get_class_children",
+            autospec=True,
+            side_effect=typeshed_client.parser._NameExtractor.get_class_children,
+        ) as mock_get_class_children:
+            lazy = get_stub_names("overloads", search_context=ctx, lazy_classes=True)
+            assert lazy is not None
+            mock_get_class_children.assert_not_called()
+            classdef = lazy["OverloadClass"]
+            self.assertIsInstance(classdef.ast, ast.ClassDef)
+            mock_get_class_children.assert_not_called()
+            children = classdef.child_nodes
+            assert children is not None
+            self.assertEqual(set(children), {"overloaded"})
+            self.assertIs(classdef.child_nodes, children)
+            self.assertEqual(mock_get_class_children.call_count, 1)
+        # lazy infos behave like plain ones
+        self.assertEqual(lazy, eager)
+        self.assertEqual(type(classdef._replace()), typeshed_client.NameInfo)
+        self.assertEqual(classdef, typeshed_client.NameInfo(*classdef))
+
 
 @unittest.skipUnless(HAS_TEST_FIXTURES, "test fixtures are not shipped in the sdist")
 class TestResolver(unittest.TestCase):
@@ -336,6 +1336,355 @@ class TestResolver(unittest.TestCase):
 
         self.assertIsInstance(res.get_name(path, "var"), typeshed_client.NameInfo)
 
+    def test_module_exists(self) -> None:
+        res = typeshed_client.Resolver(get_context((3, 5)))
+        path = typeshed_client.ModulePath(("simple",))
+        with (
+            mock.patch(
+                "typeshed_client.parser.get_stub_names_from_file",
+                wraps=get_stub_names_from_file,
+            ) as mock_get_stub_names,
+            mock.patch.object(res.finder, "find", wraps=res.finder.find) as mock_find,
+            mock.patch(
+                "typeshed_client.finder.get_stub_file", wraps=finder.get_stub_file
+            ) as mock_get_stub_file,
+        ):
+            self.assertIsInstance(
+                res.get_name(path, "exported"), typeshed_client.ImportedInfo
+            )
+            self.assertEqual(
+                res.get_name(path, "other"), typeshed_client.ModulePath(("other",))
+            )
+            # Only "simple" and "other" are parsed; "other.exported" is only probed
+            self.assertEqual(
+                [call.args[0] for call in mock_get_stub_names.call_args_list],
+                ["simple", "other"],
+            )
+            self.assertFalse(res.module_exists(ModulePath(("other", "exported"))))
+            self.assertTrue(res.module_exists(ModulePath(("subdir", "overloads"))))
+            self.assertFalse(res.get_module(ModulePath(("other", "exported"))).exists)
+            probes = [call.args[0] for call in mock_find.call_args_list]
+            # There is no "other" directory, so no submodule of "other" is searched for
+            self.assertNotIn(ModulePath(("other", "exported")), probes)
+            # all lookups go through the resolver's Finder
+            mock_get_stub_file.assert_not_called()
+
+    def test_invalidate(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            for package, source in [
+                (
+                    "pkg",
+                    "from dependency import Thing, Other\nlocal: int\n"
+                    "from star import *\n",
+                ),
+                ("dependency", "class Thing: ...\nfrom deeper import Other\n"),
+                ("deeper", "class Other: ...\n"),
+                ("star", "from starsource import *\n"),
+                ("starsource", "s: int\n"),
+                ("unrelated", "x: int\n"),
+            ]:
+                (temp_dir / package).mkdir()
+                (temp_dir / package / "__init__.pyi").write_text(source)
+            res = typeshed_client.Resolver(
+                get_search_context(typeshed=TEST_TYPESHED, search_path=[temp_dir])
+            )
+            pkg = ModulePath(("pkg",))
+            dependency = ModulePath(("dependency",))
+            deeper = ModulePath(("deeper",))
+            star = ModulePath(("star",))
+            starsource = ModulePath(("starsource",))
+            for name in ["Thing", "Other", "local", "s"]:
+                self.assertIsNotNone(res.get_name(pkg, name))
+            self.assertIsNotNone(res.get_name(ModulePath(("unrelated",)), "x"))
+
+            self.assertEqual(
+                res.get_loaded_modules(),
+                {pkg, dependency, deeper, star, starsource, ModulePath(("unrelated",))},
+            )
+            self.assertEqual(res.get_dependents(deeper), {dependency})
+            self.assertEqual(
+                res.get_dependents(deeper, transitive=True), {dependency, pkg}
+            )
+            # star imports are recorded transitively
+            self.assertEqual(res.get_dependents(starsource), {pkg, star})
+            graph = res.get_dependency_graph()
+            self.assertEqual(graph[dependency], {pkg})
+            self.assertEqual(graph[ModulePath(("dependency", "Thing"))], {pkg})
+            self.assertNotIn(ModulePath(("unrelated",)), graph)
+
+            # only the names resolved through the changed module are dropped
+            pkg_module = res.get_module(pkg)
+            (temp_dir / "deeper" / "__init__.pyi").write_text("Other: int\n")
+            self.assertEqual(res.invalidate(deeper), {deeper, dependency, pkg})
+            self.assertIs(res.get_module(pkg), pkg_module)
+            self.assertEqual(set(pkg_module._name_cache), {"Thing", "local", "s"})
+            resolved = res.get_name(pkg, "Other")
+            assert isinstance(resolved, typeshed_client.ImportedInfo)
+            self.assertIsInstance(resolved.info.ast, ast.AnnAssign)
+
+            # modules that star-import from the changed module are parsed again
+            (temp_dir / "starsource" / "__init__.pyi").write_text("s: int\nt: int\n")
+            os.utime(temp_dir / "starsource" / "__init__.pyi", ns=(0, 0))
+            self.assertEqual(res.invalidate(starsource), {starsource, star, pkg})
+            self.assertIsNot(res.get_module(pkg), pkg_module)
+            self.assertIsNotNone(res.get_name(pkg, "t"))
+
+            # new submodules are found
+            self.assertIsNone(res.get_name(pkg, "Thing2"))
+            self.assertFalse(res.module_exists(ModulePath(("dependency", "sub"))))
+            (temp_dir / "dependency" / "sub.pyi").touch()
+            self.assertEqual(res.invalidate(ModulePath(("dependency", "sub"))), set())
+            self.assertTrue(res.module_exists(ModulePath(("dependency", "sub"))))
+
+            self.assertEqual(len(res.invalidate_all()), 6)
+            self.assertEqual(res.get_loaded_modules(), set())
+            self.assertEqual(res.get_dependency_graph(), {})
+
+    def test_module_store(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            for package, source in [
+                ("pkg", "from dependency import Thing\nfrom star import *\n"),
+                ("dependency", "class Thing: ...\n"),
+                ("star", "s: int\n"),
+            ]:
+                (temp_dir / package).mkdir()
+                (temp_dir / package / "__init__.pyi").write_text(source)
+            ctx = get_search_context(typeshed=TEST_TYPESHED, search_path=[temp_dir])
+            store = typeshed_client.ModuleStore()
+            pkg = ModulePath(("pkg",))
+
+            first = typeshed_client.Resolver(ctx, module_store=store)
+            thing = first.get_name(pkg, "Thing")
+            self.assertIsNotNone(first.get_name(pkg, "s"))
+            self.assertEqual(
+                store.stats(),
+                typeshed_client.resolver.ModuleStoreStats(0, 3, 0, 3, 3, mock.ANY),
+            )
+
+            with mock.patch(
+                "typeshed_client.parser.get_stub_names_from_file",
+                wraps=get_stub_names_from_file,
+            ) as mock_get_stub_names:
+                second = typeshed_client.Resolver(ctx, module_store=store)
+                self.assertEqual(second.get_name(pkg, "Thing"), thing)
+                self.assertIsNotNone(second.get_name(pkg, "s"))
+                mock_get_stub_names.assert_not_called()
+                # the dependency graph is shared too
+                self.assertEqual(second.get_dependents(ModulePath(("star",))), {pkg})
+
+                # other versions have their own entries
+                other = typeshed_client.Resolver(
+                    ctx._replace(version=(3, 8)), module_store=store
+                )
+                # (star is parsed while parsing pkg, for its star import)
+                self.assertIsNotNone(other.get_name(pkg, "Thing"))
+                self.assertEqual(mock_get_stub_names.call_count, 3)
+
+                # edited stubs are parsed again, including star-imported ones
+                (temp_dir / "star" / "__init__.pyi").write_text("s: int\nt: int\n")
+                third = typeshed_client.Resolver(ctx, module_store=store)
+                self.assertIsNotNone(third.get_name(pkg, "t"))
+                self.assertEqual(third.get_name(pkg, "Thing"), thing)
+                self.assertEqual(
+                    [call.args[0] for call in mock_get_stub_names.call_args_list[3:]],
+                    ["pkg", "star", "star"],
+                )
+
+            stats = store.stats()
+            self.assertEqual(stats.entries, 5)
+            self.assertEqual(stats.referenced, 5)
+            self.assertEqual(
+                stats.size,
+                sum(
+                    (temp_dir / package / "__init__.pyi").stat().st_size
+                    for package in ["pkg", "dependency", "star", "pkg", "dependency"]
+                ),
+            )
+
+            # entries are released when resolvers go away, and only then evicted
+            store.max_bytes = 0
+            del first, second, other
+            self.assertEqual(store.stats().entries, 3)
+            # invalidating a module drops it from the store
+            third.invalidate(ModulePath(("dependency",)))
+            self.assertEqual(store.stats().entries, 2)
+            del third
+            self.assertEqual(
+                store.stats(),
+                typeshed_client.resolver.ModuleStoreStats(4, 7, 4, 0, 0, 0),
+            )
+
+    def test_resolve_all(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            for package, source in [
+                (
+                    "pkg",
+                    "from a import x as x, z as z\nfrom b import y as y\n"
+                    "public: int\n_private: int\n",
+                ),
+                ("a", "from b import x as x\nz: int\n"),
+                ("b", "x: int\ny: int\n"),
+                ("withall", "from b import y\n__all__ = ['y', 'missing']\n"),
+            ]:
+                (temp_dir / package).mkdir()
+                (temp_dir / package / "__init__.pyi").write_text(source)
+            ctx = get_search_context(typeshed=TEST_TYPESHED, search_path=[temp_dir])
+            modules = [ModulePath(("pkg",)), ModulePath(("withall",))]
+
+            with mock.patch(
+                "typeshed_client.parser.get_stub_names_from_file",
+                wraps=get_stub_names_from_file,
+            ) as mock_get_stub_names:
+                res = typeshed_client.Resolver(ctx)
+                resolved = res.resolve_all(modules)
+                self.assertEqual(
+                    sorted(call.args[0] for call in mock_get_stub_names.call_args_list),
+                    ["a", "b", "pkg", "withall"],
+                )
+
+            expected_resolver = typeshed_client.Resolver(ctx)
+            self.assertEqual(
+                {name: describe_resolved(info) for name, info in resolved.items()},
+                {
+                    name: describe_resolved(
+                        expected_resolver.get_fully_qualified_name(name)
+                    )
+                    for name in [
+                        "pkg.x",
+                        "pkg.z",
+                        "pkg.y",
+                        "pkg.public",
+                        "withall.y",
+                        "withall.missing",
+                    ]
+                },
+            )
+            pkg_x = resolved["pkg.x"]
+            assert isinstance(pkg_x, typeshed_client.ImportedInfo)
+            self.assertEqual(pkg_x.source_module, ModulePath(("b",)))
+            self.assertIsNone(resolved["withall.missing"])
+
+    def test_import_cycle(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            # longer than the recursion limit allows for a recursive resolver
+            length = 1000
+            modules = [
+                ("a", "from b import x as x\nfrom a import y\n"),
+                ("b", "from c import x as x\n"),
+                ("c", "from b import x as x\n"),
+                *[
+                    (f"chain{i}", f"from chain{i + 1} import name as name\n")
+                    for i in range(length)
+                ],
+                (f"chain{length}", "name: int\n"),
+            ]
+            for package, source in modules:
+                (temp_dir / package).mkdir()
+                (temp_dir / package / "__init__.pyi").write_text(source)
+            res = typeshed_client.Resolver(
+                get_search_context(typeshed=TEST_TYPESHED, search_path=[temp_dir])
+            )
+            a = ModulePath(("a",))
+            b = ModulePath(("b",))
+            c = ModulePath(("c",))
+
+            cycle = typeshed_client.ImportCycle(
+                (
+                    typeshed_client.ImportedName(c, "x"),
+                    typeshed_client.ImportedName(b, "x"),
+                )
+            )
+            self.assertEqual(res.get_name(a, "x"), cycle)
+            # every name in the chain is cached
+            self.assertEqual(res.get_module(b)._name_cache["x"], cycle)
+            self.assertEqual(res.get_module(c)._name_cache["x"], cycle)
+            self.assertEqual(
+                res.get_name(a, "y"),
+                typeshed_client.ImportCycle((typeshed_client.ImportedName(a, "y"),)),
+            )
+
+            resolved = res.get_name(ModulePath(("chain0",)), "name")
+            last = ModulePath((f"chain{length}",))
+            assert isinstance(resolved, typeshed_client.ImportedInfo)
+            self.assertEqual(resolved.source_module, last)
+            for i in range(1, length):
+                module = res.get_module(ModulePath((f"chain{i}",)))
+                self.assertEqual(module._name_cache["name"], resolved)
+            self.assertIsInstance(
+                res.get_module(last)._name_cache["name"], typeshed_client.NameInfo
+            )
+
+    def test_thread_safe(self) -> None:
+        ctx = get_search_context(search_path=[])
+        queries = [
+            (ModulePath(tuple(module.split("."))), name)
+            for module in ["typing", "os", "collections", "asyncio", "email.message"]
+            for name in get_stub_names(module, search_context=ctx) or {}
+        ]
+        expected_resolver = typeshed_client.Resolver(ctx)
+        expected = [expected_resolver.get_name(*query) for query in queries]
+
+        res = typeshed_client.ThreadSafeResolver(ctx)
+        parsed: list[str] = []
+
+        def slow_get_stub_names(
+            module_name: str,
+            path: Path,
+            *,
+            search_context: Optional[SearchContext] = None,
+            lazy_classes: bool = False,
+        ) -> typeshed_client.NameDict:
+            parsed.append(module_name)
+            # give the other threads time to ask for the same module
+            time.sleep(0.01)
+            return get_stub_names_from_file(
+                module_name,
+                path,
+                search_context=search_context,
+                lazy_classes=lazy_classes,
+            )
+
+        num_threads = 8
+        barrier = threading.Barrier(num_threads - 1)
+
+        def resolve_all(offset: int) -> list[Any]:
+            barrier.wait()
+            order = queries[offset:] + queries[:offset]
+            results = [res.get_name(*query) for query in order]
+            return results[-offset:] + results[:-offset] if offset else results
+
+        with (
+            mock.patch(
+                "typeshed_client.parser.get_stub_names_from_file",
+                side_effect=slow_get_stub_names,
+            ),
+            ThreadPoolExecutor(num_threads) as executor,
+        ):
+            offsets = [i * len(queries) // num_threads for i in range(num_threads)]
+            for results in executor.map(resolve_all, offsets[1:]):
+                self.assertEqual(results, expected)
+        # each module is parsed exactly once
+        self.assertEqual(len(parsed), len(set(parsed)))
+        self.assertEqual(set(parsed), {".".join(m) for m in res.get_loaded_modules()})
+
+        # invalidating while other threads resolve names
+        def invalidate() -> None:
+            for _ in range(10):
+                for module in ["typing", "collections", "_typeshed"]:
+                    res.invalidate(ModulePath((module,)))
+                time.sleep(0.001)
+
+        with ThreadPoolExecutor(num_threads) as executor:
+            invalidation = executor.submit(invalidate)
+            for results in executor.map(resolve_all, offsets[1:]):
+                self.assertEqual(results, expected)
+            invalidation.result()
+        self.assertEqual([res.get_name(*query) for query in queries], expected)
+
     def test_module(self) -> None:
         res = typeshed_client.Resolver(get_context((3, 5)))
         path = typeshed_client.ModulePath(("subdir",))
@@ -418,5 +1767,288 @@ class IntegrationTest(unittest.TestCase):
                 )
 
 
+def describe_resolved(resolved: typeshed_client.resolver.ResolvedName) -> object:
+    """Summarize a resolved name without comparing AST nodes by identity."""
+    if isinstance(resolved, typeshed_client.ImportedInfo):
+        return (resolved.source_module, describe_resolved(resolved.info))
+    if isinstance(resolved, typeshed_client.NameInfo):
+        return (resolved.name, resolved.is_exported, type(resolved.ast).__name__)
+    return resolved
+
+
+@unittest.skipUnless(HAS_TEST_FIXTURES, "test fixtures are not shipped in the sdist")
+class TestSymbolIndex(unittest.TestCase):
+    def test_symbol_index(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            packages = temp_dir / "packages"
+            for package, source in [
+                ("defs", "class UniqueThing: ...\n_Private: int\n"),
+                (
+                    "reexport",
+                    "from defs import UniqueThing as UniqueThing\n"
+                    "from defs import UniqueThing as UniqueAlias\n",
+                ),
+                ("withall", "from defs import *\n__all__ = ['UniqueThing']\n"),
+            ]:
+                (packages / package).mkdir(parents=True)
+                (packages / package / "__init__.pyi").write_text(source)
+            ctx = get_search_context(typeshed=TEST_TYPESHED, search_path=[packages])
+
+            definition = symbol_index.SymbolDefinition(
+                "defs",
+                "UniqueThing",
+                (
+                    symbol_index.ReExport("defs", "UniqueThing"),
+                    symbol_index.ReExport("reexport", "UniqueAlias"),
+                    symbol_index.ReExport("reexport", "UniqueThing"),
+                    symbol_index.ReExport("withall", "UniqueThing"),
+                ),
+            )
+            with symbol_index.build_symbol_index(
+                temp_dir / "index", search_context=ctx
+            ) as index:
+                self.assertEqual(index.lookup("UniqueThing"), [definition])
+                self.assertEqual(index.lookup("UniqueAlias"), [definition])
+                self.assertEqual(index.lookup("_Private"), [])
+                self.assertIn("UniqueAlias", index)
+                self.assertEqual(list(index), sorted(index, key=str.encode))
+                self.assertTrue(index.matches(ctx))
+                self.assertFalse(index.matches(ctx._replace(platform="win32")))
+                self.assertFalse(index.is_stale())
+                (packages / "defs" / "__init__.pyi").write_text("UniqueThing: int\n")
+                self.assertTrue(index.is_stale())
+
+            cache_dir = temp_dir / "cache"
+            with mock.patch(
+                "typeshed_client.symbol_index.build_symbol_index",
+                wraps=symbol_index.build_symbol_index,
+            ) as mock_build:
+                with symbol_index.get_symbol_index(ctx, cache_dir) as index:
+                    self.assertEqual(len(index.lookup("UniqueThing")), 1)
+                with symbol_index.get_symbol_index(ctx, cache_dir) as index:
+                    self.assertEqual(len(index.lookup("UniqueThing")), 1)
+                self.assertEqual(mock_build.call_count, 1)
+                (packages / "new").mkdir()
+                (packages / "new" / "__init__.pyi").write_text("UniqueThing: str\n")
+                with symbol_index.get_symbol_index(ctx, cache_dir) as index:
+                    self.assertEqual(
+                        [defn.module for defn in index.lookup("UniqueThing")],
+                        ["defs", "new"],
+                    )
+                self.assertEqual(mock_build.call_count, 2)
+                # as are submodules added to existing packages
+                (packages / "new" / "sub.pyi").write_text("class OtherThing: ...\n")
+                with symbol_index.get_symbol_index(ctx, cache_dir) as index:
+                    self.assertEqual(
+                        index.lookup("OtherThing"),
+                        [
+                            symbol_index.SymbolDefinition(
+                                "new.sub",
+                                "OtherThing",
+                                (symbol_index.ReExport("new.sub", "OtherThing"),),
+                            )
+                        ],
+                    )
+                self.assertEqual(mock_build.call_count, 3)
+
+            (temp_dir / "invalid").write_bytes(b"not an index")
+            self.assertIsNone(symbol_index.SymbolIndex.open(temp_dir / "invalid"))
+            self.assertIsNone(symbol_index.SymbolIndex.open(temp_dir / "missing"))
+
+
+@unittest.skipUnless(HAS_TEST_FIXTURES, "test fixtures are not shipped in the sdist")
+class TestAsyncResolver(unittest.TestCase):
+    def test_functions(self) -> None:
+        ctx = get_context((3, 5))
+        self.assertEqual(
+            asyncio.run(aio.get_stub_file("simple", search_context=ctx)),
+            get_stub_file("simple", search_context=ctx),
+        )
+        names = asyncio.run(aio.get_stub_names("simple", search_context=ctx))
+        expected = get_stub_names("simple", search_context=ctx)
+        assert names is not None
+        assert expected is not None
+        self.assertEqual(
+            {name: describe_resolved(info) for name, info in names.items()},
+            {name: describe_resolved(info) for name, info in expected.items()},
+        )
+
+    def test_get_name(self) -> None:
+        ctx = get_context((3, 5))
+        path = ModulePath(("simple",))
+        names = ["exported", "other", "func", "var", "nope"]
+        sync_res = typeshed_client.Resolver(ctx)
+        expected = [describe_resolved(sync_res.get_name(path, name)) for name in names]
+
+        async def resolve_concurrently() -> list[object]:
+            res = aio.AsyncResolver(ctx)
+            self.assertTrue(await res.module_exists(path))
+            resolved = await asyncio.gather(
+                *[res.get_name(path, name) for name in names * 5]
+            )
+            return [describe_resolved(result) for result in resolved]
+
+        with mock.patch(
+            "typeshed_client.parser.get_stub_names_from_file",
+            wraps=get_stub_names_from_file,
+        ) as mock_get_stub_names:
+            self.assertEqual(asyncio.run(resolve_concurrently()), expected * 5)
+        # each module is parsed once
+        self.assertEqual(
+            sorted(call.args[0] for call in mock_get_stub_names.call_args_list),
+            ["other", "simple"],
+        )
+
+    def test_cancellation(self) -> None:
+        ctx = get_context((3, 5))
+        simple_started = threading.Event()
+        release_simple = threading.Event()
+
+        def slow_get_stub_names(
+            module_name: str,
+            path: Path,
+            *,
+            search_context: typeshed_client.SearchContext,
+            lazy_classes: bool = False,
+        ) -> typeshed_client.NameDict:
+            if module_name == "simple":
+                simple_started.set()
+                release_simple.wait()
+            return get_stub_names_from_file(
+                module_name,
+                path,
+                search_context=search_context,
+                lazy_classes=lazy_classes,
+            )
+
+        async def main() -> None:
+            res = aio.AsyncResolver(ctx)
+            slow = asyncio.ensure_future(
+                res.get_fully_qualified_name("simple.exported")
+            )
+            try:
+                # fail instead of hanging if the load never starts
+                self.assertTrue(await asyncio.to_thread(simple_started.wait, 10))
+                # unrelated lookups are not held up by the slow one
+                self.assertIsInstance(
+                    await res.get_fully_qualified_name("other.exported"),
+                    typeshed_client.NameInfo,
+                )
+                slow.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await slow
+            finally:
+                # asyncio.run() waits for the executor, so never leave it blocked
+                release_simple.set()
+            # the load still completes, and later requests reuse it
+            self.assertIsInstance(
+                await res.get_fully_qualified_name("simple.exported"),
+                typeshed_client.ImportedInfo,
+            )
+
+        with mock.patch(
+            "typeshed_client.parser.get_stub_names_from_file",
+            side_effect=slow_get_stub_names,
+        ) as mock_get_stub_names:
+            asyncio.run(main())
+        self.assertEqual(
+            [call.args[0] for call in mock_get_stub_names.call_args_list].count(
+                "simple"
+            ),
+            1,
+        )
+
+
+@unittest.skipUnless(HAS_TEST_FIXTURES, "test fixtures are not shipped in the sdist")
+class TestWatcher(unittest.TestCase):
+    def test_inotify(self) -> None:
+        if not watcher._InotifyBackend.is_available():
+            self.skipTest("inotify is not available")
+        self.check_watcher(use_inotify=True)
+
+    def test_polling(self) -> None:
+        self.check_watcher(use_inotify=False)
+
+    def test_inotify_fallback(self) -> None:
+        res = typeshed_client.Resolver(get_context((3, 5)))
+        emfile = OSError(errno.EMFILE, os.strerror(errno.EMFILE))
+        with (
+            mock.patch.object(
+                watcher._InotifyBackend, "is_available", return_value=True
+            ),
+            mock.patch.object(watcher._InotifyBackend, "__init__", side_effect=emfile),
+        ):
+            with watcher.Watcher(res) as stub_watcher:
+                self.assertIsInstance(stub_watcher._backend, watcher._PollingBackend)
+            with self.assertRaises(OSError):
+                watcher.Watcher(res, use_inotify=True)
+
+        if not watcher._InotifyBackend.is_available():
+            return
+        # running out of watches
+        libc = watcher._load_libc()
+        assert libc is not None
+        fake_libc = mock.Mock(wraps=libc)
+        fake_libc.inotify_add_watch.return_value = -1
+        with (
+            mock.patch.object(watcher, "_load_libc", return_value=fake_libc),
+            mock.patch("ctypes.get_errno", return_value=errno.ENOSPC),
+        ):
+            with watcher.Watcher(res) as stub_watcher:
+                self.assertIsInstance(stub_watcher._backend, watcher._PollingBackend)
+            with self.assertRaises(OSError):
+                watcher.Watcher(res, use_inotify=True)
+
+    def check_watcher(self, *, use_inotify: bool) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            for package, source in [
+                ("pkg", "from dependency import Thing\n"),
+                ("dependency", "class Thing: ...\n"),
+                ("unrelated", "x: int\n"),
+            ]:
+                (temp_dir / package).mkdir()
+                (temp_dir / package / "__init__.pyi").write_text(source)
+            res = typeshed_client.Resolver(
+                get_search_context(typeshed=TEST_TYPESHED, search_path=[temp_dir])
+            )
+            pkg = ModulePath(("pkg",))
+            dependency = ModulePath(("dependency",))
+            new = ModulePath(("new",))
+            self.assertIsInstance(
+                res.get_name(pkg, "Thing"), typeshed_client.ImportedInfo
+            )
+            self.assertIsNone(res.get_name(pkg, "New"))
+            self.assertIsNotNone(res.get_name(ModulePath(("unrelated",)), "x"))
+            self.assertFalse(res.module_exists(new))
+
+            with watcher.Watcher(res, use_inotify=use_inotify) as stub_watcher:
+                self.assertEqual(stub_watcher.check(), set())
+
+                # Changing a stub invalidates it and the modules that import from it
+                with (temp_dir / "dependency" / "__init__.pyi").open("a") as f:
+                    f.write("class New: ...\n")
+                self.assertEqual(stub_watcher.check(), {pkg, dependency})
+                self.assertIsNotNone(res.get_name(dependency, "New"))
+                self.assertIsInstance(
+                    res.get_name(pkg, "Thing"), typeshed_client.ImportedInfo
+                )
+                self.assertEqual(stub_watcher.check(), set())
+
+                # New packages are found
+                (temp_dir / "new").mkdir()
+                (temp_dir / "new" / "__init__.pyi").touch()
+                self.assertEqual(stub_watcher.check(), set())
+                self.assertTrue(res.module_exists(new))
+
+                (temp_dir / "dependency" / "__init__.pyi").unlink()
+                self.assertEqual(stub_watcher.check(), {pkg, dependency})
+                self.assertFalse(res.get_module(dependency).exists)
+                self.assertIsNone(res.get_name(pkg, "Thing"))
+            # closing again is harmless
+            stub_watcher.close()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,21 +19,30 @@ from .parser import (
     get_stub_names,
     parse_ast,
 )
-from .resolver import ImportedInfo, Resolver
+from .resolver import (
+    ImportCycle,
+    ImportedInfo,
+    ModuleStore,
+    Resolver,
+    ThreadSafeResolver,
+)
 
 __version__ = "2.12.0"
 
 
 __all__ = [
+    "ImportCycle",
     "ImportedInfo",
     "ImportedName",
     "InvalidStub",
     "ModulePath",
+    "ModuleStore",
     "NameDict",
     "NameInfo",
     "OverloadedName",
     "Resolver",
     "SearchContext",
+    "ThreadSafeResolver",
     "__version__",
     "evaluate_expression_truthiness",
     "get_all_stub_files",
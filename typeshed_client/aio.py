@@ -0,0 +1,172 @@
+"""asyncio interface for finding stubs and resolving names.
+
+File system access and parsing happen on an executor, so that they do not block
+the event loop.
+
+"""
+
+import asyncio
+import functools
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Optional, TypeVar, Union
+
+from . import finder, parser
+from .finder import ModulePath, SearchContext, get_search_context
+from .resolver import ImportedInfo, Module, ModuleStore, ResolvedName, Resolver
+
+_T = TypeVar("_T")
+
+
+async def get_stub_file(
+    module_name: str, *, search_context: Optional[SearchContext] = None
+) -> Optional[Path]:
+    """Return the path to the stub file for this module, if any."""
+    return await asyncio.to_thread(
+        finder.get_stub_file, module_name, search_context=search_context
+    )
+
+
+async def get_stub_names(
+    module_name: str, *, search_context: Optional[SearchContext] = None
+) -> Optional[parser.NameDict]:
+    """Given a module name, return a dictionary of names defined in that module."""
+    return await asyncio.to_thread(
+        parser.get_stub_names, module_name, search_context=search_context
+    )
+
+
+class AsyncResolver:
+    """Resolves names without blocking the event loop.
+
+    Modules are found and parsed on ``executor`` (the event loop's default
+    executor if it is None). Concurrent requests that need the same module share a
+    single load, so each module is parsed only once. Cancelling a request does not
+    cancel loads that other requests are waiting for; a load that is no longer
+    awaited still completes and fills the cache. Like a Resolver, it takes an
+    optional ``module_store`` to share parsed modules with other resolvers.
+
+    All methods must be called from the same event loop.
+
+    """
+
+    def __init__(
+        self,
+        search_context: Optional[SearchContext] = None,
+        *,
+        executor: Optional[Executor] = None,
+        module_store: Optional[ModuleStore] = None,
+    ) -> None:
+        if search_context is None:
+            search_context = get_search_context()
+        self.ctx = search_context
+        self.executor = executor
+        self._resolver = _NonBlockingResolver(search_context, module_store=module_store)
+        self._loads: dict[tuple[str, ModulePath], asyncio.Future[None]] = {}
+
+    async def get_module(self, module_name: ModulePath) -> Module:
+        return await self._retry(lambda: self._resolver.get_module(module_name))
+
+    async def module_exists(self, module_name: ModulePath) -> bool:
+        """Return whether there is a stub for this module, without parsing it."""
+        return await self._retry(lambda: self._resolver.module_exists(module_name))
+
+    async def get_name(self, module_name: ModulePath, name: str) -> ResolvedName:
+        resolved = await self._retry(lambda: self._resolver.get_name(module_name, name))
+        info = resolved.info if isinstance(resolved, ImportedInfo) else resolved
+        if isinstance(info, parser.NameInfo) and not parser._is_ast_loaded(info):
+            # load the AST node now, so that accessing it does not block
+            await self._run(lambda: info.ast)
+        return resolved
+
+    async def get_fully_qualified_name(self, name: str) -> ResolvedName:
+        """Public API."""
+        *path, tail = name.split(".")
+        return await self.get_name(ModulePath(tuple(path)), tail)
+
+    async def _retry(self, func: Callable[[], _T]) -> _T:
+        """Call func, loading whatever it needs from the file system until it
+        succeeds."""
+        while True:
+            result = _attempt(func)
+            if not isinstance(result, _Blocked):
+                return result
+            await self._load(result.kind, result.module_name)
+
+    def _load(self, kind: str, module_name: ModulePath) -> Awaitable[None]:
+        key = (kind, module_name)
+        load = self._loads.get(key)
+        if load is None:
+            if kind == "module":
+                coro = self._load_module(module_name)
+            else:
+                coro = self._load_exists(module_name)
+            load = asyncio.ensure_future(coro)
+            self._loads[key] = load
+            load.add_done_callback(functools.partial(self._load_done, key))
+        # cancelling one waiter should not cancel the load for the others
+        return asyncio.shield(load)
+
+    def _load_done(
+        self, key: tuple[str, ModulePath], load: "asyncio.Future[None]"
+    ) -> None:
+        del self._loads[key]
+        # failed loads are retried by the next request that needs them
+        if not load.cancelled():
+            load.exception()
+
+    async def _load_module(self, module_name: ModulePath) -> None:
+        await self._run(functools.partial(self._resolver.load_module, module_name))
+
+    async def _load_exists(self, module_name: ModulePath) -> None:
+        await self._run(functools.partial(self._resolver.load_exists, module_name))
+
+    def _run(self, func: Callable[[], _T]) -> "asyncio.Future[_T]":
+        return asyncio.get_running_loop().run_in_executor(self.executor, func)
+
+
+def _attempt(func: Callable[[], _T]) -> Union[_T, "_Blocked"]:
+    try:
+        return func()
+    except _Blocked as blocked:
+        return blocked
+
+
+class _Blocked(Exception):
+    """Raised when the _NonBlockingResolver needs to access the file system."""
+
+    def __init__(self, kind: str, module_name: ModulePath) -> None:
+        super().__init__(kind, module_name)
+        self.kind = kind
+        self.module_name = module_name
+
+
+class _NonBlockingResolver(Resolver):
+    """A Resolver that raises _Blocked instead of loading anything.
+
+    The AsyncResolver loads the missing data on an executor with load_module() or
+    load_exists(), which fill the same caches as a normal Resolver, before trying
+    again.
+
+    """
+
+    def get_module(self, module_name: ModulePath) -> Module:
+        if module_name not in self._module_cache:
+            raise _Blocked("module", module_name)
+        return super().get_module(module_name)
+
+    def module_exists(self, module_name: ModulePath) -> bool:
+        if module_name not in self._module_cache and (
+            module_name not in self._exists_cache
+        ):
+            raise _Blocked("exists", module_name)
+        return super().module_exists(module_name)
+
+    def load_module(self, module_name: ModulePath) -> None:
+        """Find and parse a module. Called on the executor."""
+        Resolver.get_module(self, module_name)
+
+    def load_exists(self, module_name: ModulePath) -> None:
+        """Check whether a module exists. Called on the executor."""
+        Resolver.module_exists(self, module_name)
@@ -0,0 +1,361 @@
+"""Find out which names a stub defines across several Python versions and platforms.
+
+Instead of collecting the names in a stub once for every combination of version
+and platform, the stub is parsed once into a symbol table (see
+parser.write_symbol_tables()) and its ``if`` and ``assert`` conditions are
+evaluated for each combination. Combinations that take the same branches are
+handled together, so every name is visited once. Imported names are resolved the
+same way, through the symbol tables of the modules they come from.
+
+"""
+
+import sys
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+from . import finder, parser
+from .finder import ModulePath, PythonVersion, SearchContext, get_search_context
+from .parser import ImportedName
+
+# A (version, platform) combination, like ((3, 12), "linux")
+Combination = tuple[PythonVersion, str]
+
+
+class NameAvailability(NamedTuple):
+    name: str
+    # combinations in which the module defines the name
+    combinations: frozenset[Combination]
+    # combinations in which the name is part of the module's public interface
+    exported: frozenset[Combination]
+    # where the name is imported from, and in which combinations
+    imports: dict[ImportedName, frozenset[Combination]]
+    # where the name is defined once imports are followed, as the defining module
+    # and the name there (None for a module), and in which combinations; left out
+    # in combinations in which the name cannot be resolved
+    resolved: dict[ImportedName, frozenset[Combination]]
+
+
+class ModuleAvailability(NamedTuple):
+    module_name: str
+    # combinations in which a stub for the module exists
+    combinations: frozenset[Combination]
+    names: dict[str, NameAvailability]
+
+
+def get_availability(
+    module_name: str,
+    *,
+    versions: Iterable[PythonVersion],
+    platforms: Iterable[str],
+    search_context: Optional[SearchContext] = None,
+) -> Optional[ModuleAvailability]:
+    """Return the names defined in a module in each version and platform.
+
+    The stub for each combination is found using search_context with its version
+    and platform replaced. Each stub file is parsed at most once, including the
+    stubs that imported names are resolved through. Returns None if there is no
+    stub for the module in any combination.
+
+    """
+    if search_context is None:
+        search_context = get_search_context()
+    platforms = list(platforms)
+    contexts = {
+        (version, platform): search_context._replace(version=version, platform=platform)
+        for version in versions
+        for platform in platforms
+    }
+    collector = _Collector(contexts)
+    module_path = ModulePath(tuple(module_name.split(".")))
+    module = collector.get_module(module_path)
+    if module is None:
+        return None
+    names = {
+        name: availability._replace(resolved=collector.resolve(module_path, name))
+        for name, availability in module.names.items()
+    }
+    return module._replace(names=names)
+
+
+class _Collector:
+    """Collects and resolves the names of modules for a set of combinations."""
+
+    def __init__(self, contexts: dict[Combination, SearchContext]) -> None:
+        self.contexts = contexts
+        # where stubs are found does not depend on the platform
+        by_version: dict[PythonVersion, finder.Finder] = {}
+        self.finders: dict[Combination, finder.Finder] = {}
+        for combination, ctx in contexts.items():
+            if combination[0] not in by_version:
+                by_version[combination[0]] = finder.Finder(ctx)
+            self.finders[combination] = by_version[combination[0]]
+        # the names of a module, which are not resolved yet
+        self._modules: dict[ModulePath, Optional[ModuleAvailability]] = {}
+        # module -> combinations in which it may have submodules, or a submodule
+        # -> combinations in which it exists
+        self._packages: dict[ModulePath, frozenset[Combination]] = {}
+        self._submodules: dict[ModulePath, frozenset[Combination]] = {}
+        self._resolved: dict[
+            tuple[ModulePath, str], dict[ImportedName, frozenset[Combination]]
+        ] = {}
+        # names being resolved -> their depth in the chain of imports
+        self._in_progress: dict[tuple[ModulePath, str], int] = {}
+        # the lowest depth of a name in progress that the current name led back to
+        self._lowest_cycle = sys.maxsize
+
+    def get_module(self, module_path: ModulePath) -> Optional[ModuleAvailability]:
+        if module_path not in self._modules:
+            self._modules[module_path] = self._collect(module_path)
+        return self._modules[module_path]
+
+    def _collect(self, module_path: ModulePath) -> Optional[ModuleAvailability]:
+        # different versions may use different stubs, for example from @python2
+        by_path: dict[Path, set[Combination]] = {}
+        for combination, stub_finder in self.finders.items():
+            path = stub_finder.find(module_path)
+            if path is not None:
+                by_path.setdefault(path, set()).add(combination)
+        if not by_path:
+            return None
+
+        # name -> [(combinations, is_exported, import target or None, is_class)]
+        definitions: dict[str, list[_Definition]] = {}
+        for path, combinations in by_path.items():
+            ctx = self.contexts[next(iter(combinations))]
+            walker = _Walker(self.contexts, module_path, path)
+            items = parser._get_symbol_table(module_path, path, ctx)
+            for name, definition in walker.walk(items, frozenset(combinations)):
+                definitions.setdefault(name, []).append(definition)
+            if walker.failed_asserts:
+                # like get_stub_names(), the module is empty where an assert fails
+                for name, defns in definitions.items():
+                    definitions[name] = [
+                        defn._replace(
+                            combinations=defn.combinations - walker.failed_asserts
+                        )
+                        for defn in defns
+                    ]
+
+        names = {}
+        for name, defns in definitions.items():
+            availability = _merge_definitions(name, defns)
+            if availability.combinations:
+                names[name] = availability
+        return ModuleAvailability(
+            ".".join(module_path), frozenset().union(*by_path.values()), names
+        )
+
+    def resolve(
+        self, module_path: ModulePath, name: str
+    ) -> dict[ImportedName, frozenset[Combination]]:
+        """Follow the imports that lead to a name's definition, like
+        Resolver.get_name() does in each combination."""
+        key = (module_path, name)
+        cached = self._resolved.get(key)
+        if cached is not None:
+            return cached
+        depth = self._in_progress.get(key)
+        if depth is not None:
+            # an import cycle in the combinations that led back here
+            self._lowest_cycle = min(self._lowest_cycle, depth)
+            return {}
+        depth = len(self._in_progress)
+        self._in_progress[key] = depth
+        outer_lowest_cycle = self._lowest_cycle
+        self._lowest_cycle = sys.maxsize
+        try:
+            resolved = self._resolve(module_path, name)
+        finally:
+            del self._in_progress[key]
+        # a name inside a cycle sees only part of the names in progress, so only
+        # the first name of the cycle gets a complete result
+        if self._lowest_cycle >= depth:
+            self._resolved[key] = resolved
+        self._lowest_cycle = min(outer_lowest_cycle, self._lowest_cycle)
+        return resolved
+
+    def _resolve(
+        self, module_path: ModulePath, name: str
+    ) -> dict[ImportedName, frozenset[Combination]]:
+        module = self.get_module(module_path)
+        availability = module.names.get(name) if module is not None else None
+        if availability is None:
+            return {}
+        resolved: dict[ImportedName, frozenset[Combination]] = {}
+        imported = frozenset().union(*availability.imports.values())
+        defined = availability.combinations - imported
+        if defined:
+            resolved[ImportedName(module_path, name)] = defined
+        for target, combinations in availability.imports.items():
+            for definition, target_combinations in self._resolve_import(
+                target, combinations
+            ):
+                resolved[definition] = (
+                    resolved.get(definition, frozenset()) | target_combinations
+                )
+        return resolved
+
+    def _resolve_import(
+        self, target: ImportedName, combinations: frozenset[Combination]
+    ) -> Iterator[tuple[ImportedName, frozenset[Combination]]]:
+        if target.name is None:
+            yield target, combinations
+            return
+        submodule = ModulePath((*target.module_name, target.name))
+        # like the Resolver, prefer a submodule to a name in the module
+        in_submodule = combinations & self._get_submodule_combinations(submodule)
+        if in_submodule:
+            yield ImportedName(submodule, None), in_submodule
+        combinations -= in_submodule
+        if not combinations:
+            return
+        for definition, definition_combinations in self.resolve(
+            target.module_name, target.name
+        ).items():
+            common = combinations & definition_combinations
+            if common:
+                yield definition, common
+
+    def _get_submodule_combinations(
+        self, module_path: ModulePath
+    ) -> frozenset[Combination]:
+        """Return the combinations in which a stub exists for a possible submodule."""
+        if module_path not in self._submodules:
+            parent = ModulePath(module_path[:-1])
+            if parent not in self._packages:
+                self._packages[parent] = frozenset(
+                    combination
+                    for combination, stub_finder in self.finders.items()
+                    if stub_finder.may_have_submodules(parent)
+                )
+            self._submodules[module_path] = frozenset(
+                combination
+                for combination in self._packages[parent]
+                if self.finders[combination].find(module_path) is not None
+            )
+        return self._submodules[module_path]
+
+
+class _Definition(NamedTuple):
+    combinations: frozenset[Combination]
+    is_exported: bool
+    target: Optional[ImportedName]
+    is_class: bool
+
+
+class _Walker:
+    """Evaluates a symbol table for a set of combinations at once."""
+
+    def __init__(
+        self,
+        contexts: dict[Combination, SearchContext],
+        module_name: ModulePath,
+        file_path: Path,
+    ) -> None:
+        self.contexts = contexts
+        self.module_name = module_name
+        self.file_path = file_path
+        self.failed_asserts: set[Combination] = set()
+
+    def walk(
+        self, items: list[Any], combinations: frozenset[Combination]
+    ) -> Iterator[tuple[str, _Definition]]:
+        for item in items:
+            kind = item[0]
+            if kind == "name":
+                _, name, is_exported, value, children = item
+                target = None
+                if value[0] == "import":
+                    target = ImportedName(ModulePath(tuple(value[1])), value[2])
+                yield name, _Definition(
+                    combinations, is_exported, target, children is not None
+                )
+            elif kind == "if":
+                _, condition, body, orelse = item
+                if_true = set()
+                if_false = set()
+                for combination in combinations:
+                    value = self._evaluate(condition, combination)
+                    if value is None or value:
+                        if_true.add(combination)
+                    if value is None or not value:
+                        if_false.add(combination)
+                if if_true:
+                    yield from self.walk(body, frozenset(if_true))
+                if if_false:
+                    yield from self.walk(orelse, frozenset(if_false))
+            elif kind == "assert":
+                for combination in combinations:
+                    if self._evaluate(item[1], combination) is False:
+                        self.failed_asserts.add(combination)
+            elif kind == "star":
+                yield from self._walk_import_star(
+                    ModulePath(tuple(item[1])), combinations
+                )
+            else:
+                raise ValueError(f"Invalid symbol table entry: {item}")
+
+    def _evaluate(self, condition: str, combination: Combination) -> Optional[bool]:
+        ctx = self.contexts[combination]
+        return parser.get_condition_cache(ctx).evaluate_source(
+            condition, file_path=self.file_path
+        )
+
+    def _walk_import_star(
+        self, source_module: ModulePath, combinations: frozenset[Combination]
+    ) -> Iterator[tuple[str, _Definition]]:
+        # the star-imported module may itself differ between combinations
+        by_name: dict[str, set[Combination]] = {}
+        for combination in combinations:
+            ctx = self.contexts[combination]
+            infos = parser._get_import_star_infos(
+                source_module, ctx, self.module_name, self.file_path
+            )
+            for info in infos:
+                by_name.setdefault(info.name, set()).add(combination)
+        for name, star_combinations in by_name.items():
+            yield name, _Definition(
+                frozenset(star_combinations),
+                True,
+                ImportedName(source_module, name),
+                False,
+            )
+
+
+def _merge_definitions(name: str, definitions: list[_Definition]) -> NameAvailability:
+    """Combine the definitions of a name like parser._merge_names() would."""
+    if len(definitions) == 1:
+        (defn,) = definitions
+        return NameAvailability(
+            name,
+            defn.combinations,
+            defn.combinations if defn.is_exported else frozenset(),
+            {} if defn.target is None else {defn.target: defn.combinations},
+            {},
+        )
+    # combination -> (is_exported, target, is_class) of the final definition
+    final: dict[Combination, tuple[bool, Optional[ImportedName], bool]] = {}
+    for defn in definitions:
+        for combination in defn.combinations:
+            existing = final.get(combination)
+            if existing is None or existing[1] is not None:
+                # new names and imported names are replaced
+                final[combination] = (defn.is_exported, defn.target, defn.is_class)
+            elif not existing[2] and not defn.is_class:
+                # overloads are exported if any definition is
+                final[combination] = (existing[0] or defn.is_exported, None, False)
+    exported = set()
+    imports: dict[ImportedName, set[Combination]] = {}
+    for combination, (is_exported, target, _) in final.items():
+        if is_exported:
+            exported.add(combination)
+        if target is not None:
+            imports.setdefault(target, set()).add(combination)
+    return NameAvailability(
+        name,
+        frozenset(final),
+        frozenset(exported),
+        {target: frozenset(combinations) for target, combinations in imports.items()},
+        {},
+    )
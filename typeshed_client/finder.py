@@ -1,14 +1,20 @@
 """This module is responsible for finding stub files."""
 
 import ast
+import hashlib
 import json
 import os
+import shutil
 import subprocess
 import sys
-from collections.abc import Generator, Iterable, Sequence
+import threading
+import zipfile
+from collections import OrderedDict
+from collections.abc import Callable, Collection, Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from pathlib import Path
-from typing import TYPE_CHECKING, NamedTuple, NewType, Optional, Union
+from typing import TYPE_CHECKING, Any, NamedTuple, NewType, Optional, Union
 
 import importlib_resources
 from typing_extensions import deprecated
@@ -25,6 +31,8 @@ if TYPE_CHECKING:
 else:
     _DirEntry = os.DirEntry
 
+_Entry = Union[_DirEntry, "_ArchiveEntry"]
+
 
 class SearchContext(NamedTuple):
     typeshed: Path
@@ -33,6 +41,8 @@ class SearchContext(NamedTuple):
     platform: str
     raise_on_warnings: bool = False
     allow_py_files: bool = False
+    module_index: Optional["ModuleIndex"] = None
+    listing_cache: Optional["DirectoryListingCache"] = None
 
     def is_python2(self) -> bool:
         return self.version[0] == 2
@@ -47,6 +57,8 @@ def get_search_context(
     platform: str = sys.platform,
     raise_on_warnings: bool = False,
     allow_py_files: bool = False,
+    cache_dir: Optional[Path] = None,
+    listing_cache: Optional["DirectoryListingCache"] = None,
 ) -> SearchContext:
     """Return a context for finding stubs. This context can be passed to other
     functions in this file.
@@ -63,6 +75,12 @@ def get_search_context(
       process's value.
     - raise_on_warnings: Raise an error for any warnings encountered by the parser.
     - allow_py_files: Search for names in .py files on the path.
+    - cache_dir: Directory in which to store a persistent index of the stub files
+      available in this context (see ``get_module_index``) and the ``sys.path`` of
+      ``python_executable``. By default, no index is used and every lookup
+      searches the file system.
+    - listing_cache: A ``DirectoryListingCache`` used to answer questions about the
+      existence of files without a system call for each lookup.
 
     """
     if version is None:
@@ -70,23 +88,99 @@ def get_search_context(
     if search_path is None:
         if python_executable is None:
             python_executable = sys.executable
-        raw_path = subprocess.check_output(
-            [python_executable, "-c", "import sys, json; print(json.dumps(sys.path))"]
-        )
-        search_path = [Path(path) for path in json.loads(raw_path) if path]
+        search_path = [
+            Path(path) for path in _get_sys_path(python_executable, cache_dir)
+        ]
     else:
         if python_executable is not None:
             raise ValueError("python_executable is ignored if search_path is given")
     if typeshed is None:
         typeshed = find_typeshed()
-    return SearchContext(
+    ctx = SearchContext(
         typeshed=typeshed,
         search_path=search_path,
         version=version,
         platform=platform,
         raise_on_warnings=raise_on_warnings,
         allow_py_files=allow_py_files,
+        listing_cache=listing_cache,
     )
+    if cache_dir is not None:
+        ctx = ctx._replace(module_index=get_module_index(ctx, cache_dir))
+    return ctx
+
+
+# Environment variables that affect the sys.path of a new interpreter
+_SYS_PATH_ENV_VARS = (
+    "PYTHONPATH",
+    "PYTHONHOME",
+    "PYTHONUSERBASE",
+    "PYTHONNOUSERSITE",
+    "PYTHONSAFEPATH",
+    "VIRTUAL_ENV",
+)
+_sys_path_cache: dict[str, tuple[dict[str, int], list[str]]] = {}
+
+
+def _get_sys_path(python_executable: str, cache_dir: Optional[Path]) -> list[str]:
+    """Return the sys.path of the given interpreter.
+
+    Running the interpreter is slow, so the result is cached in memory and, if
+    cache_dir is given, on disk. A cached result is reused as long as the
+    interpreter, its pyvenv.cfg, the directories on its path and the .pth files
+    in them are unchanged.
+
+    """
+    # A bare name like "python3" depends on PATH, and a relative path on the
+    # working directory. Keep the unresolved location too: a virtual environment's
+    # interpreter is a symlink, and its pyvenv.cfg is found next to the link.
+    executable = shutil.which(python_executable) or python_executable
+    python_executable = os.path.abspath(executable)
+    key = json.dumps(
+        [
+            python_executable,
+            os.path.realpath(python_executable),
+            *(os.environ.get(var) for var in _SYS_PATH_ENV_VARS),
+        ]
+    )
+    cache_file = None
+    if cache_dir is not None:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        cache_file = cache_dir / f"sys-path-{digest[:16]}.json"
+    cached = _sys_path_cache.get(key)
+    if cached is None and cache_file is not None:
+        try:
+            data = json.loads(cache_file.read_text(encoding="utf-8"))
+            cached = (data["mtimes"], data["sys_path"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    if cached is not None and not _mtimes_changed(cached[0]):
+        _sys_path_cache[key] = cached
+        return cached[1]
+
+    raw_path = subprocess.check_output(
+        [python_executable, "-c", "import sys, json; print(json.dumps(sys.path))"]
+    )
+    sys_path = [path for path in json.loads(raw_path) if path]
+    mtimes: dict[str, int] = {}
+    _record_mtime(python_executable, mtimes)
+    executable_dir = Path(python_executable).parent
+    for directory in (executable_dir, executable_dir.parent):
+        _record_mtime(directory / "pyvenv.cfg", mtimes)
+    for path in sys_path:
+        _record_mtime(path, mtimes)
+        for entry in safe_scandir(Path(path)):
+            if entry.name.endswith(".pth"):
+                _record_mtime(entry.path, mtimes)
+    _sys_path_cache[key] = (mtimes, sys_path)
+    if cache_file is not None:
+        try:
+            _write_atomically(
+                cache_file, json.dumps({"mtimes": mtimes, "sys_path": sys_path})
+            )
+        except OSError:
+            pass
+    return sys_path
 
 
 def get_stub_file(
@@ -109,90 +203,97 @@ def get_stub_ast(
 
 
 def get_all_stub_files(
-    search_context: Optional[SearchContext] = None,
+    search_context: Optional[SearchContext] = None, *, max_workers: Optional[int] = None
 ) -> Iterable[tuple[str, Path]]:
     """Return paths to all stub files for a given Python version.
 
     Return pairs of (module name, module path).
 
+    If max_workers is given, directory trees are scanned concurrently on a thread
+    pool with that many threads. The results are the same either way.
+
     """
     if search_context is None:
         search_context = get_search_context()
 
+    sources = _get_stub_file_sources(search_context)
     seen: set[str] = set()
+    if max_workers is None:
+        for source in sources:
+            for module_name, path in _scan_stub_file_source(source):
+                if module_name not in seen:
+                    yield (module_name, path)
+                    seen.add(module_name)
+        return
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for stub_files in executor.map(_scan_stub_file_source, sources):
+            for module_name, path in stub_files:
+                if module_name not in seen:
+                    yield (module_name, path)
+                    seen.add(module_name)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _StubFileSource(NamedTuple):
+    path: Path
+    # None if path is a single stub file
+    root: Optional[Path]
+
+
+def _get_stub_file_sources(search_context: SearchContext) -> list[_StubFileSource]:
+    """Return the files and directory trees that may contain stubs, in order of
+    precedence."""
+    sources: list[_StubFileSource] = []
     # third-party packages
+    search_path_entries = [
+        (search_path_entry, list(safe_scandir(search_path_entry)))
+        for search_path_entry in search_context.search_path
+    ]
     for stub_packages in (True, False):
-        for search_path_entry in search_context.search_path:
-            if not safe_exists(search_path_entry):
-                continue
-            for entry in safe_scandir(search_path_entry):
+        for search_path_entry, entries in search_path_entries:
+            for entry in entries:
                 if not safe_is_dir(entry):
-                    path = Path(entry)
                     if (
                         not stub_packages
+                        and entry.name.endswith(".pyi")
                         and safe_is_file(entry)
-                        and path.suffix == ".pyi"
                     ):
-                        module_name = path.stem
-                        if module_name in seen:
-                            continue
-                        yield (module_name, path)
-                        seen.add(module_name)
+                        sources.append(_StubFileSource(Path(entry), None))
                     continue
                 condition = (
                     entry.name.endswith("-stubs")
                     if stub_packages
                     else entry.name.isidentifier()
                 )
-                if not condition:
-                    continue
-                seen = yield from _get_all_stub_files_from_directory(
-                    entry, search_path_entry, seen
-                )
+                if condition:
+                    sources.append(_StubFileSource(Path(entry), search_path_entry))
 
     # typeshed
-    versions = get_typeshed_versions(search_context.typeshed)
+    available = _get_typeshed_dirs(search_context.typeshed, search_context.version)
     typeshed_dirs = [search_context.typeshed]
     if search_context.is_python2():
         typeshed_dirs.insert(0, search_context.typeshed / "@python2")
 
     for typeshed_dir in typeshed_dirs:
         for entry in safe_scandir(typeshed_dir):
-            if safe_is_dir(entry) and entry.name.isidentifier():
-                module_name = entry.name
-            elif safe_is_file(entry) and entry.name.endswith(".pyi"):
-                module_name = entry.name[: -len(".pyi")]
-            else:
-                continue
-            version = versions[module_name]
-            if search_context.version < version.min:
-                continue
-            if version.max is not None and search_context.version > version.max:
-                continue
-            if (
-                search_context.is_python2()
-                and typeshed_dir.name != "@python2"
-                and version.in_python2
-            ):
+            module_name = entry.name.removesuffix(".pyi")
+            # Skip modules that do not exist in this version before looking further
+            if typeshed_dir not in available.get(module_name, ()):
                 continue
-            if safe_is_dir(entry):
-                seen = yield from _get_all_stub_files_from_directory(
-                    entry, typeshed_dir, seen
-                )
-            else:
-                path = Path(entry)
-                module_name = _path_to_module(path.relative_to(typeshed_dir))
-                if module_name in seen:
-                    continue
-                yield (module_name, path)
-                seen.add(module_name)
+            if safe_is_dir(entry) and entry.name.isidentifier():
+                sources.append(_StubFileSource(Path(entry), typeshed_dir))
+            elif entry.name.endswith(".pyi") and safe_is_file(entry):
+                sources.append(_StubFileSource(Path(entry), None))
+    return sources
 
 
-def _get_all_stub_files_from_directory(
-    directory: _DirEntry, root_directory: Path, seen: set[str]
-) -> Generator[tuple[str, Path], None, set[str]]:
-    new_seen = set(seen)
-    to_do: list[os.PathLike[str]] = [directory]
+def _scan_stub_file_source(source: _StubFileSource) -> list[tuple[str, Path]]:
+    if source.root is None:
+        return [(source.path.stem, source.path)]
+    stub_files = []
+    to_do: list[Path] = [source.path]
     while to_do:
         current_dir = to_do.pop()
         for dir_entry in safe_scandir(current_dir):
@@ -203,12 +304,9 @@ def _get_all_stub_files_from_directory(
                 path = Path(dir_entry)
                 if path.suffix != ".pyi":
                     continue
-                module_name = _path_to_module(path.relative_to(root_directory))
-                if module_name in new_seen:
-                    continue
-                yield (module_name, path)
-                new_seen.add(module_name)
-    return new_seen
+                module_name = _path_to_module(path.relative_to(source.root))
+                stub_files.append((module_name, path))
+    return stub_files
 
 
 @lru_cache
@@ -234,94 +332,278 @@ def get_search_path(typeshed_dir: Path, pyversion: tuple[int, int]) -> tuple[Pat
 
 def safe_exists(path: Path) -> bool:
     """Return whether a path exists, assuming it doesn't if we get an error."""
+    in_archive = _split_archive_path(path)
+    if in_archive is not None:
+        archive, member = in_archive
+        return archive.exists(member)
     try:
         return path.exists()
     except OSError:
         return False
 
 
-def safe_is_dir(path: Union[Path, _DirEntry]) -> bool:
+def safe_is_dir(path: Union[Path, _Entry]) -> bool:
     """Return whether a path is a directory, assuming it isn't if we get an error."""
+    if isinstance(path, Path):
+        in_archive = _split_archive_path(path)
+        if in_archive is not None:
+            archive, member = in_archive
+            return archive.is_dir(member)
     try:
         return path.is_dir()
     except OSError:
         return False
 
 
-def safe_is_file(path: Union[Path, _DirEntry]) -> bool:
+def safe_is_file(path: Union[Path, _Entry]) -> bool:
     """Return whether a path is a file, assuming it isn't if we get an error."""
+    if isinstance(path, Path):
+        in_archive = _split_archive_path(path)
+        if in_archive is not None:
+            archive, member = in_archive
+            return archive.exists(member) and not archive.is_dir(member)
     try:
         return path.is_file()
     except OSError:
         return False
 
 
-def safe_scandir(path: "os.PathLike[str]") -> Iterable[_DirEntry]:
+def safe_scandir(path: "os.PathLike[str]") -> Iterable[_Entry]:
     """Return an iterator over the entries in a directory, or no entries if we get an error."""
     try:
-        with os.scandir(path) as sd:
-            yield from sd
+        yield from _scandir(path)
     except OSError:
         pass
 
 
+def _scandir(path: "os.PathLike[str]") -> Iterable[_Entry]:
+    in_archive = _split_archive_path(path)
+    if in_archive is not None:
+        archive, member = in_archive
+        return archive.scandir(member)
+    with os.scandir(path) as sd:
+        return list(sd)
+
+
 def get_stub_file_name(
     module_name: ModulePath, search_context: SearchContext
 ) -> Optional[Path]:
+    index = search_context.module_index
+    if index is not None and index.matches(search_context):
+        return index.find(module_name)
+    return _find_stub_file(
+        module_name,
+        search_context,
+        _get_typeshed_dirs(search_context.typeshed, search_context.version),
+        _get_exists_function(search_context),
+    )
+
+
+def may_have_submodules(module_name: ModulePath, search_context: SearchContext) -> bool:
+    """Return whether there is any directory that could contain submodules of
+    this module.
+
+    If this returns False, get_stub_file_name() returns None for every submodule of
+    the module.
+
+    """
+    exists = _get_exists_function(search_context)
+    top_level_name, *rest = module_name
+    typeshed_dirs = _get_typeshed_dirs(search_context.typeshed, search_context.version)
+    for typeshed_dir in typeshed_dirs.get(top_level_name, ()):
+        if exists(typeshed_dir.joinpath(*module_name)):
+            return True
+    for path in search_context.search_path:
+        for root in (path / f"{top_level_name}-stubs", path / top_level_name):
+            if exists(root.joinpath(*rest)):
+                return True
+    return False
+
+
+def _find_stub_file(
+    module_name: ModulePath,
+    search_context: SearchContext,
+    typeshed_dirs: dict[str, tuple[Path, ...]],
+    exists: Callable[[Path], bool],
+    roots: Optional[tuple[Iterable[Path], Iterable[Path]]] = None,
+) -> Optional[Path]:
+    """Search the file system for the stub file for a module.
+
+    roots gives the stub packages and packages on the search path that provide the
+    module's top-level name; if it is None, they are looked for as needed.
+
+    """
     # https://typing.python.org/en/latest/spec/distributing.html#import-resolution-ordering
     # typeshed_client doesn't support 1 (MYPYPATH equivalent) and 2 (user code)
     top_level_name, *rest = module_name
     rest_module_path = ModulePath(tuple(rest))
 
     # 3. typeshed
-    stub = _find_stub_in_typeshed(module_name, search_context)
-    if stub is not None:
-        return stub
+    for typeshed_dir in typeshed_dirs.get(top_level_name, ()):
+        stub = _find_file_in_dir(typeshed_dir, module_name, "pyi", exists)
+        if stub is not None:
+            return stub
 
+    if roots is None:
+        roots = _find_roots(search_context.search_path, top_level_name, exists)
+    stubs_packages, packages = roots
     # 4. stub packages
-    stubs_package = f"{top_level_name}-stubs"
-    for path in search_context.search_path:
-        stubdir = path / stubs_package
-        if safe_exists(stubdir):
-            stub = _find_file_in_dir(stubdir, rest_module_path, "pyi")
-            if stub is not None:
-                return stub
+    for stubdir in stubs_packages:
+        stub = _find_file_in_dir(stubdir, rest_module_path, "pyi", exists)
+        if stub is not None:
+            return stub
 
     # 5. stubs or .py files in normal packages
-    for path in search_context.search_path:
-        stubdir = path / top_level_name
-        if safe_exists(stubdir):
-            stub = _find_file_in_dir(stubdir, rest_module_path, "pyi")
-            if stub is not None:
-                return stub
-            if search_context.allow_py_files:
-                py_file = _find_file_in_dir(stubdir, rest_module_path, "py")
-                if py_file is not None:
-                    return py_file
+    for stubdir in packages:
+        stub = _find_file_in_dir(stubdir, rest_module_path, "pyi", exists)
+        if stub is not None:
+            return stub
+        if search_context.allow_py_files:
+            py_file = _find_file_in_dir(stubdir, rest_module_path, "py", exists)
+            if py_file is not None:
+                return py_file
 
     return None
 
 
-def _find_stub_in_typeshed(
-    module_name: ModulePath, search_context: SearchContext
-) -> Optional[Path]:
-    versions = get_typeshed_versions(search_context.typeshed)
-    top_level_name = module_name[0]
-    if top_level_name not in versions:
-        return None
-    version = versions[top_level_name]
-    if search_context.version < version.min:
-        return None
-    if version.max is not None and search_context.version > version.max:
-        return None
+def _find_roots(
+    search_path: Sequence[Path], top_level_name: str, exists: Callable[[Path], bool]
+) -> tuple[Iterator[Path], Iterator[Path]]:
+    """Return iterators over the stub packages and packages on the search path that
+    provide a top-level name."""
+    return (
+        (
+            path / f"{top_level_name}-stubs"
+            for path in search_path
+            if exists(path / f"{top_level_name}-stubs")
+        ),
+        (
+            path / top_level_name
+            for path in search_path
+            if exists(path / top_level_name)
+        ),
+    )
 
-    if search_context.version[0] == 2:
-        python2_dir = search_context.typeshed / "@python2"
-        stub = _find_file_in_dir(python2_dir, module_name, "pyi")
-        if stub is not None or version.in_python2:
-            return stub
 
-    return _find_file_in_dir(search_context.typeshed, module_name, "pyi")
+class Finder:
+    """Finds stub files for a single SearchContext.
+
+    Everything that depends only on the context is computed once: the typeshed
+    modules that exist in the context's version and the directories to search for
+    them, and for each top-level name, the stub packages and packages on the
+    search path that provide it. Results of ``find()`` are memoized, so repeated
+    lookups are dictionary hits. Call ``invalidate()`` after the file system
+    changes.
+
+    """
+
+    def __init__(self, search_context: SearchContext) -> None:
+        self.search_context = search_context
+        index = search_context.module_index
+        if index is not None and not index.matches(search_context):
+            index = None
+        self._module_index = index
+        self._exists = _get_exists_function(search_context)
+        # top-level typeshed module -> directories to search for it, in order
+        self._typeshed_dirs = _get_typeshed_dirs(
+            search_context.typeshed, search_context.version
+        )
+        # top-level name -> (stub package roots, package roots)
+        self._roots: dict[str, tuple[list[Path], list[Path]]] = {}
+        self._results: dict[ModulePath, Optional[Path]] = {}
+
+    def __repr__(self) -> str:
+        return f"<Finder with {len(self._results)} cached lookups>"
+
+    @property
+    def typeshed_modules(self) -> Collection[str]:
+        """The top-level modules in typeshed that exist in the context's version."""
+        return self._typeshed_dirs.keys()
+
+    def find(self, module_name: ModulePath) -> Optional[Path]:
+        """Return the stub file for this module, or None if there is none."""
+        try:
+            return self._results[module_name]
+        except KeyError:
+            pass
+        if self._module_index is not None:
+            stub = self._module_index.find(module_name)
+        else:
+            stub = self._find_uncached(module_name)
+        self._results[module_name] = stub
+        return stub
+
+    def _find_uncached(self, module_name: ModulePath) -> Optional[Path]:
+        return _find_stub_file(
+            module_name,
+            self.search_context,
+            self._typeshed_dirs,
+            self._exists,
+            self._get_roots(module_name[0]),
+        )
+
+    def may_have_submodules(self, module_name: ModulePath) -> bool:
+        """Return whether there is any directory that could contain submodules of
+        this module."""
+        top_level_name, *rest = module_name
+        for typeshed_dir in self._typeshed_dirs.get(top_level_name, ()):
+            if self._exists(typeshed_dir.joinpath(*module_name)):
+                return True
+        stubs_packages, packages = self._get_roots(top_level_name)
+        return any(
+            self._exists(root.joinpath(*rest)) for root in [*stubs_packages, *packages]
+        )
+
+    def _get_roots(self, top_level_name: str) -> tuple[list[Path], list[Path]]:
+        try:
+            return self._roots[top_level_name]
+        except KeyError:
+            pass
+        stubs_packages, packages = _find_roots(
+            self.search_context.search_path, top_level_name, self._exists
+        )
+        roots = (list(stubs_packages), list(packages))
+        self._roots[top_level_name] = roots
+        return roots
+
+    def invalidate(self, module_name: Optional[ModulePath] = None) -> None:
+        """Forget the results for a module and its submodules, or for all modules,
+        so that later lookups search the file system again."""
+        if not module_name:
+            self._roots.clear()
+            self._results.clear()
+            return
+        self._roots.pop(module_name[0], None)
+        for cached in list(self._results):
+            if cached[: len(module_name)] == module_name:
+                del self._results[cached]
+
+
+def _get_exists_function(search_context: SearchContext) -> Callable[[Path], bool]:
+    if search_context.listing_cache is not None:
+        return search_context.listing_cache.exists
+    return safe_exists
+
+
+@lru_cache
+def _get_typeshed_dirs(
+    typeshed: Path, version: PythonVersion
+) -> dict[str, tuple[Path, ...]]:
+    """Return the directories to search for each top-level typeshed module that
+    exists in this version, in order of precedence."""
+    typeshed_dirs: dict[str, tuple[Path, ...]] = {}
+    for name, version_data in get_typeshed_versions(typeshed).items():
+        if version < version_data.min:
+            continue
+        if version_data.max is not None and version > version_data.max:
+            continue
+        if version[0] != 2:
+            typeshed_dirs[name] = (typeshed,)
+        elif version_data.in_python2:
+            typeshed_dirs[name] = (typeshed / "@python2",)
+        else:
+            typeshed_dirs[name] = (typeshed / "@python2", typeshed)
+    return typeshed_dirs
 
 
 class _VersionData(NamedTuple):
@@ -333,26 +615,23 @@ class _VersionData(NamedTuple):
 
 @lru_cache
 def get_typeshed_versions(typeshed: Path) -> dict[str, _VersionData]:
+    _register_typeshed_archive(typeshed)
     versions = {}
-    try:
-        python2_files = set(os.listdir(typeshed / "@python2"))
-    except FileNotFoundError:
-        python2_files = set()
-    with (typeshed / "VERSIONS").open() as f:
-        for line in f:
-            line = line.split("#")[0].strip()
-            if not line:
-                continue
-            module, version = line.split(": ")
-            if "-" in version:
-                min_version_str, max_version_str = version.split("-")
-            else:
-                min_version_str = version
-                max_version_str = None
-            max_version = _parse_version(max_version_str) if max_version_str else None
-            min_version = _parse_version(min_version_str)
-            python2_only = module in python2_files or module + ".pyi" in python2_files
-            versions[module] = _VersionData(min_version, max_version, python2_only)
+    python2_files = {entry.name for entry in safe_scandir(typeshed / "@python2")}
+    for line in _read_text(typeshed / "VERSIONS").splitlines():
+        line = line.split("#")[0].strip()
+        if not line:
+            continue
+        module, version = line.split(": ")
+        if "-" in version:
+            min_version_str, max_version_str = version.split("-")
+        else:
+            min_version_str = version
+            max_version_str = None
+        max_version = _parse_version(max_version_str) if max_version_str else None
+        min_version = _parse_version(min_version_str)
+        python2_only = module in python2_files or module + ".pyi" in python2_files
+        versions[module] = _VersionData(min_version, max_version, python2_only)
     return versions
 
 
@@ -362,35 +641,618 @@ def _parse_version(version: str) -> PythonVersion:
 
 
 def _find_file_in_dir(
-    stubdir: Path, module: ModulePath, extension: str
+    stubdir: Path,
+    module: ModulePath,
+    extension: str,
+    exists: Callable[[Path], bool] = safe_exists,
 ) -> Optional[Path]:
     if not module:
         init_name = stubdir / f"__init__.{extension}"
-        if safe_exists(init_name):
+        if exists(init_name):
             return init_name
         return None
     if len(module) == 1:
         stub_name = stubdir / f"{module[0]}.{extension}"
-        if safe_exists(stub_name):
+        if exists(stub_name):
             return stub_name
     next_name, *rest = module
     next_dir = stubdir / next_name
-    if safe_exists(next_dir):
-        return _find_file_in_dir(next_dir, ModulePath(tuple(rest)), extension)
+    if exists(next_dir):
+        return _find_file_in_dir(next_dir, ModulePath(tuple(rest)), extension, exists)
     return None
 
 
+class DirectoryListingCache:
+    """In-memory snapshot of directory listings.
+
+    Each directory is read once with ``os.scandir``; afterwards, questions about
+    the existence of its entries are answered from memory. At most ``maxsize``
+    directories are kept, with the least recently used listings evicted first.
+    Call ``invalidate()`` after the file system changes.
+
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self._listings: OrderedDict[str, Optional[dict[str, bool]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"<DirectoryListingCache with {len(self._listings)} directories>"
+
+    def __getstate__(self) -> dict[str, Any]:
+        # search contexts are pickled to send them to worker processes
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def listing(self, directory: Path) -> Optional[dict[str, bool]]:
+        """Return a mapping from entry names to whether they are directories.
+
+        Return None if the directory cannot be read.
+
+        """
+        key = str(directory)
+        with self._lock:
+            try:
+                listing = self._listings[key]
+            except KeyError:
+                pass
+            else:
+                self._listings.move_to_end(key)
+                return listing
+        try:
+            listing = {
+                entry.name: safe_is_dir(entry)
+                for entry in _scandir(directory)
+                # skip broken symlinks, which Path.exists() also ignores
+                if not entry.is_symlink() or os.path.exists(entry.path)
+            }
+        except OSError:
+            listing = None
+        with self._lock:
+            self._listings[key] = listing
+            if len(self._listings) > self.maxsize:
+                self._listings.popitem(last=False)
+        return listing
+
+    def exists(self, path: Path) -> bool:
+        """Return whether a path exists, according to the cached listings."""
+        parent = path.parent
+        if parent == path:
+            return safe_exists(path)
+        listing = self.listing(parent)
+        return listing is not None and path.name in listing
+
+    def is_dir(self, path: Path) -> bool:
+        """Return whether a path is a directory, according to the cached listings."""
+        parent = path.parent
+        if parent == path:
+            return safe_is_dir(path)
+        listing = self.listing(parent)
+        return listing is not None and listing.get(path.name, False)
+
+    def invalidate(self, directory: Optional[Path] = None) -> None:
+        """Forget the listing of a directory, or of all directories."""
+        with self._lock:
+            if directory is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(str(directory), None)
+
+
+_MODULE_INDEX_FORMAT = 1
+
+
+class ModuleIndex:
+    """Precomputed mapping from module names to stub files for a SearchContext.
+
+    The index is built by scanning every relevant directory once. It records the
+    modification time of each directory it scanned so that it can later be
+    checked for staleness without repeating the scan. The bundled copy of typeshed
+    never changes, so its directories are not recorded.
+
+    """
+
+    def __init__(
+        self,
+        key: dict[str, object],
+        modules: dict[ModulePath, Path],
+        directory_mtimes: dict[str, int],
+    ) -> None:
+        self.key = key
+        self.modules = modules
+        self.directory_mtimes = directory_mtimes
+
+    def __repr__(self) -> str:
+        return f"<ModuleIndex with {len(self.modules)} modules>"
+
+    def find(self, module_name: ModulePath) -> Optional[Path]:
+        """Return the stub file for this module, or None if there is none."""
+        return self.modules.get(module_name)
+
+    def matches(self, search_context: SearchContext) -> bool:
+        """Return whether this index was built for the given context."""
+        return self.key == _module_index_key(search_context)
+
+    def is_stale(self) -> bool:
+        """Return whether any of the indexed directories has changed."""
+        return _mtimes_changed(self.directory_mtimes)
+
+    def save(self, path: Path) -> None:
+        """Write the index to disk."""
+        data = {
+            "format": _MODULE_INDEX_FORMAT,
+            "key": self.key,
+            "modules": {
+                ".".join(module): str(stub) for module, stub in self.modules.items()
+            },
+            "directory_mtimes": self.directory_mtimes,
+        }
+        _write_atomically(path, json.dumps(data))
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ModuleIndex"]:
+        """Read an index from disk, returning None if it is missing or unreadable."""
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("format") != _MODULE_INDEX_FORMAT:
+            return None
+        modules = {
+            ModulePath(tuple(module.split("."))): Path(stub)
+            for module, stub in data["modules"].items()
+        }
+        return cls(data["key"], modules, data["directory_mtimes"])
+
+
+def get_module_index(search_context: SearchContext, cache_dir: Path) -> ModuleIndex:
+    """Return an up-to-date module index for this context.
+
+    A previously saved index in ``cache_dir`` is reused if it is still fresh;
+    otherwise a new index is built and saved there.
+
+    """
+    key = _module_index_key(search_context)
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    path = cache_dir / f"module-index-{digest[:16]}.json"
+    index = ModuleIndex.load(path)
+    if index is not None and index.key == key and not index.is_stale():
+        return index
+    index = build_module_index(search_context)
+    try:
+        index.save(path)
+    except OSError:
+        pass
+    return index
+
+
+def build_module_index(search_context: SearchContext) -> ModuleIndex:
+    """Scan the file system and build a module index for this context.
+
+    The index gives the same results as ``get_stub_file_name`` would give for the
+    state of the file system at the time the index is built.
+
+    """
+    directory_mtimes: dict[str, int] = {}
+    modules: dict[ModulePath, Path] = {}
+
+    # typeshed
+    typeshed_mtimes = (
+        None if search_context.typeshed == find_typeshed() else directory_mtimes
+    )
+    available = _get_typeshed_dirs(search_context.typeshed, search_context.version)
+    typeshed_dirs = [search_context.typeshed]
+    if search_context.is_python2():
+        typeshed_dirs.insert(0, search_context.typeshed / "@python2")
+    for typeshed_dir in typeshed_dirs:
+        typeshed_files, _ = _scan_module_files(typeshed_dir, typeshed_mtimes)
+        for module, path in typeshed_files.items():
+            if module and typeshed_dir in available.get(module[0], ()):
+                modules.setdefault(module, path)
+
+    # stub packages
+    for search_path_entry in search_context.search_path:
+        _record_mtime(search_path_entry, directory_mtimes)
+        for entry in safe_scandir(search_path_entry):
+            if entry.name.endswith("-stubs") and safe_is_dir(entry):
+                top_level_name = entry.name[: -len("-stubs")]
+                stub_files, _ = _scan_module_files(Path(entry), directory_mtimes)
+                for module, path in stub_files.items():
+                    modules.setdefault(ModulePath((top_level_name, *module)), path)
+
+    # stubs or .py files in normal packages
+    for search_path_entry in search_context.search_path:
+        for entry in safe_scandir(search_path_entry):
+            if not entry.name.isidentifier() or not safe_is_dir(entry):
+                continue
+            stub_files, py_files = _scan_module_files(Path(entry), directory_mtimes)
+            for module, path in stub_files.items():
+                modules.setdefault(ModulePath((entry.name, *module)), path)
+            if search_context.allow_py_files:
+                for module, path in py_files.items():
+                    modules.setdefault(ModulePath((entry.name, *module)), path)
+
+    return ModuleIndex(_module_index_key(search_context), modules, directory_mtimes)
+
+
+def _module_index_key(search_context: SearchContext) -> dict[str, object]:
+    return {
+        "typeshed": str(search_context.typeshed),
+        "search_path": [str(path) for path in search_context.search_path],
+        "version": list(search_context.version),
+        "allow_py_files": search_context.allow_py_files,
+    }
+
+
+def _record_mtime(
+    path: "Union[str, os.PathLike[str]]", mtimes: Optional[dict[str, int]]
+) -> None:
+    if mtimes is None:
+        return
+    try:
+        mtimes[os.fspath(path)] = os.stat(path).st_mtime_ns
+    except OSError:
+        mtimes[os.fspath(path)] = -1
+
+
+def _write_atomically(path: Path, data: Union[str, bytes]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    if isinstance(data, str):
+        tmp_path.write_text(data, encoding="utf-8")
+    else:
+        tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def _mtimes_changed(mtimes: dict[str, int]) -> bool:
+    """Return whether any of the paths recorded with _record_mtime has changed."""
+    for path, mtime in mtimes.items():
+        try:
+            current = os.stat(path).st_mtime_ns
+        except OSError:
+            current = -1
+        if current != mtime:
+            return True
+    return False
+
+
+def _scan_module_files(
+    root: Path, directory_mtimes: Optional[dict[str, int]]
+) -> tuple[dict[ModulePath, Path], dict[ModulePath, Path]]:
+    """Find all .pyi and .py files under root, keyed by their module path.
+
+    As in ``_find_file_in_dir``, ``a/b.pyi`` takes precedence over
+    ``a/b/__init__.pyi``.
+
+    """
+    modules: dict[str, dict[ModulePath, Path]] = {"pyi": {}, "py": {}}
+    packages: dict[str, dict[ModulePath, Path]] = {"pyi": {}, "py": {}}
+    to_do: list[tuple[Path, tuple[str, ...]]] = [(root, ())]
+    while to_do:
+        directory, parts = to_do.pop()
+        _record_mtime(directory, directory_mtimes)
+        for entry in safe_scandir(directory):
+            if safe_is_dir(entry):
+                if entry.name.isidentifier():
+                    to_do.append((Path(entry), (*parts, entry.name)))
+                continue
+            stem, _, extension = entry.name.rpartition(".")
+            if (
+                extension not in modules
+                or not stem.isidentifier()
+                or not safe_is_file(entry)
+            ):
+                continue
+            if stem == "__init__":
+                packages[extension][ModulePath(parts)] = Path(entry)
+            else:
+                modules[extension][ModulePath((*parts, stem))] = Path(entry)
+    return ({**packages["pyi"], **modules["pyi"]}, {**packages["py"], **modules["py"]})
+
+
 def find_typeshed() -> Path:
     path = importlib_resources.files("typeshed_client") / "typeshed"
     assert isinstance(path, Path), repr(path)
+    if not path.is_dir():
+        archive = path.with_name("typeshed.zip")
+        if archive.is_file():
+            return archive
     return path
 
 
+class ASTCacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    # total size of the cached stub files, in bytes
+    size: int
+
+
+class ASTCache:
+    """Process-wide cache of parsed stub files.
+
+    Entries are keyed by path and checked against the file's modification time and
+    size (or, inside an archive, its CRC and size), so edited stubs are parsed
+    again. The cache holds at most ``maxsize`` trees and, if ``max_bytes`` is not
+    None, trees for at most that many bytes of source; the least recently used
+    trees are evicted first. A tree takes about 50 times the size of its source, so
+    the default budget of 1 MiB of source keeps the cache to roughly 50 MB. A
+    ``maxsize`` of 0 disables caching. Changes to the limits take effect at the next
+    insertion.
+
+    The cached trees are shared by all callers and must not be modified; the public
+    parse_stub_file() and get_stub_ast() return trees of their own.
+
+    """
+
+    def __init__(self, maxsize: int = 256, max_bytes: Optional[int] = 1 << 20) -> None:
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        # path -> (stamp, size, tree)
+        self._trees: OrderedDict[str, tuple[tuple[int, int], int, ast.Module]] = (
+            OrderedDict()
+        )
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"<ASTCache with {len(self._trees)} trees>"
+
+    def parse(self, path: Path) -> ast.Module:
+        """Return the AST for a stub file, parsing it only if needed."""
+        key = os.fspath(path)
+        stamp = _file_stamp(path)
+        with self._lock:
+            entry = self._trees.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._trees.move_to_end(key)
+                self._hits += 1
+                return entry[2]
+            self._misses += 1
+        text = _read_text(path)
+        tree = ast.parse(text, filename=str(path))
+        if stamp is not None and self.maxsize > 0:
+            self._insert(key, stamp, tree)
+        return tree
+
+    def _insert(self, key: str, stamp: tuple[int, int], tree: ast.Module) -> None:
+        size = stamp[1]
+        with self._lock:
+            old = self._trees.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._trees[key] = (stamp, size, tree)
+            self._size += size
+            while self._trees and (
+                len(self._trees) > self.maxsize
+                or (self.max_bytes is not None and self._size > self.max_bytes)
+            ):
+                _, (_, evicted_size, _) = self._trees.popitem(last=False)
+                self._size -= evicted_size
+                self._evictions += 1
+
+    def stats(self) -> ASTCacheStats:
+        """Return the number of hits, misses and evictions so far, and the current
+        contents of the cache."""
+        with self._lock:
+            return ASTCacheStats(
+                self._hits, self._misses, self._evictions, len(self._trees), self._size
+            )
+
+    def invalidate(self, path: Optional[Path] = None) -> None:
+        """Forget the tree for a stub file, or all trees."""
+        with self._lock:
+            if path is None:
+                self._trees.clear()
+                self._size = 0
+            else:
+                entry = self._trees.pop(os.fspath(path), None)
+                if entry is not None:
+                    self._size -= entry[1]
+
+
+_ast_cache = ASTCache()
+
+
+def get_ast_cache() -> ASTCache:
+    """Return the cache of the trees shared by the parser and the Resolver."""
+    return _ast_cache
+
+
 def parse_stub_file(path: Path) -> ast.Module:
-    text = path.read_text(encoding="utf-8")
+    """Return a newly parsed AST for a stub file, which the caller may modify."""
+    text = _read_text(path)
     return ast.parse(text, filename=str(path))
 
 
+def _parse_stub_file(path: Path) -> ast.Module:
+    """Return the shared, cached AST for a stub file, which must not be modified."""
+    return _ast_cache.parse(path)
+
+
+def _file_stamp(path: Path) -> Optional[tuple[int, int]]:
+    """Return a value that changes whenever the file changes, with its size last."""
+    in_archive = _split_archive_path(path)
+    if in_archive is not None:
+        archive, member = in_archive
+        return archive.stamp(member)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _read_text(path: Path) -> str:
+    in_archive = _split_archive_path(path)
+    if in_archive is not None:
+        archive, member = in_archive
+        return archive.read_text(member)
+    return path.read_text(encoding="utf-8")
+
+
+def _read_bytes(path: Path) -> bytes:
+    in_archive = _split_archive_path(path)
+    if in_archive is not None:
+        archive, member = in_archive
+        return archive.read_bytes(member)
+    return path.read_bytes()
+
+
+def pack_typeshed(typeshed: Path, archive: Path) -> None:
+    """Write the stubs in a typeshed directory to a zip archive.
+
+    The archive can be used in place of the directory as the ``typeshed`` of a
+    SearchContext. Stubs are read directly from the archive, without extracting
+    them.
+
+    """
+    files = sorted(
+        path
+        for path in typeshed.rglob("*")
+        if path.is_file() and (path.suffix == ".pyi" or path.name == "VERSIONS")
+    )
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for path in files:
+            # fixed timestamp for reproducible archives
+            info = zipfile.ZipInfo(
+                path.relative_to(typeshed).as_posix(), date_time=(1980, 1, 1, 0, 0, 0)
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, path.read_bytes())
+    # forget anything read from a previous archive at this path
+    if _typeshed_archives.pop(os.fspath(archive), None) is not None:
+        get_typeshed_versions.cache_clear()
+        _get_typeshed_dirs.cache_clear()
+
+
+class _ArchiveEntry:
+    """An entry in a typeshed archive, with the parts of the os.DirEntry interface
+    that we use."""
+
+    def __init__(self, name: str, path: str, is_dir: bool) -> None:
+        self.name = name
+        self.path = path
+        self._is_dir = is_dir
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def is_dir(self) -> bool:
+        return self._is_dir
+
+    def is_file(self) -> bool:
+        return not self._is_dir
+
+    def is_symlink(self) -> bool:
+        return False
+
+
+class _TypeshedArchive:
+    """A zip archive containing typeshed, as produced by pack_typeshed().
+
+    Paths inside the archive are represented as paths below the archive file, such
+    as ``typeshed.zip/os/__init__.pyi``. Members are read on demand.
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._zipfile = zipfile.ZipFile(path)
+        # directory within the archive -> {entry name: whether it is a directory}
+        self._directories: dict[str, dict[str, bool]] = {"": {}}
+        for name in self._zipfile.namelist():
+            parts = name.rstrip("/").split("/")
+            is_dir = name.endswith("/")
+            for i, part in enumerate(parts):
+                directory = "/".join(parts[:i])
+                is_child_dir = is_dir or i < len(parts) - 1
+                self._directories.setdefault(directory, {})[part] = is_child_dir
+                if is_child_dir:
+                    self._directories.setdefault(f"{directory}/{part}".lstrip("/"), {})
+
+    def exists(self, member: str) -> bool:
+        if member in self._directories:
+            return True
+        directory, _, name = member.rpartition("/")
+        return name in self._directories.get(directory, {})
+
+    def is_dir(self, member: str) -> bool:
+        return member in self._directories
+
+    def scandir(self, member: str) -> list[_Entry]:
+        try:
+            children = self._directories[member]
+        except KeyError:
+            raise FileNotFoundError(os.path.join(self.path, member)) from None
+        directory = os.path.join(self.path, *member.split("/"))
+        return [
+            _ArchiveEntry(name, os.path.join(directory, name), is_dir)
+            for name, is_dir in children.items()
+        ]
+
+    def stamp(self, member: str) -> Optional[tuple[int, int]]:
+        try:
+            info = self._zipfile.getinfo(member)
+        except KeyError:
+            return None
+        return (info.CRC, info.file_size)
+
+    def read_text(self, member: str) -> str:
+        return self.read_bytes(member).decode("utf-8")
+
+    def read_bytes(self, member: str) -> bytes:
+        try:
+            return self._zipfile.read(member)
+        except KeyError:
+            raise FileNotFoundError(os.path.join(self.path, member)) from None
+
+
+# Typeshed archives in use, by path. Only paths inside these archives are looked up
+# in an archive, so that other zip files (like those on sys.path) keep their meaning.
+_typeshed_archives: dict[str, _TypeshedArchive] = {}
+
+
+def _register_typeshed_archive(typeshed: Path) -> None:
+    """If typeshed is a zip archive, make its contents available to the safe_*
+    functions."""
+    path = os.fspath(typeshed)
+    if path in _typeshed_archives or not os.path.isfile(path):
+        return
+    try:
+        _typeshed_archives[path] = _TypeshedArchive(path)
+    except (OSError, zipfile.BadZipFile):
+        pass
+
+
+def _split_archive_path(
+    path: "os.PathLike[str]",
+) -> Optional[tuple[_TypeshedArchive, str]]:
+    """If path points into a typeshed archive, return the archive and the name of the
+    member within it."""
+    if not _typeshed_archives:
+        return None
+    path_str = os.fspath(path)
+    for archive_path, archive in _typeshed_archives.items():
+        if path_str == archive_path:
+            return archive, ""
+        if path_str.startswith(archive_path) and path_str[len(archive_path)] == os.sep:
+            member = path_str[len(archive_path) + 1 :]
+            return archive, member.replace(os.sep, "/")
+    return None
+
+
 def _path_to_module(path: Path) -> str:
     """Returns the module name corresponding to a file path."""
     parts = path.parts
@@ -1,14 +1,22 @@
 """This module is responsible for parsing a stub AST into a dictionary of names."""
 
 import ast
+import json
 import logging
+import os
 import sys
-from collections.abc import Iterable
+import threading
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import Generator, Hashable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Any, Callable, NamedTuple, NoReturn, Optional, Union
+from typing import Any, Callable, NamedTuple, NoReturn, Optional, Union, cast
 
 from . import finder
-from .finder import ModulePath, SearchContext, get_search_context, parse_stub_file
+from .finder import ModulePath, SearchContext, _parse_stub_file, get_search_context
 
 log = logging.getLogger(__name__)
 
@@ -41,7 +49,10 @@ NameDict = dict[str, NameInfo]
 
 
 def get_stub_names(
-    module_name: str, *, search_context: Optional[SearchContext] = None
+    module_name: str,
+    *,
+    search_context: Optional[SearchContext] = None,
+    lazy_classes: bool = False,
 ) -> Optional[NameDict]:
     """Given a module name, return a dictionary of names defined in that module."""
     if search_context is None:
@@ -49,17 +60,113 @@ def get_stub_names(
     path = finder.get_stub_file(module_name, search_context=search_context)
     if path is None:
         return None
+    return get_stub_names_from_file(
+        module_name, path, search_context=search_context, lazy_classes=lazy_classes
+    )
+
+
+def get_stub_names_from_file(
+    module_name: str,
+    path: Path,
+    *,
+    search_context: Optional[SearchContext] = None,
+    lazy_classes: bool = False,
+) -> NameDict:
+    """Return a dictionary of names defined in a module, given its stub file."""
+    if search_context is None:
+        search_context = get_search_context()
+    module_path = ModulePath(tuple(module_name.split(".")))
+    names = _get_precompiled_names(module_path, path, search_context)
+    if names is not None:
+        return names
     is_init = path.name in ("__init__.py", "__init__.pyi")
-    ast = parse_stub_file(path)
+    ast = _parse_stub_file(path)
     return parse_ast(
         ast,
         search_context,
-        ModulePath(tuple(module_name.split("."))),
+        module_path,
         is_init=is_init,
         file_path=path,
+        lazy_classes=lazy_classes,
     )
 
 
+def iter_all_stub_names(
+    search_context: Optional[SearchContext] = None, *, prefetch: int = 8
+) -> Generator[tuple[str, Path, NameDict], None, None]:
+    """Yield (module name, path, NameDict) for every stub in the context.
+
+    This is like calling get_stub_names() for each module that get_all_stub_files()
+    returns, but while the caller handles one module, the next prefetch stubs are
+    read and parsed on a background thread. The trees are not added to the
+    process-wide ASTCache, so only the prefetched stubs and the names the caller
+    still holds on to are kept alive. Stubs that cannot be parsed are logged and
+    skipped. Closing the generator stops the background thread.
+
+    """
+    if search_context is None:
+        search_context = get_search_context()
+    stub_files = finder.get_all_stub_files(search_context)
+    if prefetch <= 0:
+        for module_name, path in stub_files:
+            load = partial(_load_stub, path, search_context)
+            names = _get_loaded_names(module_name, path, load, search_context)
+            if names is not None:
+                yield module_name, path, names
+        return
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending: deque[tuple[str, Path, Future[_LoadedStub]]] = deque()
+    try:
+        for module_name, path in stub_files:
+            future = executor.submit(_load_stub, path, search_context)
+            pending.append((module_name, path, future))
+            if len(pending) <= prefetch:
+                continue
+            module_name, path, future = pending.popleft()
+            names = _get_loaded_names(module_name, path, future.result, search_context)
+            if names is not None:
+                yield module_name, path, names
+        while pending:
+            module_name, path, future = pending.popleft()
+            names = _get_loaded_names(module_name, path, future.result, search_context)
+            if names is not None:
+                yield module_name, path, names
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+# the symbol table items for a stub if they are precompiled, otherwise its AST
+_LoadedStub = Union[list[Any], ast.Module]
+
+
+def _load_stub(path: Path, search_context: SearchContext) -> _LoadedStub:
+    data = finder._read_bytes(path)
+    items = _get_precompiled_items(path, search_context, data)
+    if items is not None:
+        return items
+    return ast.parse(data.decode("utf-8"), filename=str(path))
+
+
+def _get_loaded_names(
+    module_name: str,
+    path: Path,
+    load: Callable[[], _LoadedStub],
+    search_context: SearchContext,
+) -> Optional[NameDict]:
+    module_path = ModulePath(tuple(module_name.split(".")))
+    try:
+        loaded = load()
+        if isinstance(loaded, ast.Module):
+            is_init = path.name in ("__init__.py", "__init__.pyi")
+            return parse_ast(
+                loaded, search_context, module_path, file_path=path, is_init=is_init
+            )
+        return _evaluate_precompiled_items(loaded, search_context, module_path, path)
+    except (SyntaxError, UnicodeDecodeError, InvalidStub) as e:
+        log.warning("%s: skipping: %s", path, e)
+        return None
+
+
 def parse_ast(
     ast: ast.AST,
     search_context: SearchContext,
@@ -67,15 +174,36 @@ def parse_ast(
     *,
     file_path: Path,
     is_init: bool = False,
+    lazy_classes: bool = False,
 ) -> NameDict:
+    """Collect the names defined in a stub's AST.
+
+    If lazy_classes is True, the child_nodes of each class are only collected when
+    they are first accessed.
+
+    """
     visitor = _NameExtractor(
-        search_context, module_name, is_init=is_init, file_path=file_path
+        search_context,
+        module_name,
+        is_init=is_init,
+        file_path=file_path,
+        lazy_classes=lazy_classes,
     )
-    name_dict: NameDict = {}
     try:
         names: Iterable[NameInfo] = visitor.visit(ast)
     except _AssertFailed:
-        return name_dict
+        return {}
+    return _merge_names(names, search_context, module_name, file_path)
+
+
+def _merge_names(
+    names: Iterable[NameInfo],
+    search_context: SearchContext,
+    module_name: ModulePath,
+    file_path: Path,
+) -> NameDict:
+    """Build the NameDict for a module, handling names that are defined repeatedly."""
+    name_dict: NameDict = {}
     for info in names:
         if info.name in name_dict:
             existing = name_dict[info.name]
@@ -133,13 +261,227 @@ def parse_ast(
 def get_import_star_names(
     module_name: str, *, search_context: SearchContext, file_path: Optional[Path] = None
 ) -> Optional[list[str]]:
-    name_dict = get_stub_names(module_name, search_context=search_context)
-    if name_dict is None:
+    """Return the names that ``from module_name import *`` imports.
+
+    Results are cached per context and reused until one of the stubs they were
+    computed from changes. A module that is star-imported again while its own names
+    are being collected is reported as a cyclic import and contributes no names.
+
+    """
+    key = (_get_context_key(search_context), module_name)
+    in_progress = _star_imports_in_progress()
+    if key in in_progress:
+        _warn(f"cyclic import * of {module_name}", search_context, file_path)
+        # the names collected by the modules in the cycle are incomplete
+        for pending in in_progress.values():
+            pending.is_complete = False
+        return []
+    path = finder.get_stub_file(module_name, search_context=search_context)
+    if path is None:
+        if in_progress:
+            next(reversed(in_progress.values())).modules.add(module_name)
+        _record_star_imports({module_name})
         return None
-    if "__all__" in name_dict:
-        info = name_dict["__all__"]
-        return get_dunder_all_from_info(info, file_path)
-    return [name for name, info in name_dict.items() if info.is_exported]
+    cached = _star_import_cache.get(key, path)
+    if cached is not None:
+        names, stamps, modules = cached
+        if in_progress:
+            parent = next(reversed(in_progress.values()))
+            parent.stamps.update(stamps)
+            parent.modules |= modules
+        _record_star_imports(modules)
+        return list(names)
+
+    state = _StarImport()
+    state.stamps[os.fspath(path)] = finder._file_stamp(path)
+    state.modules.add(module_name)
+    in_progress[key] = state
+    try:
+        name_dict = get_stub_names_from_file(
+            module_name, path, search_context=search_context
+        )
+        if "__all__" in name_dict:
+            info = name_dict["__all__"]
+            dunder_all = get_dunder_all_from_info(info, file_path)
+        else:
+            dunder_all = [name for name, info in name_dict.items() if info.is_exported]
+    finally:
+        del in_progress[key]
+    if in_progress:
+        parent = next(reversed(in_progress.values()))
+        parent.stamps.update(state.stamps)
+        parent.modules |= state.modules
+    _record_star_imports(state.modules)
+    if dunder_all is None:
+        return None
+    if state.is_complete:
+        _star_import_cache.put(key, path, dunder_all, state.stamps, state.modules)
+    return list(dunder_all)
+
+
+_ContextKey = tuple[object, ...]
+# file path -> (modification time, size) when it was read
+_Stamps = dict[str, Optional[tuple[int, int]]]
+
+
+def _get_context_key(ctx: SearchContext) -> _ContextKey:
+    """Return the parts of a SearchContext that affect the names in a stub."""
+    return (
+        os.fspath(ctx.typeshed),
+        tuple(os.fspath(path) for path in ctx.search_path),
+        ctx.version,
+        ctx.platform,
+        ctx.raise_on_warnings,
+        ctx.allow_py_files,
+    )
+
+
+class _StarImport:
+    """A star-imported module whose names are being collected."""
+
+    def __init__(self) -> None:
+        # every stub the names depend on, including those star-imported in turn
+        self.stamps: _Stamps = {}
+        # the names of the modules those stubs are for
+        self.modules: set[str] = set()
+        self.is_complete = True
+
+
+class _StarImportCache:
+    """The names exported by star-imported modules, with the stubs they came from."""
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[
+            tuple[_ContextKey, str], tuple[str, list[str], _Stamps, frozenset[str]]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, key: tuple[_ContextKey, str], path: Path
+    ) -> Optional[tuple[list[str], _Stamps, frozenset[str]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry_path, names, stamps, modules = entry
+        if entry_path != os.fspath(path) or any(
+            finder._file_stamp(Path(stub)) != stamp for stub, stamp in stamps.items()
+        ):
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return names, stamps, modules
+
+    def put(
+        self,
+        key: tuple[_ContextKey, str],
+        path: Path,
+        names: list[str],
+        stamps: _Stamps,
+        modules: Iterable[str],
+    ) -> None:
+        with self._lock:
+            self._entries[key] = (
+                os.fspath(path),
+                list(names),
+                dict(stamps),
+                frozenset(modules),
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_star_import_cache = _StarImportCache()
+_star_import_state = threading.local()
+
+
+def _star_imports_in_progress() -> dict[tuple[_ContextKey, str], _StarImport]:
+    """Return the star imports being collected on this thread, innermost last."""
+    try:
+        in_progress: dict[tuple[_ContextKey, str], _StarImport] = (
+            _star_import_state.in_progress
+        )
+    except AttributeError:
+        in_progress = _star_import_state.in_progress = {}
+    return in_progress
+
+
+@contextmanager
+def _recording_star_imports() -> Generator[set[str], None, None]:
+    """Collect the modules star-imported on this thread within the block.
+
+    This includes modules star-imported in turn by those modules, even when their
+    names come from the cache.
+
+    """
+    try:
+        recorders: list[set[str]] = _star_import_state.recorders
+    except AttributeError:
+        recorders = _star_import_state.recorders = []
+    modules: set[str] = set()
+    recorders.append(modules)
+    try:
+        yield modules
+    finally:
+        recorders.remove(modules)
+
+
+def _record_star_imports(modules: Iterable[str]) -> None:
+    for recorder in getattr(_star_import_state, "recorders", ()):
+        recorder.update(modules)
+
+
+def get_import_dependencies(names: NameDict) -> set[ModulePath]:
+    """Return the modules that names in a NameDict are imported from.
+
+    For ``from a import b``, both ``a`` and ``a.b`` are included, because ``b`` may
+    be a submodule. This does not look up AST nodes that have not been loaded yet.
+
+    """
+    dependencies: set[ModulePath] = set()
+    for info in names.values():
+        value = _get_raw_ast(info)
+        definitions: list[object] = (
+            list(value.definitions) if isinstance(value, OverloadedName) else [value]
+        )
+        for definition in definitions:
+            if isinstance(definition, ImportedName):
+                dependencies.add(definition.module_name)
+                if definition.name is not None:
+                    dependencies.add(
+                        ModulePath((*definition.module_name, definition.name))
+                    )
+        if info.child_nodes is not None:
+            dependencies |= get_import_dependencies(info.child_nodes)
+    return dependencies
+
+
+def get_imported_name(info: NameInfo) -> Optional[ImportedName]:
+    """Return where a name is imported from, or None if it is not imported.
+
+    This is equivalent to checking whether ``info.ast`` is an ImportedName, but
+    never needs to parse the stub.
+
+    """
+    value = _get_raw_ast(info)
+    return value if isinstance(value, ImportedName) else None
+
+
+def _get_raw_ast(info: NameInfo) -> object:
+    # bypass _LazyNameInfo.ast, which may need to parse the stub
+    return tuple.__getitem__(info, 2)
+
+
+def _is_ast_loaded(info: NameInfo) -> bool:
+    """Return whether accessing info.ast will not need to parse the stub."""
+    return not isinstance(info, _LazyNameInfo) or "_ast" in info.__dict__
 
 
 def get_dunder_all_from_info(
@@ -195,6 +537,52 @@ def _name_is_exported(name: str) -> bool:
     return not name.startswith("_")
 
 
+def _merge_class_children(
+    children: Iterable[NameInfo], *, is_py_file: bool
+) -> NameDict:
+    child_dict: NameDict = {}
+    for info in children:
+        # overloads are only created here
+        assert not isinstance(info.ast, OverloadedName), info
+        if info.name in child_dict:
+            existing = child_dict[info.name]
+            if isinstance(existing.ast, OverloadedName):
+                existing.ast.definitions.append(info.ast)
+            elif isinstance(existing.ast, ImportedName):
+                if is_py_file:
+                    continue
+                raise RuntimeError(f"Unexpected import name in class: {existing.ast}")
+            else:
+                new_info = NameInfo(
+                    existing.name,
+                    existing.is_exported,
+                    OverloadedName([existing.ast, info.ast]),
+                )
+                child_dict[info.name] = new_info
+        else:
+            child_dict[info.name] = info
+    return child_dict
+
+
+def _get_import_star_infos(
+    source_module: ModulePath,
+    ctx: SearchContext,
+    module_name: ModulePath,
+    file_path: Path,
+) -> Iterable[NameInfo]:
+    names = get_import_star_names(
+        ".".join(source_module), search_context=ctx, file_path=file_path
+    )
+    if names is None:
+        _warn(
+            f"could not import {source_module} in {module_name} with {ctx}",
+            ctx,
+            file_path,
+        )
+        return []
+    return [NameInfo(name, True, ImportedName(source_module, name)) for name in names]
+
+
 class _NameExtractor(ast.NodeVisitor):
     """Extract names from a stub module."""
 
@@ -205,11 +593,13 @@ class _NameExtractor(ast.NodeVisitor):
         *,
         file_path: Path,
         is_init: bool = False,
+        lazy_classes: bool = False,
     ) -> None:
         self.ctx = ctx
         self.module_name = module_name
         self.is_init = is_init
         self.file_path = file_path
+        self.lazy_classes = lazy_classes
 
     @property
     def is_py_file(self) -> bool:
@@ -225,29 +615,17 @@ class _NameExtractor(ast.NodeVisitor):
         yield NameInfo(node.name, _name_is_exported(node.name), node)
 
     def visit_ClassDef(self, node: ast.ClassDef) -> Iterable[NameInfo]:
+        if self.lazy_classes:
+            info = _LazyClassInfo(node.name, _name_is_exported(node.name), node)
+            info.__dict__["_extractor"] = self
+            yield info
+        else:
+            child_dict = self.get_class_children(node)
+            yield NameInfo(node.name, _name_is_exported(node.name), node, child_dict)
+
+    def get_class_children(self, node: ast.ClassDef) -> NameDict:
         children = [info for child in node.body for info in self.visit(child)]
-        child_dict: NameDict = {}
-        for info in children:
-            if info.name in child_dict:
-                existing = child_dict[info.name]
-                if isinstance(existing.ast, OverloadedName):
-                    existing.ast.definitions.append(info.ast)
-                elif isinstance(existing.ast, ImportedName):
-                    if self.is_py_file:
-                        continue
-                    raise RuntimeError(
-                        f"Unexpected import name in class: {existing.ast}"
-                    )
-                else:
-                    new_info = NameInfo(
-                        existing.name,
-                        existing.is_exported,
-                        OverloadedName([existing.ast, info.ast]),
-                    )
-                    child_dict[info.name] = new_info
-            else:
-                child_dict[info.name] = info
-        yield NameInfo(node.name, _name_is_exported(node.name), node, child_dict)
+        return _merge_class_children(children, is_py_file=self.is_py_file)
 
     def visit_Assign(self, node: ast.Assign) -> Iterable[NameInfo]:
         for target in node.targets:
@@ -362,26 +740,17 @@ class _NameExtractor(ast.NodeVisitor):
                     alias.asname, is_exported, ImportedName(source_module, alias.name)
                 )
             elif alias.name == "*":
-                names = get_import_star_names(
-                    ".".join(source_module),
-                    search_context=self.ctx,
-                    file_path=self.file_path,
-                )
-                if names is None:
-                    _warn(
-                        f"could not import {source_module} in"
-                        f" {self.module_name} with {self.ctx}",
-                        self.ctx,
-                        self.file_path,
-                    )
-                    continue
-                for name in names:
-                    yield NameInfo(name, True, ImportedName(source_module, name))
+                yield from self._visit_import_star(source_module)
             else:
                 yield NameInfo(
                     alias.name, False, ImportedName(source_module, alias.name)
                 )
 
+    def _visit_import_star(self, source_module: ModulePath) -> Iterable[NameInfo]:
+        return _get_import_star_infos(
+            source_module, self.ctx, self.module_name, self.file_path
+        )
+
     def visit_Expr(self, node: ast.Expr) -> Iterable[NameInfo]:
         if isinstance(node.value, ast.Constant) and (
             node.value.value is Ellipsis or isinstance(node.value.value, str)
@@ -448,9 +817,12 @@ def evaluate_expression_truthiness(
 
     For example, if passed an AST node representing the expression ``sys.platform == "linux"``,
     it will return ``True`` if ``ctx.platform`` is equal to ``"linux"``, otherwise ``False``.
+
+    To reuse results across stubs, use the ConditionCache returned by
+    ``get_condition_cache(ctx)``.
     """
 
-    visitor = _LiteralEvalVisitor(ctx, file_path)
+    visitor = _LiteralEvalVisitor(ctx.version, ctx.platform, file_path)
     try:
         value = visitor.visit(expr)
     except InvalidStub:
@@ -461,9 +833,165 @@ def evaluate_expression_truthiness(
         return bool(value)
 
 
+class ConditionCacheStats(NamedTuple):
+    hits: int
+    misses: int
+    entries: int
+
+
+class ConditionCache:
+    """The truthiness of stub conditions under one Python version and platform.
+
+    Conditions are keyed by their structure, so each distinct condition is
+    evaluated only once, whichever stub it appears in. Only conditions that can be
+    evaluated are cached, and the cache stops growing once it holds ``maxsize`` of
+    them.
+
+    Computing the key of an AST node takes about as long as evaluating a typical
+    condition, so ``evaluate_source()`` is where the cache pays off: the key of
+    each distinct source string is computed only once.
+
+    """
+
+    def __init__(
+        self, version: finder.PythonVersion, platform: str, *, maxsize: int = 4096
+    ) -> None:
+        self.version = version
+        self.platform = platform
+        self.maxsize = maxsize
+        self._values: dict[Hashable, bool] = {}
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"<ConditionCache for {self.platform} {self.version} with"
+            f" {len(self._values)} conditions>"
+        )
+
+    def evaluate(self, expr: ast.expr, *, file_path: Path) -> Optional[bool]:
+        """Like evaluate_expression_truthiness(), for this cache's version and
+        platform."""
+        key = _get_condition_key(expr)
+        value = self._get(key)
+        if value is not None:
+            return value
+        return self._evaluate(key, expr, file_path)
+
+    def evaluate_source(self, source: str, *, file_path: Path) -> Optional[bool]:
+        """Evaluate a condition given as source code, such as ``sys.platform ==
+        "win32"``."""
+        key = _get_source_condition_key(source)
+        value = self._get(key)
+        if value is not None:
+            return value
+        return self._evaluate(key, _parse_condition(source), file_path)
+
+    def _get(self, key: Optional[Hashable]) -> Optional[bool]:
+        if key is None:
+            return None
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return value
+
+    def _evaluate(
+        self, key: Optional[Hashable], expr: ast.expr, file_path: Path
+    ) -> Optional[bool]:
+        visitor = _LiteralEvalVisitor(self.version, self.platform, file_path)
+        try:
+            value = bool(visitor.visit(expr))
+        except InvalidStub:
+            if file_path.suffix == ".pyi":
+                raise
+            return None
+        if key is not None:
+            with self._lock:
+                if len(self._values) < self.maxsize:
+                    self._values[key] = value
+        return value
+
+    def stats(self) -> ConditionCacheStats:
+        """Return the number of hits and misses so far, and the number of cached
+        conditions."""
+        with self._lock:
+            return ConditionCacheStats(self._hits, self._misses, len(self._values))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+_condition_caches: dict[tuple[finder.PythonVersion, str], ConditionCache] = {}
+_condition_caches_lock = threading.Lock()
+
+
+def get_condition_cache(ctx: SearchContext) -> ConditionCache:
+    """Return the ConditionCache shared by all contexts with the version and platform
+    of ``ctx``."""
+    key = (ctx.version, ctx.platform)
+    cache = _condition_caches.get(key)
+    if cache is None:
+        with _condition_caches_lock:
+            cache = _condition_caches.setdefault(
+                key, ConditionCache(ctx.version, ctx.platform)
+            )
+    return cache
+
+
+def _get_condition_key(node: ast.AST) -> Optional[Hashable]:
+    """Return a hashable description of the structure of a condition.
+
+    Returns None for nodes that cannot appear in a condition that can be evaluated.
+    This is much faster than ast.dump().
+
+    """
+    key: Optional[Hashable]
+    if isinstance(node, ast.Compare):
+        keys = tuple(map(_get_condition_key, [node.left, *node.comparators]))
+        if None in keys:
+            return None
+        return (ast.Compare, tuple(map(type, node.ops)), keys)
+    elif isinstance(node, ast.Attribute):
+        key = _get_condition_key(node.value)
+        return None if key is None else (ast.Attribute, key, node.attr)
+    elif isinstance(node, ast.Name):
+        return (ast.Name, node.id)
+    elif isinstance(node, ast.Constant):
+        # 1 and True are equal, but not interchangeable
+        return (ast.Constant, type(node.value), node.value)
+    elif isinstance(node, (ast.Tuple, ast.BoolOp)):
+        if isinstance(node, ast.Tuple):
+            op, values = None, node.elts
+        else:
+            op, values = type(node.op), node.values
+        keys = tuple(map(_get_condition_key, values))
+        if None in keys:
+            return None
+        return (type(node), op, keys)
+    elif isinstance(node, (ast.Subscript, ast.Slice)):
+        parts: list[Optional[ast.expr]]
+        if isinstance(node, ast.Subscript):
+            parts = [node.value, node.slice]
+        else:
+            parts = [node.lower, node.upper, node.step]
+        keys = tuple(() if part is None else _get_condition_key(part) for part in parts)
+        if None in keys:
+            return None
+        return (type(node), keys)
+    return None
+
+
 class _LiteralEvalVisitor(ast.NodeVisitor):
-    def __init__(self, ctx: SearchContext, file_path: Optional[Path]) -> None:
-        self.ctx = ctx
+    def __init__(
+        self, version: finder.PythonVersion, platform: str, file_path: Optional[Path]
+    ) -> None:
+        self.version = version
+        self.platform = platform
         self.file_path = file_path
 
     def visit_Constant(self, node: ast.Constant) -> object:
@@ -510,9 +1038,9 @@ class _LiteralEvalVisitor(ast.NodeVisitor):
                 self.file_path,
             )
         if node.attr == "platform":
-            return self.ctx.platform
+            return self.platform
         elif node.attr == "version_info":
-            return self.ctx.version
+            return self.version
         else:
             raise InvalidStub(f"Invalid attribute on {ast.dump(node)}", self.file_path)
 
@@ -542,3 +1070,841 @@ def _warn(message: str, ctx: SearchContext, file_path: Optional[Path]) -> None:
         if file_path is not None:
             message = f"{file_path}: {message}"
         log.warning(message)
+
+
+# Compact name records
+#
+# NameRecords describe names without holding on to AST nodes, so that many modules
+# can be kept in memory. Nodes are found again by their location when requested.
+
+RecordDict = dict[str, "NameRecord"]
+
+
+class NameRecord:
+    """A compact, AST-free alternative to NameInfo.
+
+    ``kind`` is the class name of the defining AST node (such as ``"FunctionDef"``),
+    ``"import"`` for imported names, or ``"overload"`` for names defined more than
+    once, whose individual definitions are in ``definitions``. For imports,
+    ``imported`` is the ImportedName and there is no source location.
+
+    """
+
+    __slots__ = (
+        "children",
+        "col_offset",
+        "definitions",
+        "end_col_offset",
+        "end_lineno",
+        "file_path",
+        "imported",
+        "is_exported",
+        "kind",
+        "lineno",
+        "module_name",
+        "name",
+        "wrap_in_list",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        is_exported: bool,
+        kind: str,
+        module_name: ModulePath,
+        file_path: Path,
+        *,
+        location: Optional[tuple[int, int, int, int]] = None,
+        imported: Optional[ImportedName] = None,
+        definitions: Optional[tuple["NameRecord", ...]] = None,
+        children: Optional[RecordDict] = None,
+        wrap_in_list: bool = False,
+    ) -> None:
+        self.name = name
+        self.is_exported = is_exported
+        self.kind = kind
+        self.module_name = module_name
+        self.file_path = file_path
+        if location is None:
+            self.lineno = self.col_offset = self.end_lineno = self.end_col_offset = 0
+        else:
+            self.lineno, self.col_offset, self.end_lineno, self.end_col_offset = (
+                location
+            )
+        self.imported = imported
+        self.definitions = definitions
+        self.children = children
+        # __all__.append(x) is represented as a list containing x
+        self.wrap_in_list = wrap_in_list
+
+    def __repr__(self) -> str:
+        location = "" if self.kind == "import" else f" at line {self.lineno}"
+        return f"<NameRecord {self.name!r}: {self.kind}{location}>"
+
+    def get_ast(self) -> Union[ast.AST, ImportedName, OverloadedName]:
+        """Return the AST node for this name, parsing the stub again if necessary."""
+        if self.imported is not None:
+            return self.imported
+        if self.definitions is not None:
+            definitions = []
+            for defn in self.definitions:
+                node = defn.get_ast()
+                assert not isinstance(node, OverloadedName), node
+                definitions.append(node)
+            return OverloadedName(definitions)
+        found = _find_node(
+            _parse_stub_file(self.file_path), self.kind, (self.lineno, self.col_offset)
+        )
+        if found is None:
+            raise InvalidStub(
+                f"{self.name} is no longer at line {self.lineno}", self.file_path
+            )
+        if self.wrap_in_list:
+            return ast.List(elts=[cast(ast.expr, found)], ctx=ast.Load())
+        return found
+
+    def to_name_info(self) -> NameInfo:
+        """Return the equivalent NameInfo, with its AST nodes."""
+        children = None
+        if self.children is not None:
+            children = {
+                name: record.to_name_info() for name, record in self.children.items()
+            }
+        return NameInfo(self.name, self.is_exported, self.get_ast(), children)
+
+
+def compact_names(
+    names: NameDict, module_name: ModulePath, file_path: Path
+) -> RecordDict:
+    """Convert the NameDict for a stub into NameRecords."""
+    return {
+        name: _make_record(info.name, info.is_exported, info, module_name, file_path)
+        for name, info in names.items()
+    }
+
+
+def get_stub_records(
+    module_name: str, *, search_context: Optional[SearchContext] = None
+) -> Optional[RecordDict]:
+    """Like get_stub_names(), but return compact NameRecords."""
+    if search_context is None:
+        search_context = get_search_context()
+    path = finder.get_stub_file(module_name, search_context=search_context)
+    if path is None:
+        return None
+    names = get_stub_names_from_file(module_name, path, search_context=search_context)
+    return compact_names(names, ModulePath(tuple(module_name.split("."))), path)
+
+
+class StubNamesResult(NamedTuple):
+    module_name: str
+    # None if there is no stub for the module, or if it could not be parsed
+    names: Optional[RecordDict]
+    error: Optional[Exception] = None
+
+
+def get_stub_names_many(
+    module_names: Iterable[str],
+    *,
+    search_context: Optional[SearchContext] = None,
+    max_workers: Optional[int] = None,
+    chunksize: int = 16,
+) -> Iterator[StubNamesResult]:
+    """Collect the names in many modules, using a pool of worker processes.
+
+    Finding and parsing the stubs happens in up to max_workers processes (by
+    default, one per CPU), which send back NameRecords in a compact form. Modules
+    are sent to the workers in groups of chunksize. Results are yielded in the
+    order of module_names. If collecting the names in a module fails, the
+    exception is returned in the module's result instead of being raised.
+
+    """
+    if search_context is None:
+        search_context = get_search_context()
+    module_names = list(module_names)
+    chunks = [
+        module_names[start : start + chunksize]
+        for start in range(0, len(module_names), chunksize)
+    ]
+    if not chunks:
+        return
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        results = executor.map(
+            _get_encoded_records, chunks, [search_context] * len(chunks)
+        )
+        for chunk, encoded in zip(chunks, results):
+            for module_name, (path, items, error) in zip(chunk, encoded):
+                if path is None:
+                    yield StubNamesResult(module_name, None, error)
+                else:
+                    module_path = ModulePath(tuple(module_name.split(".")))
+                    names = _decode_records(items, module_path, Path(path))
+                    yield StubNamesResult(module_name, names)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Records are sent from worker processes as nested tuples, without the module name
+# and file path that all records for a stub share. This halves the size of the
+# pickled data.
+_EncodedRecord = tuple[Any, ...]
+
+
+def _get_encoded_records(
+    module_names: list[str], search_context: SearchContext
+) -> list[tuple[Optional[str], list[_EncodedRecord], Optional[Exception]]]:
+    results: list[tuple[Optional[str], list[_EncodedRecord], Optional[Exception]]]
+    results = []
+    for module_name in module_names:
+        try:
+            path = finder.get_stub_file(module_name, search_context=search_context)
+            if path is None:
+                results.append((None, [], None))
+                continue
+            names = get_stub_names_from_file(
+                module_name, path, search_context=search_context
+            )
+            records = compact_names(
+                names, ModulePath(tuple(module_name.split("."))), path
+            )
+        except Exception as e:
+            results.append((None, [], e))
+        else:
+            encoded = [_encode_record(record) for record in records.values()]
+            results.append((os.fspath(path), encoded, None))
+    return results
+
+
+def _encode_record(record: NameRecord) -> _EncodedRecord:
+    imported = record.imported
+    return (
+        record.name,
+        record.is_exported,
+        record.kind,
+        (record.lineno, record.col_offset, record.end_lineno, record.end_col_offset),
+        None if imported is None else (imported.module_name, imported.name),
+        (
+            None
+            if record.definitions is None
+            else [_encode_record(defn) for defn in record.definitions]
+        ),
+        (
+            None
+            if record.children is None
+            else [_encode_record(child) for child in record.children.values()]
+        ),
+        record.wrap_in_list,
+    )
+
+
+def _decode_records(
+    items: list[_EncodedRecord], module_name: ModulePath, file_path: Path
+) -> RecordDict:
+    return {item[0]: _decode_record(item, module_name, file_path) for item in items}
+
+
+def _decode_record(
+    item: _EncodedRecord, module_name: ModulePath, file_path: Path
+) -> NameRecord:
+    name, is_exported, kind, location, imported, definitions, children, wrap = item
+    return NameRecord(
+        name,
+        is_exported,
+        kind,
+        module_name,
+        file_path,
+        location=location,
+        imported=None if imported is None else ImportedName(*imported),
+        definitions=(
+            None
+            if definitions is None
+            else tuple(_decode_record(d, module_name, file_path) for d in definitions)
+        ),
+        children=(
+            None
+            if children is None
+            else _decode_records(children, module_name, file_path)
+        ),
+        wrap_in_list=wrap,
+    )
+
+
+def _make_record(
+    name: str,
+    is_exported: bool,
+    info: Optional[NameInfo],
+    module_name: ModulePath,
+    file_path: Path,
+    node: Union[ast.AST, ImportedName, OverloadedName, None] = None,
+) -> NameRecord:
+    if info is not None:
+        node = info.ast
+    if isinstance(node, ImportedName):
+        record = NameRecord(
+            name, is_exported, "import", module_name, file_path, imported=node
+        )
+    elif isinstance(node, OverloadedName):
+        definitions = tuple(
+            _make_record(name, is_exported, None, module_name, file_path, defn)
+            for defn in node.definitions
+        )
+        record = NameRecord(
+            name,
+            is_exported,
+            "overload",
+            module_name,
+            file_path,
+            definitions=definitions,
+        )
+    else:
+        assert node is not None
+        wrap_in_list = (
+            isinstance(node, ast.List)
+            and not hasattr(node, "lineno")
+            and len(node.elts) == 1
+        )
+        if wrap_in_list:
+            assert isinstance(node, ast.List)
+            node = node.elts[0]
+        record = NameRecord(
+            name,
+            is_exported,
+            type(node).__name__,
+            module_name,
+            file_path,
+            location=_get_location(node),
+            wrap_in_list=wrap_in_list,
+        )
+    if info is not None and info.child_nodes is not None:
+        record.children = compact_names(info.child_nodes, module_name, file_path)
+    return record
+
+
+def _get_location(node: ast.AST) -> Optional[tuple[int, int, int, int]]:
+    """Return the start line and column and end line and column of a node."""
+    lineno: Optional[int] = getattr(node, "lineno", None)
+    if lineno is None:
+        return None
+    col_offset: int = getattr(node, "col_offset", 0)
+    end_lineno: Optional[int] = getattr(node, "end_lineno", None)
+    end_col_offset: Optional[int] = getattr(node, "end_col_offset", None)
+    if end_lineno is None or end_col_offset is None:
+        return (lineno, col_offset, lineno, col_offset)
+    return (lineno, col_offset, end_lineno, end_col_offset)
+
+
+def _find_node(
+    tree: ast.AST, kind: str, position: tuple[int, int]
+) -> Optional[ast.AST]:
+    """Find the node of the given kind that starts at position (line, column)."""
+    node = tree
+    while True:
+        location = _get_location(node)
+        if (
+            type(node).__name__ == kind
+            and location is not None
+            and location[:2] == position
+        ):
+            return node
+        for child in ast.iter_child_nodes(node):
+            location = _get_location(child)
+            if location is not None and location[:2] <= position < location[2:]:
+                node = child
+                break
+        else:
+            return None
+
+
+# Precompiled symbol tables
+#
+# Symbol tables record the names defined in each stub in a typeshed directory,
+# without evaluating conditions or star imports, so that they can be used with any
+# SearchContext. AST nodes are stored as their location in the module and looked up
+# only when they are accessed.
+
+_SYMBOL_TABLE_FORMAT = 2
+
+
+def write_symbol_tables(typeshed: Path, output: Optional[Path] = None) -> Path:
+    """Precompile the names defined in all stubs in a typeshed directory.
+
+    get_stub_names() uses the resulting file instead of parsing stubs from this
+    typeshed. By default, the file is written next to the typeshed directory.
+    Returns the path to the file.
+
+    The file starts with a line of JSON giving its format, followed by a line for
+    each stub with its path relative to typeshed, its size, its CRC-32 and its
+    symbol table as JSON, separated by tabs.
+
+    """
+    if output is None:
+        output = _get_symbol_table_path(typeshed)
+    ctx = get_search_context(typeshed=typeshed, search_path=[])
+    lines = [json.dumps({"format": _SYMBOL_TABLE_FORMAT}).encode("utf-8")]
+    for path in sorted(typeshed.rglob("*.pyi")):
+        relative_path = path.relative_to(typeshed)
+        parts = relative_path.parts
+        if parts[0] == "@python2":
+            parts = parts[1:]
+        module_name = ModulePath(tuple(finder._path_to_module(Path(*parts)).split(".")))
+        data = path.read_bytes()
+        try:
+            tree = ast.parse(data.decode("utf-8"), filename=str(path))
+            builder = _SymbolTableBuilder(
+                ctx,
+                module_name,
+                file_path=path,
+                is_init=path.name == "__init__.pyi",
+                tree=tree,
+            )
+            items = builder.visit(tree)
+        except (SyntaxError, InvalidStub) as e:
+            log.warning("%s: not precompiling: %s", path, e)
+            continue
+        # compact JSON never contains tabs or newlines
+        fields = [
+            relative_path.as_posix(),
+            str(len(data)),
+            str(zlib.crc32(data)),
+            json.dumps(items, separators=(",", ":")),
+        ]
+        lines.append("\t".join(fields).encode("utf-8"))
+    output.write_bytes(b"\n".join(lines) + b"\n")
+    return output
+
+
+def _get_symbol_table_path(typeshed: Path) -> Path:
+    # typeshed/ and typeshed.zip both use typeshed.symbols
+    name = typeshed.stem if typeshed.suffix == ".zip" else typeshed.name
+    return typeshed.with_name(f"{name}.symbols")
+
+
+class _SymbolTables(NamedTuple):
+    # relative path -> (file size, CRC-32 of the file, JSON-encoded items)
+    modules: dict[str, tuple[int, int, bytes]]
+    # whether the tables are for the bundled typeshed, which never changes
+    is_bundled: bool
+
+
+@lru_cache
+def _load_symbol_tables(typeshed: Path) -> Optional[_SymbolTables]:
+    try:
+        header, *lines = _get_symbol_table_path(typeshed).read_bytes().splitlines()
+        data = json.loads(header)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("format") != _SYMBOL_TABLE_FORMAT:
+        return None
+    modules = {}
+    for line in lines:
+        path, size, checksum, items = line.split(b"\t", 3)
+        modules[path.decode("utf-8")] = (int(size), int(checksum), items)
+    return _SymbolTables(modules, typeshed == finder.find_typeshed())
+
+
+# path -> stamp of a stub whose CRC-32 matched its symbol table
+_verified_stamps: dict[str, tuple[int, int]] = {}
+
+
+def _get_precompiled_names(
+    module_name: ModulePath, path: Path, search_context: SearchContext
+) -> Optional[NameDict]:
+    """Return the names in a stub from the symbol tables, if they cover it."""
+    items = _get_precompiled_items(path, search_context)
+    if items is None:
+        return None
+    return _evaluate_precompiled_items(items, search_context, module_name, path)
+
+
+def _evaluate_precompiled_items(
+    items: list[Any], search_context: SearchContext, module_name: ModulePath, path: Path
+) -> NameDict:
+    try:
+        names = list(_evaluate_symbol_table(items, search_context, module_name, path))
+    except _AssertFailed:
+        return {}
+    name_dict = _merge_names(names, search_context, module_name, path)
+    return _make_lazy(name_dict, _StubSource(path))
+
+
+def _get_precompiled_items(
+    path: Path, search_context: SearchContext, data: Optional[bytes] = None
+) -> Optional[list[Any]]:
+    """Return the symbol table items for a stub, if the symbol tables cover it.
+
+    data is the content of the stub, if it has already been read.
+
+    """
+    tables = _load_symbol_tables(search_context.typeshed)
+    if tables is None:
+        return None
+    typeshed_prefix = os.path.join(search_context.typeshed, "")
+    path_str = os.fspath(path)
+    if not path_str.startswith(typeshed_prefix):
+        return None
+    entry = tables.modules.get(path_str[len(typeshed_prefix) :].replace(os.sep, "/"))
+    if entry is None:
+        return None
+    size, checksum, items = entry
+    if not _is_unchanged(path, size, checksum, tables.is_bundled, data):
+        # the stub has changed since the tables were written
+        return None
+    return cast(list[Any], json.loads(items))
+
+
+def _is_unchanged(
+    path: Path, size: int, checksum: int, is_bundled: bool, data: Optional[bytes]
+) -> bool:
+    """Return whether a stub still has this size and CRC-32.
+
+    The CRC is computed only if the stub's size and stamp cannot tell.
+
+    """
+    stamp = finder._file_stamp(path)
+    if stamp is None or stamp[1] != size:
+        return False
+    if finder._split_archive_path(path) is not None:
+        # the stamp of an archive member is its CRC and size
+        return stamp[0] == checksum
+    if is_bundled:
+        return True
+    path_str = os.fspath(path)
+    if _verified_stamps.get(path_str) == stamp:
+        return True
+    if data is None:
+        data = finder._read_bytes(path)
+    if zlib.crc32(data) != checksum:
+        return False
+    _verified_stamps[path_str] = stamp
+    return True
+
+
+def _get_symbol_table(
+    module_name: ModulePath, path: Path, search_context: SearchContext
+) -> list[Any]:
+    """Return the symbol table items for a stub, building them if necessary."""
+    items = _get_precompiled_items(path, search_context)
+    if items is not None:
+        return items
+    tree = _parse_stub_file(path)
+    builder = _SymbolTableBuilder(
+        search_context,
+        module_name,
+        file_path=path,
+        is_init=path.name in ("__init__.py", "__init__.pyi"),
+        tree=tree,
+    )
+    return cast(list[Any], builder.visit(tree))
+
+
+class _NodeRef(NamedTuple):
+    """Location of an AST node within its module, as (field, index) pairs.
+
+    The index is -1 for fields that hold a single node.
+
+    """
+
+    path: tuple[tuple[str, int], ...]
+    # __all__.append(x) is represented as a list containing x
+    wrap_in_list: bool = False
+
+
+class _StubSource:
+    """A stub file that _NodeRefs point into. It is parsed when first needed."""
+
+    def __init__(self, file_path: Path) -> None:
+        self.file_path = file_path
+        self._tree: Optional[ast.Module] = None
+
+    def resolve(self, ref: _NodeRef) -> ast.AST:
+        if self._tree is None:
+            self._tree = _parse_stub_file(self.file_path)
+        node: Any = self._tree
+        for field, index in ref.path:
+            node = getattr(node, field)
+            if index >= 0:
+                node = node[index]
+        if ref.wrap_in_list:
+            return ast.List(elts=[node], ctx=ast.Load())
+        return node
+
+
+class _DeferredNameInfo(NameInfo):
+    """Base class for NameInfos that compute some of their fields on first access.
+
+    The underlying tuple holds placeholders for those fields, but all public ways
+    of accessing the fields return the real values. _replace() returns a plain
+    NameInfo.
+
+    """
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter((self.name, self.is_exported, self.ast, self.child_nodes))
+
+    def __getitem__(self, index: Union[int, slice]) -> object:  # type: ignore[override]
+        return tuple(self)[index]
+
+    def __eq__(self, other: object) -> bool:
+        return tuple(self) == other
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    def __hash__(self) -> int:
+        # consistent with __eq__, since equal infos have equal names and children
+        return hash((self.name, self.is_exported, self.child_nodes))
+
+    @classmethod
+    def _make(cls, iterable: Iterable[object]) -> NameInfo:  # type: ignore[override,misc]
+        # also used by _replace()
+        return NameInfo._make(iterable)
+
+    def __repr__(self) -> str:
+        return repr(NameInfo(*self))
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (NameInfo, tuple(self))
+
+
+class _LazyNameInfo(_DeferredNameInfo):
+    """A NameInfo whose AST nodes are looked up when they are first accessed.
+
+    The underlying tuple holds _NodeRef placeholders.
+
+    Hashing does not load the nodes, and neither does comparing two infos from the
+    same stub. Comparing with any other NameInfo loads them, because AST nodes
+    compare by identity.
+
+    """
+
+    @property
+    def ast(self) -> Union[ast.AST, ImportedName, OverloadedName]:  # type: ignore[misc]
+        try:
+            return cast(
+                Union[ast.AST, ImportedName, OverloadedName], self.__dict__["_ast"]
+            )
+        except KeyError:
+            pass
+        source: _StubSource = self.__dict__["_source"]
+        value = tuple.__getitem__(self, 2)
+        if isinstance(value, _NodeRef):
+            value = source.resolve(value)
+        elif isinstance(value, OverloadedName):
+            value = OverloadedName(
+                [
+                    source.resolve(defn) if isinstance(defn, _NodeRef) else defn
+                    for defn in value.definitions
+                ]
+            )
+        self.__dict__["_ast"] = value
+        return cast(Union[ast.AST, ImportedName, OverloadedName], value)
+
+    def __eq__(self, other: object) -> bool:
+        if (
+            isinstance(other, _LazyNameInfo)
+            and other.__dict__["_source"] is self.__dict__["_source"]
+        ):
+            # the same placeholders point to the same nodes
+            return tuple.__eq__(self, other)
+        return tuple(self) == other
+
+    # defining __eq__ resets __hash__
+    __hash__ = _DeferredNameInfo.__hash__
+
+
+class _LazyClassInfo(_DeferredNameInfo):
+    """A NameInfo for a class whose child_nodes are collected when first accessed.
+
+    Errors in the class body, such as invalid assignments, are reported at that
+    point rather than when the module is parsed.
+
+    """
+
+    @property
+    def child_nodes(self) -> Optional[NameDict]:  # type: ignore[misc]
+        try:
+            return cast(NameDict, self.__dict__["_child_nodes"])
+        except KeyError:
+            pass
+        extractor: _NameExtractor = self.__dict__["_extractor"]
+        try:
+            child_dict = extractor.get_class_children(cast(ast.ClassDef, self.ast))
+        except _AssertFailed:
+            # too late to discard the module, so only the class is empty
+            child_dict = {}
+        self.__dict__["_child_nodes"] = child_dict
+        return child_dict
+
+
+def _make_lazy(name_dict: NameDict, source: _StubSource) -> NameDict:
+    for name, info in name_dict.items():
+        children = info.child_nodes
+        if children is not None:
+            children = _make_lazy(children, source)
+        if isinstance(info.ast, ImportedName) and children is None:
+            continue
+        lazy_info = _LazyNameInfo(info.name, info.is_exported, info.ast, children)
+        lazy_info.__dict__["_source"] = source
+        name_dict[name] = lazy_info
+    return name_dict
+
+
+@lru_cache(maxsize=1024)
+def _parse_condition(source: str) -> ast.expr:
+    return ast.parse(source, mode="eval").body
+
+
+@lru_cache(maxsize=1024)
+def _get_source_condition_key(source: str) -> Optional[Hashable]:
+    return _get_condition_key(_parse_condition(source))
+
+
+def _evaluate_symbol_table(
+    items: list[Any], ctx: SearchContext, module_name: ModulePath, file_path: Path
+) -> Iterator[NameInfo]:
+    for item in items:
+        kind = item[0]
+        if kind == "name":
+            _, name, is_exported, value, children = item
+            child_dict = None
+            if children is not None:
+                child_dict = _merge_class_children(
+                    _evaluate_symbol_table(children, ctx, module_name, file_path),
+                    is_py_file=False,
+                )
+            # the _NodeRef placeholders are replaced in _make_lazy()
+            yield NameInfo(
+                name, is_exported, _decode_value(value), child_dict  # type: ignore[arg-type]
+            )
+        elif kind == "if":
+            _, condition, body, orelse = item
+            truthiness = get_condition_cache(ctx).evaluate_source(
+                condition, file_path=file_path
+            )
+            if truthiness is None or truthiness:
+                yield from _evaluate_symbol_table(body, ctx, module_name, file_path)
+            if truthiness is None or not truthiness:
+                yield from _evaluate_symbol_table(orelse, ctx, module_name, file_path)
+        elif kind == "assert":
+            truthiness = get_condition_cache(ctx).evaluate_source(
+                item[1], file_path=file_path
+            )
+            if truthiness is False:
+                raise _AssertFailed
+        elif kind == "star":
+            source_module = ModulePath(tuple(item[1]))
+            yield from _get_import_star_infos(
+                source_module, ctx, module_name, file_path
+            )
+        else:
+            raise ValueError(f"Invalid symbol table entry: {item}")
+
+
+def _decode_value(value: list[Any]) -> Union[_NodeRef, ImportedName]:
+    if value[0] == "import":
+        return ImportedName(ModulePath(tuple(value[1])), value[2])
+    _, path, wrap_in_list = value
+    return _NodeRef(tuple((field, index) for field, index in path), wrap_in_list)
+
+
+class _SymbolTableBuilder(_NameExtractor):
+    """Extract names from a stub without evaluating conditions or star imports.
+
+    Produces the JSON-compatible items stored in symbol tables:
+
+    - ["name", name, is_exported, value, children or None]
+    - ["if", condition, body items, else items]
+    - ["assert", condition]
+    - ["star", source module]
+
+    """
+
+    def __init__(
+        self,
+        ctx: SearchContext,
+        module_name: ModulePath,
+        *,
+        file_path: Path,
+        is_init: bool = False,
+        tree: ast.Module,
+    ) -> None:
+        super().__init__(ctx, module_name, file_path=file_path, is_init=is_init)
+        self._paths = _get_node_paths(tree)
+
+    def visit_Module(self, node: ast.Module) -> list[Any]:
+        return self._items(node.body)
+
+    def _items(self, statements: list[ast.stmt]) -> list[Any]:
+        return [self._encode(item) for stmt in statements for item in self.visit(stmt)]
+
+    def _encode(self, item: Union[NameInfo, list[Any]]) -> list[Any]:
+        if isinstance(item, NameInfo):
+            return [
+                "name",
+                item.name,
+                item.is_exported,
+                self._encode_value(item.ast),
+                None,
+            ]
+        return item
+
+    def _encode_value(
+        self, value: Union[ast.AST, ImportedName, OverloadedName]
+    ) -> list[Any]:
+        if isinstance(value, ImportedName):
+            return ["import", list(value.module_name), value.name]
+        if id(value) not in self._paths and isinstance(value, ast.List):
+            # created by __all__.append()
+            return ["node", self._paths[id(value.elts[0])], True]
+        return ["node", self._paths[id(value)], False]
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> Iterable[Any]:
+        yield [
+            "name",
+            node.name,
+            _name_is_exported(node.name),
+            self._encode_value(node),
+            self._items(node.body),
+        ]
+
+    def visit_If(self, node: ast.If) -> Iterable[Any]:
+        yield [
+            "if",
+            ast.unparse(node.test),
+            self._items(node.body),
+            self._items(node.orelse),
+        ]
+
+    def visit_Assert(self, node: ast.Assert) -> Iterable[Any]:
+        return [["assert", ast.unparse(node.test)]]
+
+    def _visit_import_star(self, source_module: ModulePath) -> Iterable[Any]:
+        return [["star", list(source_module)]]
+
+
+def _get_node_paths(tree: ast.AST) -> dict[int, list[tuple[str, int]]]:
+    """Return the paths to the nodes that NameInfos can refer to.
+
+    These are statements and the arguments of calls like ``__all__.extend(...)``;
+    expressions elsewhere are skipped, which makes this several times faster.
+
+    """
+    paths: dict[int, list[tuple[str, int]]] = {}
+    to_do: list[tuple[ast.AST, list[tuple[str, int]]]] = [(tree, [])]
+    while to_do:
+        node, path = to_do.pop()
+        paths[id(node)] = path
+        if isinstance(node, ast.Expr):
+            to_do.append((node.value, [*path, ("value", -1)]))
+            continue
+        if isinstance(node, ast.Call):
+            for index, arg in enumerate(node.args):
+                to_do.append((arg, [*path, ("args", index)]))
+            continue
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                for index, child in enumerate(value):
+                    if isinstance(child, (ast.stmt, ast.excepthandler)):
+                        to_do.append((child, [*path, (field, index)]))
+    return paths
@@ -1,8 +1,15 @@
 """Module responsible for resolving names to the module they come from."""
 
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Generator, Iterable
+from contextlib import contextmanager
+from pathlib import Path
 from typing import NamedTuple, Optional, Union
 
-from . import parser
+from . import finder, parser
 from .finder import ModulePath, SearchContext, get_search_context
 
 
@@ -11,27 +18,426 @@ class ImportedInfo(NamedTuple):
     info: parser.NameInfo
 
 
-ResolvedName = Union[ModulePath, ImportedInfo, parser.NameInfo, None]
+class ImportCycle(NamedTuple):
+    """Returned for a name that is imported in a cycle and never defined."""
+
+    # the imports that make up the cycle, in order
+    imports: tuple[parser.ImportedName, ...]
+
+
+ResolvedName = Union[ModulePath, ImportedInfo, parser.NameInfo, ImportCycle, None]
+
+
+class ModuleStoreStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    # entries held by at least one live Resolver
+    referenced: int
+    # total size of the stored stub files, in bytes
+    size: int
+
+
+class _StoredModule:
+    """The names in a parsed module, with what is needed to check and share them."""
+
+    def __init__(
+        self,
+        names: parser.NameDict,
+        path: Path,
+        stamps: parser._Stamps,
+        imports: Iterable[ModulePath],
+        star_imports: Iterable[ModulePath],
+    ) -> None:
+        self.names = names
+        self.path = os.fspath(path)
+        self.stamps = stamps
+        self.imports = frozenset(imports)
+        self.star_imports = frozenset(star_imports)
+        stamp = stamps.get(self.path)
+        self.size = 0 if stamp is None else stamp[1]
+        # number of live Resolvers using the entry
+        self.refcount = 0
+
+
+class ModuleStore:
+    """Parsed modules shared between Resolvers.
+
+    Resolvers created with the same store share the modules they parse, so a new
+    Resolver does not parse ``builtins``, ``typing`` and other common modules again.
+    Entries are keyed by module name and by the parts of the SearchContext that
+    affect the names in a stub: the typeshed directory, the search path, the Python
+    version and platform, and the ``raise_on_warnings`` and ``allow_py_files``
+    flags. Entries are checked against the modification time and size of the stub
+    and of the stubs it star-imports, so edited stubs are parsed again.
+
+    Each entry counts the live Resolvers that use it. If ``max_bytes`` is not None,
+    the least recently used entries that no Resolver uses are evicted once the
+    stored stubs add up to more than that many bytes of source. Entries in use are
+    never evicted, so the store may go over the limit while they are alive. Changes
+    to the limit take effect when an entry is next added or released.
+
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[
+            tuple[parser._ContextKey, ModulePath], _StoredModule
+        ] = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"<ModuleStore with {len(self._entries)} modules>"
+
+    def stats(self) -> ModuleStoreStats:
+        """Return the number of hits, misses and evictions so far, and the current
+        contents of the store."""
+        with self._lock:
+            referenced = sum(1 for entry in self._entries.values() if entry.refcount)
+            return ModuleStoreStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                referenced,
+                self._size,
+            )
+
+    def invalidate(self, module_name: Optional[ModulePath] = None) -> None:
+        """Forget a module and its submodules in every context, or all modules.
+
+        Resolvers that use a forgotten entry keep their copy of the module.
+
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if module_name is None or _is_inside(key[1], module_name):
+                    self._size -= self._entries.pop(key).size
+
+    def _acquire(
+        self, key: tuple[parser._ContextKey, ModulePath], path: Path
+    ) -> Optional[_StoredModule]:
+        """Return the stored module for this stub, if it is up to date, and count
+        the caller as one of its users."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.path != os.fspath(path) or _is_stale(entry):
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            self._hits += 1
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+            entry.refcount += 1
+        return entry
+
+    def _put(
+        self, key: tuple[parser._ContextKey, ModulePath], entry: _StoredModule
+    ) -> None:
+        """Store a module that the caller has just parsed, and count the caller as
+        one of its users."""
+        with self._lock:
+            entry.refcount += 1
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += entry.size
+            self._evict()
+
+    def _release(self, entries: Iterable[_StoredModule]) -> None:
+        """Called when a Resolver no longer uses some entries."""
+        with self._lock:
+            for entry in entries:
+                entry.refcount -= 1
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.max_bytes is None or self._size <= self.max_bytes:
+            return
+        for key, entry in list(self._entries.items()):
+            if self._size <= self.max_bytes:
+                break
+            if not entry.refcount:
+                del self._entries[key]
+                self._size -= entry.size
+                self._evictions += 1
+
+
+def _release_all(store: ModuleStore, stored: dict[ModulePath, _StoredModule]) -> None:
+    store._release(stored.values())
+    stored.clear()
+
+
+def _is_stale(entry: _StoredModule) -> bool:
+    return any(
+        finder._file_stamp(Path(stub)) != stamp for stub, stamp in entry.stamps.items()
+    )
 
 
 class Resolver:
-    def __init__(self, search_context: Optional[SearchContext] = None) -> None:
+    def __init__(
+        self,
+        search_context: Optional[SearchContext] = None,
+        *,
+        module_store: Optional[ModuleStore] = None,
+    ) -> None:
         if search_context is None:
             search_context = get_search_context()
         self.ctx = search_context
+        self.finder = finder.Finder(search_context)
+        self.module_store = module_store
+        self._context_key = parser._get_context_key(search_context)
+        # loaded module -> the entry in module_store it came from
+        self._stored: dict[ModulePath, _StoredModule] = {}
+        if module_store is not None:
+            weakref.finalize(self, _release_all, module_store, self._stored)
         self._module_cache: dict[ModulePath, Module] = {}
+        self._exists_cache: dict[ModulePath, bool] = {}
+        self._has_submodules_cache: dict[ModulePath, bool] = {}
+        # loaded module -> modules it imports names from
+        self._imports: dict[ModulePath, set[ModulePath]] = {}
+        # loaded module -> modules it star-imports from, directly or indirectly
+        self._star_imports: dict[ModulePath, set[ModulePath]] = {}
+        # the reverse of both: module -> loaded modules that depend on it
+        self._dependents: dict[ModulePath, set[ModulePath]] = {}
 
     def get_module(self, module_name: ModulePath) -> "Module":
         if module_name not in self._module_cache:
-            names = parser.get_stub_names(
-                ".".join(module_name), search_context=self.ctx
+            names = self._load_names(module_name)
+            self._module_cache[module_name] = Module(
+                names or {}, self.ctx, exists=names is not None
             )
-            exists = names is not None
-            if names is None:
-                names = {}
-            self._module_cache[module_name] = Module(names, self.ctx, exists=exists)
         return self._module_cache[module_name]
 
+    def _load_names(self, module_name: ModulePath) -> Optional[parser.NameDict]:
+        """Find and parse a module, and record what it depends on.
+
+        Return None if there is no stub for the module.
+
+        """
+        if not module_name or self._exists_cache.get(module_name) is False:
+            path = None
+        else:
+            path = self.finder.find(module_name)
+        if path is None:
+            self._add_dependencies(module_name, set(), set())
+            return None
+        if self.module_store is not None:
+            key = (self._context_key, module_name)
+            entry = self.module_store._acquire(key, path)
+            if entry is not None:
+                self._stored[module_name] = entry
+                self._add_dependencies(
+                    module_name, set(entry.imports), set(entry.star_imports)
+                )
+                return entry.names
+            # before parsing, so that changes made while parsing are noticed later
+            stamp = finder._file_stamp(path)
+        with parser._recording_star_imports() as recorded:
+            names = parser.get_stub_names_from_file(
+                ".".join(module_name), path, search_context=self.ctx, lazy_classes=True
+            )
+        imports = _get_imports(names)
+        star_imports = {ModulePath(tuple(star.split("."))) for star in recorded}
+        self._add_dependencies(module_name, imports, star_imports)
+        if self.module_store is not None:
+            stamps = {os.fspath(path): stamp}
+            for star in star_imports:
+                star_path = self.finder.find(star)
+                if star_path is not None:
+                    stamps[os.fspath(star_path)] = finder._file_stamp(star_path)
+            entry = _StoredModule(names, path, stamps, imports, star_imports)
+            self._stored[module_name] = entry
+            self.module_store._put(key, entry)
+        return names
+
+    def get_loaded_modules(self) -> set[ModulePath]:
+        """Return the modules that the resolver has loaded."""
+        return set(self._module_cache)
+
+    def get_dependents(
+        self, module_name: ModulePath, *, transitive: bool = False
+    ) -> set[ModulePath]:
+        """Return the loaded modules that import names from a module or star-import
+        it.
+
+        If transitive is True, also include the modules that depend on those
+        modules, and so on. These are the modules that invalidate() may have to
+        drop or update.
+
+        """
+        dependents = set(self._dependents.get(module_name, ()))
+        if transitive:
+            to_do = list(dependents)
+            while to_do:
+                for dependent in self._dependents.get(to_do.pop(), ()):
+                    if dependent not in dependents:
+                        dependents.add(dependent)
+                        to_do.append(dependent)
+        return dependents
+
+    def get_dependency_graph(self) -> dict[ModulePath, set[ModulePath]]:
+        """Return the reverse-dependency graph of the loaded modules.
+
+        The keys are the modules that loaded modules import names from or
+        star-import, and the values are the loaded modules that do so.
+
+        """
+        return {
+            module_name: set(dependents)
+            for module_name, dependents in self._dependents.items()
+        }
+
+    def invalidate(self, module_name: ModulePath) -> set[ModulePath]:
+        """Forget what the resolver knows about a module and its submodules.
+
+        Call this after the stub for the module is created, changed or deleted.
+        The module is dropped, together with every loaded module that star-imports
+        from it. In the other modules that depend on it, directly or indirectly,
+        only the cached results of get_name() that could change are dropped.
+
+        Return the loaded modules that anything was dropped from.
+
+        """
+        self.finder.invalidate(module_name)
+        for cache in (self._exists_cache, self._has_submodules_cache):
+            for cached in list(cache):
+                if _is_inside(cached, module_name) or _is_inside(module_name, cached):
+                    del cache[cached]
+
+        # The star imports of a module are recorded transitively, so this finds all
+        # modules whose names may change
+        dropped = {
+            loaded for loaded in self._module_cache if _is_inside(loaded, module_name)
+        }
+        for loaded, star_imports in self._star_imports.items():
+            if any(_is_inside(star, module_name) for star in star_imports):
+                dropped.add(loaded)
+
+        # Then drop the resolved names that depend on the changed modules: anything
+        # imported from the module or its submodules, anything imported from the
+        # dropped modules, and in turn, the names imported from the names dropped
+        updated: set[ModulePath] = set()
+        # module -> its names that were dropped but not yet followed
+        to_do: dict[ModulePath, set[str]] = {}
+        self._drop_imported_names(module_name, None, dropped, to_do, submodules=True)
+        for loaded in dropped:
+            self._drop_imported_names(loaded, None, dropped, to_do)
+        while to_do:
+            source = next(iter(to_do))
+            updated.add(source)
+            self._drop_imported_names(source, to_do.pop(source), dropped, to_do)
+
+        for loaded in dropped:
+            del self._module_cache[loaded]
+            self._exists_cache.pop(loaded, None)
+            self._remove_dependencies(loaded)
+        if self.module_store is not None:
+            self.module_store.invalidate(module_name)
+            for loaded in dropped:
+                self.module_store.invalidate(loaded)
+            self.module_store._release(
+                [
+                    self._stored.pop(loaded)
+                    for loaded in dropped
+                    if loaded in self._stored
+                ]
+            )
+        return dropped | updated
+
+    def invalidate_all(self) -> set[ModulePath]:
+        """Forget everything the resolver knows, and return the modules it had
+        loaded."""
+        dropped = set(self._module_cache)
+        self._module_cache.clear()
+        self._exists_cache.clear()
+        self._has_submodules_cache.clear()
+        self._imports.clear()
+        self._star_imports.clear()
+        self._dependents.clear()
+        self.finder = finder.Finder(self.ctx)
+        if self.module_store is not None:
+            self.module_store.invalidate()
+            _release_all(self.module_store, self._stored)
+        return dropped
+
+    def _drop_imported_names(
+        self,
+        source: ModulePath,
+        names: Optional[set[str]],
+        dropped: set[ModulePath],
+        to_do: dict[ModulePath, set[str]],
+        *,
+        submodules: bool = False,
+    ) -> None:
+        """Drop the resolved names imported from some names in a module, or from
+        any name if names is None, and add them to to_do."""
+        if submodules:
+            dependents = {
+                dependent
+                for imported, imported_by in self._dependents.items()
+                if _is_inside(imported, source)
+                for dependent in imported_by
+            }
+        else:
+            dependents = self._dependents.get(source, set())
+        for dependent in dependents - dropped:
+            module = self._module_cache[dependent]
+            affected = module._get_names_imported_from(
+                source, names, submodules=submodules
+            )
+            for name in affected:
+                del module._name_cache[name]
+            if affected:
+                to_do.setdefault(dependent, set()).update(affected)
+
+    def _add_dependencies(
+        self,
+        module_name: ModulePath,
+        imports: set[ModulePath],
+        star_imports: set[ModulePath],
+    ) -> None:
+        self._imports[module_name] = imports
+        self._star_imports[module_name] = star_imports
+        for dependency in imports | star_imports:
+            self._dependents.setdefault(dependency, set()).add(module_name)
+
+    def _remove_dependencies(self, module_name: ModulePath) -> None:
+        imports = self._imports.pop(module_name, set())
+        star_imports = self._star_imports.pop(module_name, set())
+        for dependency in imports | star_imports:
+            dependents = self._dependents[dependency]
+            dependents.discard(module_name)
+            if not dependents:
+                del self._dependents[dependency]
+
+    def module_exists(self, module_name: ModulePath) -> bool:
+        """Return whether there is a stub for this module, without parsing it."""
+        if module_name in self._module_cache:
+            return self._module_cache[module_name].exists
+        if module_name not in self._exists_cache:
+            parent = ModulePath(module_name[:-1])
+            if parent and not self._may_have_submodules(parent):
+                self._exists_cache[module_name] = False
+            else:
+                path = self.finder.find(module_name)
+                self._exists_cache[module_name] = path is not None
+        return self._exists_cache[module_name]
+
+    def _may_have_submodules(self, module_name: ModulePath) -> bool:
+        if module_name not in self._has_submodules_cache:
+            self._has_submodules_cache[module_name] = self.finder.may_have_submodules(
+                module_name
+            )
+        return self._has_submodules_cache[module_name]
+
     def get_name(self, module_name: ModulePath, name: str) -> ResolvedName:
         module = self.get_module(module_name)
         return module.get_name(name, self)
@@ -41,6 +447,64 @@ class Resolver:
         *path, tail = name.split(".")
         return self.get_name(ModulePath(tuple(path)), tail)
 
+    def resolve_all(
+        self, module_names: Iterable[ModulePath]
+    ) -> dict[str, ResolvedName]:
+        """Resolve the public names of some modules.
+
+        The public names are those in ``__all__``, or if a module has no
+        ``__all__``, its exported names. Return a mapping from their fully
+        qualified names to what they resolve to, as returned by get_name().
+
+        Rather than following each name's chain of imports on its own, the chains
+        are followed one step at a time for all names together, and every module
+        needed for a step is loaded once for all the names imported from it.
+
+        """
+        requested: dict[ModulePath, list[str]] = {}
+        for module_name in module_names:
+            if module_name not in requested:
+                module = self.get_module(module_name)
+                dunder_all = module.get_dunder_all(self)
+                if dunder_all is None:
+                    dunder_all = [
+                        name for name, info in module.names.items() if info.is_exported
+                    ]
+                requested[module_name] = dunder_all
+
+        # module -> names in it that the next step of the chains goes through
+        step = {module_name: set(names) for module_name, names in requested.items()}
+        seen = {
+            (module_name, name) for module_name, names in step.items() for name in names
+        }
+        while step:
+            next_step: dict[ModulePath, set[str]] = {}
+            for module_name, names in step.items():
+                module = self.get_module(module_name)
+                for name in names:
+                    if name in module._name_cache or name not in module.names:
+                        continue
+                    import_info = parser.get_imported_name(module.names[name])
+                    if import_info is None or import_info.name is None:
+                        continue
+                    submodule = ModulePath((*import_info.module_name, import_info.name))
+                    if self.module_exists(submodule):
+                        continue
+                    target = (import_info.module_name, import_info.name)
+                    if target not in seen:
+                        seen.add(target)
+                        next_step.setdefault(target[0], set()).add(target[1])
+            step = next_step
+
+        # every module on the way is loaded, so this only walks cached modules
+        return {
+            ".".join((*module_name, name)): (
+                self.get_module(module_name).get_name(name, self)
+            )
+            for module_name, names in requested.items()
+            for name in names
+        }
+
 
 class Module:
     def __init__(
@@ -56,6 +520,37 @@ class Module:
             self._name_cache[name] = self._uncached_get_name(name, resolver)
         return self._name_cache[name]
 
+    def _get_names_imported_from(
+        self, module_name: ModulePath, names: Optional[set[str]], *, submodules: bool
+    ) -> list[str]:
+        """Return the resolved names that depend on some names in another module.
+
+        If names is None, return those that depend on any name in the module, and
+        with submodules, also those that depend on its submodules.
+
+        """
+        affected = []
+        for cached in self._name_cache:
+            info = self.names.get(cached)
+            import_info = None if info is None else parser.get_imported_name(info)
+            if import_info is None or import_info.name is None:
+                # local names and modules do not depend on other modules
+                continue
+            if names is not None:
+                is_affected = (
+                    import_info.module_name == module_name and import_info.name in names
+                )
+            elif submodules:
+                submodule = ModulePath((*import_info.module_name, import_info.name))
+                is_affected = _is_inside(
+                    import_info.module_name, module_name
+                ) or _is_inside(submodule, module_name)
+            else:
+                is_affected = import_info.module_name == module_name
+            if is_affected:
+                affected.append(cached)
+        return affected
+
     def get_dunder_all(self, resolver: Resolver) -> Optional[list[str]]:
         """Return the contents of __all__, or None if it does not exist."""
         resolved_name = self.get_name("__all__", resolver)
@@ -68,23 +563,216 @@ class Module:
         return parser.get_dunder_all_from_info(resolved_name)
 
     def _uncached_get_name(self, name: str, resolver: Resolver) -> ResolvedName:
-        if name not in self.names:
-            return None
-        info = self.names[name]
-        if not isinstance(info.ast, parser.ImportedName):
-            return info
-        # TODO prevent infinite recursion
-        import_info = info.ast
-        if import_info.name is not None:
+        """Follow the chain of imports that leads to a name's definition.
+
+        Every name passed through on the way is cached with its own result, so
+        later lookups of any of them do not walk the chain again.
+
+        """
+        # the names passed through, and the imports that lead from each to the next
+        chain: list[tuple[Module, str]] = [(self, name)]
+        imports: list[parser.ImportedName] = []
+        positions = {(self, name): 0}
+        while True:
+            module, current = chain[-1]
+            if len(chain) > 1 and current in module._name_cache:
+                resolved = module._name_cache[current]
+                break
+            info = module.names.get(current)
+            if info is None:
+                resolved = None
+                break
+            import_info = parser.get_imported_name(info)
+            if import_info is None:
+                resolved = info
+                break
+            if import_info.name is None:
+                resolved = import_info.module_name
+                break
             module_path = ModulePath((*import_info.module_name, import_info.name))
-            module = resolver.get_module(module_path)
-            if module.exists:
-                return module_path
-            resolved = resolver.get_name(import_info.module_name, import_info.name)
+            if resolver.module_exists(module_path):
+                resolved = module_path
+                break
+            next_name = (resolver.get_module(import_info.module_name), import_info.name)
+            if next_name in positions:
+                cycle = imports[positions[next_name] :]
+                resolved = ImportCycle((*cycle, import_info))
+                break
+            imports.append(import_info)
+            positions[next_name] = len(chain)
+            chain.append(next_name)
+
+        # walk back along the chain; a name defined in another module is returned
+        # together with the module it comes from
+        for (module, current), import_info in zip(chain[:0:-1], reversed(imports)):
+            if current not in module._name_cache:
+                module._name_cache[current] = resolved
             if isinstance(resolved, parser.NameInfo):
-                return ImportedInfo(import_info.module_name, resolved)
-            else:
-                # TODO: preserve export information
-                return resolved
-        else:
-            return import_info.module_name
+                resolved = ImportedInfo(import_info.module_name, resolved)
+            # TODO: preserve export information
+        return resolved
+
+
+class ThreadSafeResolver(Resolver):
+    """A Resolver that can be shared between threads.
+
+    Each module is parsed once, however many threads ask for it at the same time:
+    the first thread parses it while the others wait for the result. Lookups run
+    concurrently otherwise. invalidate() and invalidate_all() wait for the lookups
+    in progress to finish and hold back new ones until they are done, so lookups
+    never see a half-invalidated resolver.
+
+    """
+
+    def __init__(
+        self,
+        search_context: Optional[SearchContext] = None,
+        *,
+        module_store: Optional[ModuleStore] = None,
+    ) -> None:
+        super().__init__(search_context, module_store=module_store)
+        # guards the dependency graph and _module_locks
+        self._lock = threading.Lock()
+        # module -> lock held while the module is loaded
+        self._module_locks: dict[ModulePath, threading.Lock] = {}
+        # lookups in progress, and invalidations waiting for them or running
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers = 0
+        self._writing = False
+        self._local = threading.local()
+
+    def get_module(self, module_name: ModulePath) -> "Module":
+        with self._reading():
+            module = self._module_cache.get(module_name)
+            if module is not None:
+                return module
+            with self._lock:
+                module_lock = self._module_locks.setdefault(
+                    module_name, threading.Lock()
+                )
+            with module_lock:
+                # another thread may have loaded it while we waited
+                module = self._module_cache.get(module_name)
+                if module is None:
+                    names = self._load_names(module_name)
+                    module = _ThreadSafeModule(
+                        names or {}, self.ctx, exists=names is not None
+                    )
+                    self._module_cache[module_name] = module
+                return module
+
+    def module_exists(self, module_name: ModulePath) -> bool:
+        with self._reading():
+            return super().module_exists(module_name)
+
+    def get_name(self, module_name: ModulePath, name: str) -> ResolvedName:
+        with self._reading():
+            return super().get_name(module_name, name)
+
+    def resolve_all(
+        self, module_names: Iterable[ModulePath]
+    ) -> dict[str, ResolvedName]:
+        with self._reading():
+            return super().resolve_all(module_names)
+
+    def get_loaded_modules(self) -> set[ModulePath]:
+        with self._lock:
+            return super().get_loaded_modules()
+
+    def get_dependents(
+        self, module_name: ModulePath, *, transitive: bool = False
+    ) -> set[ModulePath]:
+        with self._lock:
+            return super().get_dependents(module_name, transitive=transitive)
+
+    def get_dependency_graph(self) -> dict[ModulePath, set[ModulePath]]:
+        with self._lock:
+            return super().get_dependency_graph()
+
+    def invalidate(self, module_name: ModulePath) -> set[ModulePath]:
+        with self._writing_lock():
+            dropped = super().invalidate(module_name)
+            for loaded in list(self._module_locks):
+                if loaded not in self._module_cache:
+                    del self._module_locks[loaded]
+            return dropped
+
+    def invalidate_all(self) -> set[ModulePath]:
+        with self._writing_lock():
+            self._module_locks.clear()
+            return super().invalidate_all()
+
+    def _add_dependencies(
+        self,
+        module_name: ModulePath,
+        imports: set[ModulePath],
+        star_imports: set[ModulePath],
+    ) -> None:
+        with self._lock:
+            super()._add_dependencies(module_name, imports, star_imports)
+
+    @contextmanager
+    def _reading(self) -> Generator[None, None, None]:
+        """Hold back invalidation while resolving names on this thread."""
+        depth = getattr(self._local, "depth", 0)
+        if not depth:
+            with self._condition:
+                # waiting invalidations go first, so that lookups cannot starve them
+                while self._writers:
+                    self._condition.wait()
+                self._readers += 1
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if not depth:
+                with self._condition:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._condition.notify_all()
+
+    @contextmanager
+    def _writing_lock(self) -> Generator[None, None, None]:
+        """Wait for the lookups in progress, and hold back new ones."""
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("Cannot invalidate a resolver while resolving a name")
+        with self._condition:
+            self._writers += 1
+            while self._readers or self._writing:
+                self._condition.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writers -= 1
+                self._writing = False
+                self._condition.notify_all()
+
+
+class _ThreadSafeModule(Module):
+    """A Module that holds back invalidation of its resolver while it resolves a
+    name, so that it never caches a result from before the invalidation."""
+
+    def get_name(self, name: str, resolver: Resolver) -> ResolvedName:
+        if isinstance(resolver, ThreadSafeResolver):
+            with resolver._reading():
+                return super().get_name(name, resolver)
+        return super().get_name(name, resolver)
+
+
+def _get_imports(names: parser.NameDict) -> set[ModulePath]:
+    """Return the modules that get_name() may look at to resolve the names."""
+    imports: set[ModulePath] = set()
+    for info in names.values():
+        import_info = parser.get_imported_name(info)
+        if import_info is not None and import_info.name is not None:
+            imports.add(import_info.module_name)
+            imports.add(ModulePath((*import_info.module_name, import_info.name)))
+    return imports
+
+
+def _is_inside(module_name: ModulePath, package: ModulePath) -> bool:
+    return module_name[: len(package)] == package
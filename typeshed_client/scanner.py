@@ -0,0 +1,599 @@
+"""Fast collection of the top-level names in a stub, without parsing all of it.
+
+The scanner splits a stub into logical lines with a small lexer and only looks at
+the statements at the top level of the module and inside top-level ``if`` and
+``try`` blocks. Function and class bodies are skipped, and the common statements
+(definitions, assignments and imports) are recognized without building an AST.
+Other statements are parsed on their own, and a stub that the scanner cannot
+split into statements is parsed completely.
+
+The result is the same as that of parser.get_stub_records(), except that classes
+have no children. The scanner assumes that the stub is valid Python: some syntax
+errors that ast.parse() would report are not detected.
+
+"""
+
+import ast
+import keyword
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, NamedTuple, Optional, Union, cast
+
+from . import finder, parser
+from .finder import ModulePath, SearchContext, get_search_context
+from .parser import (
+    ImportedName,
+    NameInfo,
+    NameRecord,
+    OverloadedName,
+    RecordDict,
+    _name_is_exported,
+)
+
+
+def scan_stub_names(
+    module_name: str, *, search_context: Optional[SearchContext] = None
+) -> Optional[RecordDict]:
+    """Given a module name, return NameRecords for its top-level names."""
+    if search_context is None:
+        search_context = get_search_context()
+    path = finder.get_stub_file(module_name, search_context=search_context)
+    if path is None:
+        return None
+    return scan_stub_names_from_file(module_name, path, search_context=search_context)
+
+
+def scan_stub_names_from_file(
+    module_name: str, path: Path, *, search_context: Optional[SearchContext] = None
+) -> RecordDict:
+    """Return NameRecords for the top-level names in a module, given its stub file."""
+    if search_context is None:
+        search_context = get_search_context()
+    module_path = ModulePath(tuple(module_name.split(".")))
+    is_init = path.name in ("__init__.py", "__init__.pyi")
+    source = finder._read_text(path)
+    names: Optional[list[NameInfo]] = None
+    try:
+        if path.suffix != ".py":
+            try:
+                names = _Scanner(
+                    source, search_context, module_path, file_path=path, is_init=is_init
+                ).scan()
+            except _Unsupported:
+                pass
+        if names is None:
+            tree = ast.parse(source, filename=str(path))
+            extractor = parser._NameExtractor(
+                search_context,
+                module_path,
+                file_path=path,
+                is_init=is_init,
+                lazy_classes=True,
+            )
+            names = extractor.visit(tree)
+    except parser._AssertFailed:
+        return {}
+    name_dict = parser._merge_names(names, search_context, module_path, path)
+    return {
+        name: _make_record(info, module_path, path) for name, info in name_dict.items()
+    }
+
+
+class _Unsupported(Exception):
+    """Raised when the scanner cannot handle a stub, which is then parsed instead."""
+
+
+class _LogicalLine(NamedTuple):
+    indent: int
+    # zero-based numbers of the first and last physical lines
+    lineno: int
+    end_lineno: int
+    # offsets in the source of the start of the first physical line, and of the
+    # start and end of the code
+    begin: int
+    start: int
+    end: int
+
+
+_STRING = r"""
+    '''(?:[^'\\]|\\.|'(?!''))*'''
+    |\"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"
+    |'(?:[^'\\\n]|\\.)*'
+    |"(?:[^"\\\n]|\\.)*"
+"""
+# Runs of other characters are matched atomically with a lookahead, so that the
+# regexes do not backtrack into them if they fail.
+_BRACKETS = "(?!)"
+for _level in range(10):
+    _BRACKETS = rf"""
+        [(\[{{]
+        (?:
+            (?=(?P<plain{_level}>[^'"\#\\()\[\]{{}}]+))(?P=plain{_level})
+            |{_STRING}|\#[^\n]*|\\\n|{_BRACKETS}
+        )*
+        [)\]}}]
+    """
+# The code of a logical line, if its brackets are not nested too deeply
+_CODE = rf"""
+    (?:(?=(?P<plain>[^'"\#\\()\[\]{{}}\n]+))(?P=plain)|{_STRING}|{_BRACKETS}|\\\n)*
+"""
+# A logical line, preceded by any blank lines and comments
+_LOGICAL_LINE_RE = re.compile(
+    rf"""
+    (?:[ ]*(?:\#[^\n]*)?\n)*
+    (?P<line>[ ]*)(?P<code>{_CODE})(?:\#[^\n]*)?(?:\n|\Z)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_DEFINITION_RE = re.compile(r"(?:async\s+)?def\b|class\b")
+
+
+@lru_cache
+def _get_block_re(indent: int) -> "re.Pattern[str]":
+    """Return a regex that matches the body of a definition at this indentation.
+
+    The ``code`` group is the last line of code in the body.
+
+    """
+    return re.compile(
+        rf"""
+        (?:
+            [ ]*(?:\#[^\n]*)?\n
+            |[ ]{{{indent + 1},}}(?=[^ \n\#])(?P<code>{_CODE})(?:\#[^\n]*)?(?:\n|\Z)
+        )*
+        """,
+        re.VERBOSE | re.DOTALL,
+    )
+
+
+# Tokens in a single statement that matter for finding its operators
+_TOKEN_RE = re.compile(
+    r"""
+    [rRbBuUfF]{0,2}(?:'''(?:[^\\]|\\.)*?'''|\"\"\"(?:[^\\]|\\.)*?\"\"\"
+                     |'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+    |\#[^\n]*
+    |(?P<open>[(\[{])
+    |(?P<close>[)\]}])
+    |(?P<op>->|\*\*=|//=|>>=|<<=|[-+*/%&|^@<>!:=]=|[:;=])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_WORD_RE = re.compile(r"\w+")
+_SIMPLE_ASSIGNMENT_RE = re.compile(r"((?!\d)\w+)\s*(:|=)(?!=)")
+_EXTEND_DUNDER_ALL_RE = re.compile(r"__all__\s*\+=")
+_NAME_RE = re.compile(r"(?!\d)\w+")
+_DEF_RE = re.compile(r"(async\s+)?def\s+((?!\d)\w+)")
+_CLASS_RE = re.compile(r"class\s+((?!\d)\w+)")
+_IMPORT_RE = re.compile(r"import\s+(.*)", re.DOTALL)
+_FROM_RE = re.compile(r"from\s*(\.*)\s*([\w.]*)\s+import\s*(.*)", re.DOTALL)
+_ALIAS_RE = re.compile(r"\s*((?!\d)[\w.]+|\*)(?:\s+as\s+((?!\d)\w+))?\s*")
+_IGNORED_RE = re.compile(r"\\\n|#[^\n]*")
+_DOCSTRING_RE = re.compile(
+    r"""[rRuU]?(?:'''(?:[^\\]|\\.)*?'''|\"\"\"(?:[^\\]|\\.)*?\"\"\"
+                 |'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")""",
+    re.VERBOSE | re.DOTALL,
+)
+
+# The child_nodes of classes with a non-trivial body. _merge_names() only checks
+# whether a class has children.
+_SKIPPED_CHILDREN: dict[str, Any] = {"...": None}
+
+
+class _Scanner:
+    """Collect the top-level NameInfos in a stub.
+
+    Names defined by the statements that the scanner recognizes have a NameRecord
+    as their ``ast``; the others have their AST node.
+
+    """
+
+    def __init__(
+        self,
+        source: str,
+        ctx: SearchContext,
+        module_name: ModulePath,
+        *,
+        file_path: Path,
+        is_init: bool = False,
+    ) -> None:
+        self.ctx = ctx
+        self.module_name = module_name
+        self.file_path = file_path
+        self.conditions = parser.get_condition_cache(ctx)
+        self.extractor = parser._NameExtractor(
+            ctx, module_name, file_path=file_path, is_init=is_init, lazy_classes=True
+        )
+        if "\r" in source:
+            raise _Unsupported
+        self.source = source
+        self.lines = _split_logical_lines(source)
+
+    def scan(self) -> list[NameInfo]:
+        names: list[NameInfo] = []
+        self._visit_block(0, len(self.lines), names)
+        return names
+
+    def _visit_block(self, start: int, stop: int, names: list[NameInfo]) -> None:
+        index = start
+        while index < stop:
+            if self.lines[index].indent != self.lines[start].indent:
+                raise _Unsupported
+            index = self._visit_statement(index, names)
+
+    def _visit_statement(self, index: int, names: list[NameInfo]) -> int:
+        """Collect the names defined by a statement and return the index of the
+        next one."""
+        text = self._get_text(index)
+        match = _WORD_RE.match(text)
+        word = match.group() if match else ""
+        if word in ("def", "async"):
+            return self._visit_def(index, text, names)
+        elif word == "class":
+            return self._visit_class(index, text, names)
+        elif word == "if":
+            return self._visit_if(index, names)
+        elif word == "try":
+            return self._visit_try(index, names)
+        elif word in ("import", "from"):
+            return self._visit_import(index, text, names)
+        elif text.startswith("@") or text in ("...", "pass"):
+            return index + 1
+        else:
+            return self._visit_assignment(index, text, names)
+
+    def _visit_def(self, index: int, text: str, names: list[NameInfo]) -> int:
+        match = _DEF_RE.match(text)
+        if match is None:
+            return self._visit_parsed(index, names)
+        # the location of a function does not depend on what its body is
+        body_end = self._get_block_end(index)
+        kind = "FunctionDef" if match.group(1) is None else "AsyncFunctionDef"
+        name = match.group(2)
+        names.append(self._make_info(name, kind, index, body_end - 1))
+        return body_end
+
+    def _visit_class(self, index: int, text: str, names: list[NameInfo]) -> int:
+        match = _CLASS_RE.match(text)
+        colon = None if match is None else _find_header_colon(text)
+        if match is None or colon is None:
+            return self._visit_parsed(index, names)
+        body_end = self._get_block_end(index)
+        body = text[colon + 1 :].strip()
+        if bool(body) == (body_end > index + 1):
+            return self._visit_parsed(index, names)
+        name = match.group(1)
+        children = {}
+        if body:
+            if not _is_trivial_statement(body):
+                return self._visit_parsed(index, names)
+        else:
+            for body_index in range(index + 1, body_end):
+                if not _is_trivial_statement(self._get_text(body_index).strip()):
+                    children = _SKIPPED_CHILDREN
+                    break
+        names.append(
+            self._make_info(name, "ClassDef", index, body_end - 1, child_nodes=children)
+        )
+        return body_end
+
+    def _visit_if(self, index: int, names: list[NameInfo]) -> int:
+        clauses = self._get_clauses(index, ("elif", "else"))
+        if clauses is None:
+            return self._visit_parsed(index, names)
+        for header, colon, body_end in clauses:
+            text = self._get_text(header)
+            if text.startswith("else"):
+                self._visit_block(header + 1, body_end, names)
+                break
+            keyword = 2 if text.startswith("if") else 4
+            value = self.conditions.evaluate_source(
+                text[keyword:colon].strip(), file_path=self.file_path
+            )
+            if value is None or value:
+                self._visit_block(header + 1, body_end, names)
+            if value:
+                break
+        return clauses[-1][2]
+
+    def _visit_try(self, index: int, names: list[NameInfo]) -> int:
+        clauses = self._get_clauses(index, ("except", "else", "finally"))
+        if clauses is None:
+            return self._visit_parsed(index, names)
+        for header, _, body_end in clauses:
+            text = self._get_text(header)
+            # try-except sometimes gets used with conditional imports. We assume
+            # the try block is always executed.
+            if text.startswith(("try", "finally")):
+                self._visit_block(header + 1, body_end, names)
+        return clauses[-1][2]
+
+    def _get_clauses(
+        self, index: int, keywords: tuple[str, ...]
+    ) -> Optional[list[tuple[int, int, int]]]:
+        """Return the header, colon position and end of each clause of a compound
+        statement, or None if one of them is not followed by an indented block."""
+        indent = self.lines[index].indent
+        clauses = []
+        while True:
+            text = self._get_text(index)
+            colon = _find_header_colon(text)
+            body_end = self._get_block_end(index)
+            if colon is None or text[colon + 1 :].strip() or body_end == index + 1:
+                return None
+            clauses.append((index, colon, body_end))
+            if body_end == len(self.lines) or self.lines[body_end].indent != indent:
+                return clauses
+            match = _WORD_RE.match(self._get_text(body_end))
+            if match is None or match.group() not in keywords:
+                return clauses
+            index = body_end
+
+    def _visit_import(self, index: int, text: str, names: list[NameInfo]) -> int:
+        text = _IGNORED_RE.sub("", text)
+        node: ast.stmt
+        if text.startswith("import"):
+            match = _IMPORT_RE.fullmatch(text)
+            aliases = None if match is None else _parse_aliases(match.group(1))
+            if aliases is None:
+                return self._visit_parsed(index, names)
+            node = ast.Import(names=aliases)
+        else:
+            match = _FROM_RE.fullmatch(text)
+            if match is None:
+                return self._visit_parsed(index, names)
+            dots, module, imported = match.groups()
+            if imported.startswith("("):
+                imported = imported[1:-1] if imported.endswith(")") else ""
+            elif imported.endswith(","):
+                imported = ""
+            aliases = _parse_aliases(imported)
+            if aliases is None or not (dots or module):
+                return self._visit_parsed(index, names)
+            node = ast.ImportFrom(module=module or None, names=aliases, level=len(dots))
+        names += self.extractor.visit(node)
+        return index + 1
+
+    def _visit_assignment(self, index: int, text: str, names: list[NameInfo]) -> int:
+        if ";" in text:
+            return self._visit_parsed(index, names)
+        match = _SIMPLE_ASSIGNMENT_RE.match(text)
+        if (
+            match is not None
+            and not keyword.iskeyword(match.group(1))
+            and (match.group(2) == ":" or "=" not in text[match.end() :])
+        ):
+            name = match.group(1)
+            kind = "AnnAssign" if match.group(2) == ":" else "Assign"
+            names.append(self._make_info(name, kind, index, index))
+            return index + 1
+        if _EXTEND_DUNDER_ALL_RE.match(text):
+            names.append(
+                self._make_info("__all__", "AugAssign", index, index, is_exported=True)
+            )
+            return index + 1
+        operators = _find_operators(text)
+        if not operators or operators[0][0] not in (":", "="):
+            return self._visit_parsed(index, names)
+        if operators[0][0] == ":":
+            kind = "AnnAssign"
+            targets = [text[: operators[0][1]]]
+        else:
+            kind = "Assign"
+            targets = []
+            start = 0
+            for operator, position in operators:
+                if operator == "=":
+                    targets.append(text[start:position])
+                    start = position + 1
+        targets = [target.strip() for target in targets]
+        if not all(_NAME_RE.fullmatch(target) for target in targets):
+            return self._visit_parsed(index, names)
+        names += [self._make_info(target, kind, index, index) for target in targets]
+        return index + 1
+
+    def _visit_parsed(self, index: int, names: list[NameInfo]) -> int:
+        """Parse a statement and collect its names with the _NameExtractor."""
+        indent = self.lines[index].indent
+        stop = self._get_block_end(index)
+        while stop < len(self.lines) and self.lines[stop].indent == indent:
+            match = _WORD_RE.match(self._get_text(stop))
+            if match is None or match.group() not in (
+                "elif",
+                "else",
+                "except",
+                "finally",
+            ):
+                break
+            stop = self._get_block_end(stop)
+        start_line = self.lines[index].lineno
+        source = self.source[self.lines[index].begin : self.lines[stop - 1].end]
+        if indent:
+            # keep the original columns
+            source = "if 1:\n" + source
+        try:
+            tree = ast.parse(source, filename=str(self.file_path))
+        except SyntaxError:
+            raise _Unsupported from None
+        statements = tree.body
+        if indent:
+            assert isinstance(statements[0], ast.If), statements
+            statements = statements[0].body
+        for statement in statements:
+            ast.increment_lineno(statement, start_line - (1 if indent else 0))
+            names += self.extractor.visit(statement)
+        return stop
+
+    def _make_info(
+        self,
+        name: str,
+        kind: str,
+        first: int,
+        last: int,
+        *,
+        is_exported: Optional[bool] = None,
+        child_nodes: Optional[dict[str, Any]] = None,
+    ) -> NameInfo:
+        """Return a NameInfo for a statement spanning the given logical lines."""
+        start = self.lines[first]
+        end = self.lines[last]
+        # AST columns count UTF-8 bytes
+        end_line = self.source[self.source.rfind("\n", 0, end.end) + 1 : end.end]
+        end_col = len(end_line) if end_line.isascii() else len(end_line.encode())
+        if is_exported is None:
+            is_exported = _name_is_exported(name)
+        record = NameRecord(
+            name,
+            is_exported,
+            kind,
+            self.module_name,
+            self.file_path,
+            location=(start.lineno + 1, start.indent, end.end_lineno + 1, end_col),
+        )
+        # the NameRecord stands in for the AST node until the names are merged
+        return NameInfo(name, is_exported, cast(ast.AST, record), child_nodes)
+
+    def _get_block_end(self, index: int) -> int:
+        """Return the index of the first logical line after a statement's body."""
+        indent = self.lines[index].indent
+        end = index + 1
+        while end < len(self.lines) and self.lines[end].indent > indent:
+            end += 1
+        return end
+
+    def _get_text(self, index: int) -> str:
+        """Return the source of a logical line, without its trailing comment."""
+        line = self.lines[index]
+        return self.source[line.start : line.end]
+
+
+def _split_logical_lines(source: str) -> list[_LogicalLine]:
+    """Find the logical lines in a stub, skipping blank lines and comments.
+
+    The body of each function and class is a single logical line.
+
+    """
+    if "\t" in source or "\f" in source:
+        raise _Unsupported
+    logical_lines = []
+    position = lineno = 0
+    while position < len(source):
+        match = _LOGICAL_LINE_RE.match(source, position)
+        if match is None:
+            raise _Unsupported
+        code = match.group("code")
+        begin = match.start("line")
+        start = match.start("code")
+        end = start + len(code.rstrip())
+        if end == start:
+            if match.end() < len(source):
+                raise _Unsupported
+            # blank lines at the end of the stub
+            break
+        indent = start - begin
+        lineno += source.count("\n", position, begin)
+        logical_lines.append(
+            _LogicalLine(
+                indent,
+                lineno,
+                lineno + source.count("\n", start, end),
+                begin,
+                start,
+                end,
+            )
+        )
+        lineno += source.count("\n", begin, match.end())
+        position = match.end()
+        if source[end - 1] == ":" and _DEFINITION_RE.match(source, start):
+            block = _get_block_re(indent).match(source, position)
+            assert block is not None, "the regex matches the empty string"
+            if block.group("code") is not None:
+                end = block.start("code") + len(block.group("code").rstrip())
+                logical_lines.append(
+                    _LogicalLine(
+                        indent + 1,
+                        lineno,
+                        lineno + source.count("\n", position, end),
+                        position,
+                        position,
+                        end,
+                    )
+                )
+                lineno += source.count("\n", position, block.end())
+                position = block.end()
+    return logical_lines
+
+
+def _find_operators(text: str) -> list[tuple[str, int]]:
+    """Return the operators outside brackets in a statement, with their positions."""
+    operators = []
+    depth = 0
+    for match in _TOKEN_RE.finditer(text):
+        if match.lastgroup == "open":
+            depth += 1
+        elif match.lastgroup == "close":
+            depth -= 1
+        elif match.lastgroup == "op" and depth == 0:
+            operators.append((match.group(), match.start()))
+    return operators
+
+
+def _find_header_colon(text: str) -> Optional[int]:
+    """Return the position of the colon that ends the header of a compound
+    statement."""
+    for operator, position in _find_operators(text):
+        if operator == ":":
+            return position
+    return None
+
+
+def _is_trivial_statement(text: str) -> bool:
+    return text in ("...", "pass") or _DOCSTRING_RE.fullmatch(text) is not None
+
+
+def _parse_aliases(text: str) -> Optional[list[ast.alias]]:
+    aliases: list[ast.alias] = []
+    for part in text.split(","):
+        match = _ALIAS_RE.fullmatch(part)
+        if match is None:
+            if part.strip() or not aliases:
+                return None
+            # a trailing comma
+            continue
+        aliases.append(ast.alias(name=match.group(1), asname=match.group(2)))
+    return aliases
+
+
+def _make_record(
+    info: NameInfo, module_name: ModulePath, file_path: Path
+) -> NameRecord:
+    if isinstance(info.ast, OverloadedName):
+        definitions = tuple(
+            _make_definition(info.name, info.is_exported, defn, module_name, file_path)
+            for defn in info.ast.definitions
+        )
+        return NameRecord(
+            info.name,
+            info.is_exported,
+            "overload",
+            module_name,
+            file_path,
+            definitions=definitions,
+        )
+    return _make_definition(
+        info.name, info.is_exported, info.ast, module_name, file_path
+    )
+
+
+def _make_definition(
+    name: str,
+    is_exported: bool,
+    node: Union[ast.AST, ImportedName, NameRecord],
+    module_name: ModulePath,
+    file_path: Path,
+) -> NameRecord:
+    if isinstance(node, NameRecord):
+        # the definitions of an overloaded name share its export flag
+        node.is_exported = is_exported
+        return node
+    return parser._make_record(name, is_exported, None, module_name, file_path, node)
@@ -0,0 +1,400 @@
+"""Find where names are defined and which modules re-export them.
+
+A symbol index records, for every public name of every stub in a SearchContext,
+the module that defines it and the modules that re-export it. It is built once
+with the Resolver and saved in a binary file that is memory-mapped when it is
+opened. Lookups binary-search the mapped file and decode only the entries they
+return, so no stubs are parsed and no NameDicts are loaded to answer them.
+
+The file starts with a header giving the position of each table, followed by a
+JSON description of the context and of the stub files the index was built from.
+All integers are unsigned, 32 bits and little-endian. Strings are stored once, in
+a table of (offset, length) pairs pointing into a blob of UTF-8 text. Names are
+(string, start, length) records, sorted by their UTF-8 encoding, of a slice of a
+list of definition numbers. They are found through an open-addressing hash table
+keyed by the CRC-32 of the name. Definitions are (name string, module string,
+first re-export, number of re-exports), and re-exports are (module string, name
+string).
+
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from types import TracebackType
+from typing import Any, NamedTuple, Optional
+
+from . import finder, parser
+from .finder import ModulePath, SearchContext, get_search_context
+from .resolver import ImportedInfo, Resolver
+
+log = logging.getLogger(__name__)
+
+_SYMBOL_INDEX_MAGIC = b"TSCSYMIX"
+_SYMBOL_INDEX_FORMAT = 1
+# magic, format, then (offset, count) for the metadata (a length in bytes), the
+# strings, the blob (a length in bytes), the names, the hash table, the definition
+# lists, the definitions and the re-exports
+_HEADER = struct.Struct("<8sI16I")
+_STRING = struct.Struct("<II")
+_NAME = struct.Struct("<III")
+_DEFINITION = struct.Struct("<IIII")
+_REEXPORT = struct.Struct("<II")
+_INDEX = struct.Struct("<I")
+
+
+class ReExport(NamedTuple):
+    # the module that re-exports the name
+    module: str
+    # the name it is available as in that module
+    name: str
+
+
+class SymbolDefinition(NamedTuple):
+    # the module that defines the name
+    module: str
+    name: str
+    # the modules that make the definition available under some public name,
+    # sorted; includes the defining module if the name is public there
+    reexports: tuple[ReExport, ...]
+
+
+class SymbolIndex:
+    """A memory-mapped symbol index, as written by build_symbol_index().
+
+    Call ``close()`` when the index is no longer needed, or use it as a context
+    manager.
+
+    """
+
+    def __init__(self, path: Path, data: mmap.mmap) -> None:
+        self.path = path
+        self._data = data
+        fields = _HEADER.unpack_from(data)
+        (
+            self._metadata_offset,
+            metadata_length,
+            self._strings_offset,
+            _,
+            self._blob_offset,
+            _,
+            self._names_offset,
+            self._name_count,
+            self._slots_offset,
+            slot_count,
+            self._lists_offset,
+            _,
+            self._definitions_offset,
+            _,
+            self._reexports_offset,
+            _,
+        ) = fields[2:]
+        self._slot_mask = slot_count - 1
+        metadata = json.loads(
+            data[self._metadata_offset : self._metadata_offset + metadata_length]
+        )
+        self.key: dict[str, object] = metadata["key"]
+        self._stamps: dict[str, list[int]] = metadata["stamps"]
+        self._directory_mtimes: dict[str, int] = metadata["directory_mtimes"]
+
+    def __repr__(self) -> str:
+        return f"<SymbolIndex with {self._name_count} names>"
+
+    def __enter__(self) -> "SymbolIndex":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._name_count
+
+    def __contains__(self, name: str) -> bool:
+        return self._find(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the indexed names, in the order of their UTF-8 encoding."""
+        for i in range(self._name_count):
+            string, _, _ = _NAME.unpack_from(
+                self._data, self._names_offset + i * _NAME.size
+            )
+            yield self._string(string).decode("utf-8")
+
+    @classmethod
+    def open(cls, path: Path) -> Optional["SymbolIndex"]:
+        """Map an index from disk, returning None if it is missing or unreadable."""
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            if len(data) < _HEADER.size:
+                raise ValueError("truncated header")
+            magic, version, *_ = _HEADER.unpack_from(data)
+            if magic != _SYMBOL_INDEX_MAGIC or version != _SYMBOL_INDEX_FORMAT:
+                raise ValueError("not a symbol index")
+            return cls(path, data)
+        except (ValueError, KeyError, struct.error):
+            data.close()
+            return None
+
+    def close(self) -> None:
+        self._data.close()
+
+    def lookup(self, name: str) -> list[SymbolDefinition]:
+        """Return the definitions that have this name or are re-exported as it.
+
+        The definitions are sorted by module.
+
+        """
+        found = self._find(name)
+        if found is None:
+            return []
+        first, count = found
+        definitions = []
+        for i in range(first, first + count):
+            (definition,) = _INDEX.unpack_from(
+                self._data, self._lists_offset + i * _INDEX.size
+            )
+            definitions.append(self._definition(definition))
+        return definitions
+
+    def matches(self, search_context: SearchContext) -> bool:
+        """Return whether this index was built for the given context."""
+        return self.key == _symbol_index_key(search_context)
+
+    def is_stale(self) -> bool:
+        """Return whether any of the indexed stubs has changed, or a stub may
+        have been added to or removed from any of the scanned directories.
+
+        The bundled copy of typeshed never changes, so its stubs are not checked.
+
+        """
+        if finder._mtimes_changed(self._directory_mtimes):
+            return True
+        return any(
+            list(finder._file_stamp(Path(path)) or ()) != stamp
+            for path, stamp in self._stamps.items()
+        )
+
+    def _find(self, name: str) -> Optional[tuple[int, int]]:
+        """Return the position and number of the definitions of a name."""
+        key = name.encode("utf-8")
+        slot = zlib.crc32(key) & self._slot_mask
+        while True:
+            (entry,) = _INDEX.unpack_from(
+                self._data, self._slots_offset + slot * _INDEX.size
+            )
+            if not entry:
+                return None
+            string, first, count = _NAME.unpack_from(
+                self._data, self._names_offset + (entry - 1) * _NAME.size
+            )
+            if self._string(string) == key:
+                return first, count
+            slot = (slot + 1) & self._slot_mask
+
+    def _definition(self, definition: int) -> SymbolDefinition:
+        name, module, first, count = _DEFINITION.unpack_from(
+            self._data, self._definitions_offset + definition * _DEFINITION.size
+        )
+        reexports = []
+        for i in range(first, first + count):
+            reexport_module, reexport_name = _REEXPORT.unpack_from(
+                self._data, self._reexports_offset + i * _REEXPORT.size
+            )
+            reexports.append(
+                ReExport(
+                    self._string(reexport_module).decode("utf-8"),
+                    self._string(reexport_name).decode("utf-8"),
+                )
+            )
+        return SymbolDefinition(
+            self._string(module).decode("utf-8"),
+            self._string(name).decode("utf-8"),
+            tuple(reexports),
+        )
+
+    def _string(self, string: int) -> bytes:
+        offset, length = _STRING.unpack_from(
+            self._data, self._strings_offset + string * _STRING.size
+        )
+        start = self._blob_offset + offset
+        return self._data[start : start + length]
+
+
+def get_symbol_index(search_context: SearchContext, cache_dir: Path) -> SymbolIndex:
+    """Return an up-to-date symbol index for this context.
+
+    A previously saved index in ``cache_dir`` is reused if it is still fresh;
+    otherwise a new index is built and saved there.
+
+    """
+    key = _symbol_index_key(search_context)
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    path = cache_dir / f"symbol-index-{digest[:16]}.bin"
+    index = SymbolIndex.open(path)
+    if index is not None:
+        if index.key == key and not index.is_stale():
+            return index
+        index.close()
+    return build_symbol_index(path, search_context=search_context)
+
+
+def build_symbol_index(
+    output: Path,
+    *,
+    search_context: Optional[SearchContext] = None,
+    resolver: Optional[Resolver] = None,
+) -> SymbolIndex:
+    """Resolve the public names of every stub and write a symbol index to output.
+
+    The public names of a module are those in ``__all__``, or if it has no
+    ``__all__``, its exported names. Names that resolve to modules, that cannot be
+    resolved, or that come from stubs that cannot be parsed are left out.
+
+    A resolver for the context may be passed to reuse the modules it has already
+    loaded. Returns the index, mapped from output.
+
+    """
+    if resolver is None:
+        if search_context is None:
+            search_context = get_search_context()
+        resolver = Resolver(search_context)
+    elif search_context is None:
+        search_context = resolver.ctx
+
+    # (defining module, name) -> (public module, public name) pairs
+    definitions: dict[tuple[str, str], set[tuple[str, str]]] = {}
+    stamps: dict[str, list[int]] = {}
+    bundled = os.path.join(finder.find_typeshed(), "")
+    for module_name, path in finder.get_all_stub_files(search_context):
+        module_path = ModulePath(tuple(module_name.split(".")))
+        try:
+            resolved_names = resolver.resolve_all([module_path])
+        except (SyntaxError, UnicodeDecodeError, parser.InvalidStub) as e:
+            log.warning("%s: not indexing: %s", path, e)
+            continue
+        for qualified_name, resolved in resolved_names.items():
+            public_name = qualified_name[len(module_name) + 1 :]
+            if isinstance(resolved, ImportedInfo):
+                key = (".".join(resolved.source_module), resolved.info.name)
+            elif isinstance(resolved, parser.NameInfo):
+                key = (module_name, resolved.name)
+            else:
+                continue
+            definitions.setdefault(key, set()).add((module_name, public_name))
+        path_str = os.fspath(path)
+        if not path_str.startswith(bundled):
+            stamps[path_str] = list(finder._file_stamp(path) or ())
+
+    # the directories a module index scans are those in which new stubs may appear
+    module_index = finder.build_module_index(search_context)
+    metadata = {
+        "key": _symbol_index_key(search_context),
+        "stamps": stamps,
+        "directory_mtimes": module_index.directory_mtimes,
+    }
+    finder._write_atomically(output, _encode(definitions, metadata))
+    index = SymbolIndex.open(output)
+    assert index is not None, f"cannot read {output}"
+    return index
+
+
+def _encode(
+    definitions: dict[tuple[str, str], set[tuple[str, str]]], metadata: dict[str, Any]
+) -> bytes:
+    strings: dict[str, int] = {}
+
+    def intern(string: str) -> int:
+        return strings.setdefault(string, len(strings))
+
+    # name -> definitions it is the name or a public alias of
+    by_name: dict[str, set[int]] = {}
+    definition_table = bytearray()
+    reexport_table = bytearray()
+    reexport_count = 0
+    for i, ((module, name), reexports) in enumerate(sorted(definitions.items())):
+        definition_table += _DEFINITION.pack(
+            intern(name), intern(module), reexport_count, len(reexports)
+        )
+        by_name.setdefault(name, set()).add(i)
+        for reexport_module, reexport_name in sorted(reexports):
+            reexport_table += _REEXPORT.pack(
+                intern(reexport_module), intern(reexport_name)
+            )
+            reexport_count += 1
+            by_name.setdefault(reexport_name, set()).add(i)
+
+    name_table = bytearray()
+    list_table = bytearray()
+    list_count = 0
+    # an open-addressing hash table of name entries plus one, with 0 for free slots,
+    # at most half full
+    slot_count = 1
+    while slot_count < 2 * len(by_name):
+        slot_count *= 2
+    slots = [0] * slot_count
+    encoded_names = sorted(name.encode("utf-8") for name in by_name)
+    for i, encoded in enumerate(encoded_names):
+        name = encoded.decode("utf-8")
+        indexes = sorted(by_name[name])
+        name_table += _NAME.pack(intern(name), list_count, len(indexes))
+        for index in indexes:
+            list_table += _INDEX.pack(index)
+        list_count += len(indexes)
+        slot = zlib.crc32(encoded) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = i + 1
+    slot_table = struct.pack(f"<{slot_count}I", *slots)
+
+    string_table = bytearray()
+    blob = bytearray()
+    for string in strings:
+        encoded = string.encode("utf-8")
+        string_table += _STRING.pack(len(blob), len(encoded))
+        blob += encoded
+
+    metadata_bytes = json.dumps(metadata).encode("utf-8")
+    sections = [
+        (metadata_bytes, len(metadata_bytes)),
+        (string_table, len(strings)),
+        (blob, len(blob)),
+        (name_table, len(by_name)),
+        (slot_table, slot_count),
+        (list_table, list_count),
+        (definition_table, len(definitions)),
+        (reexport_table, reexport_count),
+    ]
+    header_fields: list[int] = []
+    offset = _HEADER.size
+    for section, count in sections:
+        header_fields += [offset, count]
+        offset += len(section)
+    return b"".join(
+        [
+            _HEADER.pack(_SYMBOL_INDEX_MAGIC, _SYMBOL_INDEX_FORMAT, *header_fields),
+            *(section for section, _ in sections),
+        ]
+    )
+
+
+def _symbol_index_key(search_context: SearchContext) -> dict[str, object]:
+    # unlike the module index, the names also depend on the platform
+    return {
+        **finder._module_index_key(search_context),
+        "platform": search_context.platform,
+    }
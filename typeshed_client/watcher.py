@@ -0,0 +1,400 @@
+"""Module responsible for keeping a Resolver up to date with the file system."""
+
+import abc
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from errno import ENOSPC
+from pathlib import Path
+from types import TracebackType
+from typing import Optional
+
+from . import finder
+from .finder import ModulePath
+from .resolver import Resolver
+
+# from <sys/inotify.h>
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+    | _IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Watcher:
+    """Detects changes to stub files and invalidates the affected parts of a Resolver.
+
+    The watcher observes the typeshed directory, the directories on the search
+    path, and the directories containing every stub the resolver has loaded. Call
+    ``check()`` periodically, for example before handling each request; it drops
+    the modules whose stubs changed with ``Resolver.invalidate()``, which also
+    updates the loaded modules that import names from them, directly or
+    indirectly, and returns the names of the modules that were dropped or updated.
+
+    Changes are tracked with inotify where it is available and by comparing
+    directory listings and modification times otherwise. Unless ``use_inotify`` is
+    given, polling is also used if inotify cannot be set up or runs out of watches.
+    A stub is watched from the first ``check()`` after the resolver loads it.
+
+    The bundled copy of typeshed and typeshed archives are assumed never to change.
+
+    """
+
+    def __init__(
+        self, resolver: Resolver, *, use_inotify: Optional[bool] = None
+    ) -> None:
+        self.resolver = resolver
+        ctx = resolver.ctx
+        roots = [Path(path) for path in ctx.search_path]
+        if ctx.typeshed != finder.find_typeshed() and _is_real_dir(ctx.typeshed):
+            roots += [ctx.typeshed, ctx.typeshed / "@python2"]
+        # more specific roots first, in case one is nested inside another
+        self._roots = sorted(roots, key=lambda root: len(root.parts), reverse=True)
+        # if inotify was not asked for explicitly, fall back to polling when it runs
+        # out of instances or watches, or is not permitted
+        self._can_fall_back = use_inotify is None
+        if use_inotify is None:
+            use_inotify = _InotifyBackend.is_available()
+        self._backend: _Backend = _PollingBackend()
+        if use_inotify:
+            try:
+                self._backend = _InotifyBackend()
+            except OSError:
+                if not self._can_fall_back:
+                    raise
+        self._update_watches()
+
+    def __repr__(self) -> str:
+        return f"<Watcher using {self._backend!r}>"
+
+    def __enter__(self) -> "Watcher":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop watching. The watcher cannot be used afterwards."""
+        self._backend.close()
+
+    def check(self) -> set[ModulePath]:
+        """Invalidate the modules affected by changes since the last call.
+
+        Return the names of the modules that were dropped from the resolver or whose
+        resolved names were.
+
+        """
+        changed_paths = self._backend.read_changes()
+        if changed_paths is None:
+            invalidated = self._invalidate_all()
+        else:
+            invalidated = self._invalidate_paths(changed_paths)
+        self._update_watches()
+        return invalidated
+
+    def _invalidate_paths(self, changed_paths: set[Path]) -> set[ModulePath]:
+        resolver = self.resolver
+        listing_cache = resolver.ctx.listing_cache
+        changed_modules: set[ModulePath] = set()
+        for path in changed_paths:
+            if listing_cache is not None:
+                listing_cache.invalidate(path.parent)
+                listing_cache.invalidate(path)
+            if self._is_versions_file(path):
+                return self._invalidate_all()
+            module_name = self._path_to_module(path)
+            if module_name is not None:
+                changed_modules.add(module_name)
+        if not changed_modules:
+            return set()
+
+        invalidated: set[ModulePath] = set()
+        for module_name in changed_modules:
+            invalidated |= resolver.invalidate(module_name)
+        return invalidated
+
+    def _invalidate_all(self) -> set[ModulePath]:
+        resolver = self.resolver
+        if resolver.ctx.listing_cache is not None:
+            resolver.ctx.listing_cache.invalidate()
+        # VERSIONS may have changed
+        finder.get_typeshed_versions.cache_clear()
+        finder._get_typeshed_dirs.cache_clear()
+        return resolver.invalidate_all()
+
+    def _is_versions_file(self, path: Path) -> bool:
+        ctx = self.resolver.ctx
+        return path == ctx.typeshed / "VERSIONS" and ctx.typeshed in self._roots
+
+    def _path_to_module(self, path: Path) -> Optional[ModulePath]:
+        """Return the module or package that a changed path may belong to."""
+        for root in self._roots:
+            try:
+                parts = list(path.relative_to(root).parts)
+            except ValueError:
+                continue
+            break
+        else:
+            return None
+        if not parts:
+            # the root itself
+            return ModulePath(())
+        for extension in (".pyi", ".py"):
+            if parts[-1].endswith(extension):
+                parts[-1] = parts[-1][: -len(extension)]
+                if parts[-1] == "__init__":
+                    del parts[-1]
+                break
+        if parts:
+            parts[0] = parts[0].removesuffix("-stubs")
+        # ignore temporary files, metadata, caches and the like
+        if not all(part.isidentifier() for part in parts):
+            return None
+        return ModulePath(tuple(parts))
+
+    def _update_watches(self) -> None:
+        resolver = self.resolver
+        directories = {root for root in self._roots if _is_real_dir(root)}
+        files: set[Path] = set()
+        modules = resolver.get_loaded_modules() | resolver.get_dependency_graph().keys()
+        for module_name in modules:
+            if not module_name:
+                continue
+            path = resolver.finder.find(module_name)
+            if path is None:
+                continue
+            root = next((root for root in self._roots if root in path.parents), None)
+            if root is None:
+                continue
+            files.add(path)
+            directory = path.parent
+            while directory != root and directory not in directories:
+                directories.add(directory)
+                directory = directory.parent
+        try:
+            self._backend.watch(directories, files)
+        except OSError:
+            if not self._can_fall_back:
+                raise
+            self._backend.close()
+            self._backend = _PollingBackend()
+            self._backend.watch(directories, files)
+
+
+def _is_real_dir(path: Path) -> bool:
+    # unlike finder.safe_is_dir(), this is False for paths inside an archive
+    return os.path.isdir(path)
+
+
+class _Backend(abc.ABC):
+    @abc.abstractmethod
+    def watch(self, directories: set[Path], files: set[Path]) -> None:
+        """Set the directories and files to watch.
+
+        Changes to the entries of a watched directory are reported, as are changes
+        to the contents of watched files. Raise OSError if the backend cannot watch
+        all of them.
+
+        """
+
+    @abc.abstractmethod
+    def read_changes(self) -> Optional[set[Path]]:
+        """Return the paths that changed since the last call.
+
+        Return None if changes may have been missed.
+
+        """
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Release the resources used for watching. Calling this again does nothing."""
+
+
+class _PollingBackend(_Backend):
+    """Finds changes by comparing directory listings and file modification times."""
+
+    def __init__(self) -> None:
+        self._listings: dict[Path, Optional[frozenset[str]]] = {}
+        self._stats: dict[Path, Optional[tuple[int, int]]] = {}
+
+    def __repr__(self) -> str:
+        return "<polling backend>"
+
+    def close(self) -> None:
+        self._listings = {}
+        self._stats = {}
+
+    def watch(self, directories: set[Path], files: set[Path]) -> None:
+        self._listings = {
+            directory: (
+                self._listings[directory]
+                if directory in self._listings
+                else _list_directory(directory)
+            )
+            for directory in directories
+        }
+        self._stats = {
+            file: self._stats[file] if file in self._stats else _stat_file(file)
+            for file in files
+        }
+
+    def read_changes(self) -> Optional[set[Path]]:
+        changed: set[Path] = set()
+        for directory, old_listing in self._listings.items():
+            listing = _list_directory(directory)
+            if listing == old_listing:
+                continue
+            self._listings[directory] = listing
+            if old_listing is None or listing is None:
+                changed.add(directory)
+            else:
+                changed.update(directory / name for name in listing ^ old_listing)
+        for file, old_stat in self._stats.items():
+            stat = _stat_file(file)
+            if stat != old_stat:
+                self._stats[file] = stat
+                changed.add(file)
+        return changed
+
+
+def _list_directory(directory: Path) -> Optional[frozenset[str]]:
+    try:
+        return frozenset(os.listdir(directory))
+    except OSError:
+        return None
+
+
+def _stat_file(path: Path) -> Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class _InotifyBackend(_Backend):
+    """Finds changes using the Linux inotify API."""
+
+    def __init__(self) -> None:
+        libc = _load_libc()
+        if libc is None:
+            raise OSError("inotify is not available")
+        self._libc = libc
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._fd = fd
+        self._watches: dict[Path, int] = {}
+        self._directories: dict[int, Path] = {}
+        self._overflowed = False
+
+    def __repr__(self) -> str:
+        return f"<inotify backend watching {len(self._watches)} directories>"
+
+    @staticmethod
+    def is_available() -> bool:
+        return _load_libc() is not None
+
+    def watch(self, directories: set[Path], files: set[Path]) -> None:
+        # files are covered by watching their directories
+        for directory in self._watches.keys() - directories:
+            self._libc.inotify_rm_watch(self._fd, self._watches.pop(directory))
+        for directory in directories - self._watches.keys():
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), _WATCH_MASK
+            )
+            if wd >= 0:
+                self._watches[directory] = wd
+                self._directories[wd] = directory
+                continue
+            errno = ctypes.get_errno()
+            # other errors mean that the directory is gone or cannot be read
+            if errno == ENOSPC:
+                raise OSError(errno, os.strerror(errno), os.fspath(directory))
+
+    def read_changes(self) -> Optional[set[Path]]:
+        changed: set[Path] = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    self._overflowed = True
+                    continue
+                directory = self._directories.get(wd)
+                if directory is None:
+                    continue
+                if mask & _IN_IGNORED:
+                    # the watch was removed, or the directory no longer exists
+                    del self._directories[wd]
+                    if self._watches.get(directory) == wd:
+                        del self._watches[directory]
+                    continue
+                changed.add(directory / os.fsdecode(name) if name else directory)
+        if self._overflowed:
+            self._overflowed = False
+            return None
+        return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    global _libc
+    if _libc is None and sys.platform == "linux":
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_uint32,
+            ]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        except (OSError, AttributeError):
+            return None
+        _libc = libc
+    return _libc
@@ -1,19 +1,23 @@
 #!/usr/bin/env python3
 
+import argparse
 import shutil
 import subprocess
 import tempfile
 from pathlib import Path
 
 
-def update_bundled() -> None:
+def update_bundled(*, pack: bool = False) -> None:
     ts_client = Path("typeshed_client")
     assert (
         ts_client.is_dir()
     ), "this script must be run at the root of the typeshed_client repository"
     bundled_ts_dir = ts_client / "typeshed"
+    bundled_ts_archive = ts_client / "typeshed.zip"
     if bundled_ts_dir.exists():
         shutil.rmtree(bundled_ts_dir)
+    if bundled_ts_archive.exists():
+        bundled_ts_archive.unlink()
     with tempfile.TemporaryDirectory() as temp_dir_str:
         temp_dir = Path(temp_dir_str)
         subprocess.check_call(
@@ -22,8 +26,37 @@ def update_bundled() -> None:
         )
         shutil.copytree(temp_dir / "typeshed" / "stdlib", bundled_ts_dir)
     shutil.rmtree(bundled_ts_dir / "@tests")
-    subprocess.check_call(["git", "add", str(bundled_ts_dir)])
+
+    from typeshed_client.finder import pack_typeshed
+    from typeshed_client.parser import write_symbol_tables
+
+    symbol_tables = write_symbol_tables(bundled_ts_dir)
+    subprocess.check_call(["git", "add", str(symbol_tables)])
+    if pack:
+        pack_typeshed(bundled_ts_dir, bundled_ts_archive)
+        shutil.rmtree(bundled_ts_dir)
+        subprocess.check_call(
+            [
+                "git",
+                "rm",
+                "-r",
+                "-q",
+                "--cached",
+                "--ignore-unmatch",
+                str(bundled_ts_dir),
+            ]
+        )
+        subprocess.check_call(["git", "add", str(bundled_ts_archive)])
+    else:
+        subprocess.check_call(["git", "add", str(bundled_ts_dir)])
 
 
 if __name__ == "__main__":
-    update_bundled()
+    parser = argparse.ArgumentParser(description="Update the bundled typeshed")
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="bundle typeshed as a single zip archive instead of a directory",
+    )
+    args = parser.parse_args()
+    update_bundled(pack=args.pack)